@@ -1 +1,3 @@
-from .parser import Parser
\ No newline at end of file
+from .parser import Parser
+from .cache import CompileCache
+from .incremental import IncrementalCompiler
@@ -0,0 +1,59 @@
+import hashlib
+import os
+import struct
+from VM import Program, binary
+from .parser import Parser
+
+class CompileCache:
+    """
+    Keeps compiled programs on disk, keyed by the hash of their source,
+    so unchanged programs are loaded without being parsed.
+    """
+    def __init__(self, directory:str = None) -> None:
+        self.directory = directory
+        """
+        Where compiled programs are kept, defaults to a __pasmcache__
+        directory next to each source file.
+        """
+
+    def path(self, src_path:str):
+        """
+        Where the compiled program for the source file goes, the source is
+        hashed a block at a time. The compiler's own sources are hashed in
+        too, so programs compiled before it changed are never loaded.
+        """
+        digest = hashlib.sha256()
+        with open(src_path, "rb") as srcf:
+            while block := srcf.read(1 << 20):
+                digest.update(block)
+        digest.update(binary.sources(os.path.dirname(__file__), os.path.dirname(binary.__file__)).encode())
+        directory = self.directory or os.path.join(os.path.dirname(os.path.abspath(src_path)), "__pasmcache__")
+        name = os.path.splitext(os.path.basename(src_path))[0]
+        return os.path.join(directory, f"{name}.{digest.hexdigest()[:16]}.pasmc")
+
+    def compile(self, src_path:str) -> Program:
+        """
+        Loads the compiled program for the source file, compiling it on a
+        miss. Misses are streamed from the source into the cache, so only
+        the finished program is ever held in memory.
+        """
+        path = self.path(src_path)
+        try:
+            return binary.load(path)
+        except (OSError, RuntimeError, struct.error, ValueError, IndexError):
+            pass # missing, from another version or cut short, compiled again
+
+        tmp = f"{path}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(src_path, encoding="utf-8") as srcf, open(tmp, "wb") as f:
+                Parser(srcf).stream(f)
+            os.replace(tmp, path) # other processes never see a half written file
+            return binary.load(path)
+        except OSError:
+            pass
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        with open(src_path, encoding="utf-8") as srcf:
+            return Parser(srcf.read()).compile()
@@ -0,0 +1,309 @@
+"""
+Recompiles a source after an edit by compiling only the blocks that changed.
+
+The source is cut into segments, one per BLOCK, FUNC and START plus the
+code before the first of them. Each segment's compiled code is kept keyed
+by its text and by the state the compiler was in when it got there, so a
+segment is reused whenever compiling it again could not give anything
+different. The state after a segment is told apart by the names, ids and
+registers compiling it changed, not its code, so an edit that only changes
+what a block reads or computes leaves every later segment as it was.
+"""
+
+import itertools
+import re
+from VM import BytecodeBuilder, Decoder, Program
+from VM import bytecodes as bc
+from .parser import INSTRUCTIONS, Parser
+
+BOUNDARY = re.compile(r"\n[ \t]*(?:BLOCK|FUNC|START)\b")
+"""
+The lines a new segment starts at, after their newline. Matching the
+newline is faster than a multiline ^, which is tried at every character.
+"""
+
+DECLARES = {mnemonic: tuple(i for i, kind in enumerate(signature.replace("^", ""), 1) if kind in "NDLBCF+") for mnemonic, signature in INSTRUCTIONS.items()}
+"""
+The positions of the operands of each instruction that can change what
+the compiler knows about a name, FUNC's parameters starting at the +.
+"""
+
+class Segment:
+    """The compiled code of one segment, and what compiling it changed in the compiler."""
+    def __init__(self, code:list[tuple[int, tuple]], lines:list[int], constants:list, calls:list[tuple[str, int, int]]) -> None:
+        self.code = code
+        """
+        The decoded code, NUM and STR refer to `constants`.
+        """
+        self.lines = lines
+        """
+        The line of each instruction, counted from the segment's first line.
+        """
+        self.constants = constants
+        self.placed:tuple[list[int], list[tuple[int, tuple]]] = None
+        """
+        Where the constants went in the last program the segment was part
+        of, and its code with NUM and STR referring to them there.
+        """
+        self.calls = calls
+        """
+        The CALLs in the segment, their line counted like `lines`.
+        """
+        self.opens:str = None
+        """
+        The function the segment starts, if it starts with FUNC.
+        """
+        self.depth = 0
+        """
+        How many functions are open once the segment is compiled.
+        """
+        self.names:dict[str, tuple[int, bool, bool, int]] = {}
+        """
+        The id, whether it is pending, whether it is a label and the
+        parameter count of every name the segment changed, the id being
+        None for names that are gone.
+        """
+        self.ids:dict[int, tuple[bool, int]] = {}
+        """
+        Whether it exists and its register, for every id the segment changed.
+        """
+        self.counters:tuple[int, int, int] = None
+        """
+        The last id handed out, the next free register and the size of the register file.
+        """
+        self.scopes:list[list[int]] = []
+        self.state:tuple = None
+        """
+        The state of the compiler before the segment and the changes compiling it made.
+        """
+        self.exit = 0
+        """
+        The state of the compiler once the segment is compiled.
+        """
+
+class IncrementalCompiler:
+    """
+    Compiles versions of a source one after the other, reusing the
+    compiled code of every segment an edit could not have changed.
+
+    The compiled segments of the last version are all that is kept, so a
+    compiler watching a file stays the size of one compiled program.
+    """
+    def __init__(self) -> None:
+        self.segments:dict[tuple[int, str], Segment] = {}
+        """
+        The compiled segments of the last version, keyed by the state of
+        the compiler before them and their text.
+        """
+        self.states:dict[tuple, int] = {}
+        """
+        The number of every state the compiler was in after a segment, 0
+        being the state before the first one. Two segments leave the
+        compiler in the same state when it was in the same state before
+        them and they made the same changes, which compares and hashes a
+        lot faster than the whole state.
+        """
+        self.numbers = itertools.count(1)
+        self.final:tuple[int, dict[int, str]] = None
+        """
+        The state of the compiler at the end of the last version and the
+        names of its blocks, the checks that need the whole source passed
+        for it.
+        """
+        self.compiled = 0
+        self.total = 0
+        """
+        How many segments the last version had and how many of them had to be compiled.
+        """
+        self.unwarmed:str = None
+        """
+        The last version, if it fell back to a plain compile and none of its
+        segments after the first miss are kept yet.
+        """
+
+    def split(self, src:str):
+        """Yields the text and first line of every segment of the source."""
+        starts = [match.start() + 1 for match in BOUNDARY.finditer(src)]
+        if not starts or starts[0] != 0:
+            starts.insert(0, 0)
+        starts.append(len(src))
+        line = 1
+        for begin, end in zip(starts, starts[1:]):
+            text = src[begin:end]
+            yield text, line
+            line += text.count("\n")
+
+    def compile(self, src:str, fallback:bool = True) -> Program:
+        """
+        Compiles the source, the same program Parser(src).compile() gives.
+
+        Compiling a segment on its own costs a few times what it does as part
+        of a plain compile, so with fallback, once every segment left is
+        sure to miss and that is most of them, the source is compiled plainly
+        instead. Its segments are only kept once warm() is called.
+        """
+        parser = Parser("")
+        BB = BytecodeBuilder()
+        decoder = Decoder(BB.src)
+        segments:dict[tuple[int, str], Segment] = {}
+        plan:list[tuple[Segment, int]] = []
+        replayed = 0 # how many segments of plan the compiler is caught up with
+        state = 0
+        self.compiled = 0
+        parts = list(self.split(src))
+        starts = {entry for entry, _ in self.segments}
+        for n, (text, first) in enumerate(parts):
+            key = (state, text)
+            segment = self.segments.get(key) or segments.get(key)
+            if segment is None:
+                # no kept segment starts in this state, so neither this one nor any after it can be reused
+                if fallback and state not in starts and self.compiled + len(parts) - n > len(parts) // 2:
+                    program = Parser(src).compile()
+                    self.compiled = self.total = len(parts)
+                    self.final = None
+                    self.unwarmed = src
+                    return program
+                for done, _ in plan[replayed:]:
+                    self.replay(done, parser, BB, decoder)
+                segment = self.compile_segment(text, first, state, parser, BB, decoder)
+                replayed = len(plan) + 1
+                self.compiled += 1
+            segments[key] = segment
+            plan.append((segment, first))
+            state = segment.exit
+        self.total = len(plan)
+        if len(self.states) > 2 * len(segments) + 1024:
+            # only the states the segments being kept are in can come up again
+            self.states = {segment.state: segment.exit for segment in segments.values()}
+
+        if self.final is None or self.final[0] != state:
+            for done, _ in plan[replayed:]:
+                self.replay(done, parser, BB, decoder)
+            parser.calls = [(name, count, line + first) for segment, first in plan for name, count, line in segment.calls]
+            self.segments = segments
+            parser.check()
+            final = None
+        else:
+            self.segments = segments
+            final = self.final
+
+        program = self.assemble(plan)
+        if final is None:
+            final = (state, {id: name for name, id in parser.vars.items() if id in program.blocks})
+        self.final = final
+        program.names = dict(final[1])
+        self.unwarmed = None
+        return program
+
+    def warm(self):
+        """
+        Compiles the last version segment by segment if it fell back to a
+        plain compile, so the next version can reuse its segments. Meant for
+        when the caller would be idle anyway, like waiting on the next edit.
+        """
+        if self.unwarmed is not None:
+            compiled, total = self.compiled, self.total
+            self.compile(self.unwarmed, fallback=False)
+            self.compiled, self.total = compiled, total
+
+    def compile_segment(self, text:str, first:int, entry:int, parser:Parser, BB:BytecodeBuilder, decoder:Decoder):
+        """Compiles a segment with the compiler in the state it is in before it, leaving it in the state after it."""
+        tokens = list(Parser(text).instructions(first))
+        touched = set()
+        for _, parts in tokens:
+            if parts[0] == "FUNC":
+                touched.update(parts[1:])
+            elif parts[0] == "END_FUNC":
+                touched.update(parser.vars) # the function's variables go, wherever they were declared
+            else:
+                for i in DECLARES.get(parts[0], ()):
+                    if i < len(parts):
+                        touched.add(parts[i])
+        state = lambda name: (parser.vars.get(name), name in parser.pending, name in parser.labels, parser.params.get(name))
+        before = {name: state(name) for name in touched}
+        ids = {id for id, *_ in before.values() if id is not None}
+        entry_id = BB._current_id
+
+        BB.src = bc.ByteCode(BB) # every segment has a constant pool of its own
+        BB.constant_ids = {}
+        parser.calls = []
+        parser.emit_part(tokens, BB)
+        code, lines = decoder.feed(BB.src.bytecode, BB.src.lines)
+
+        segment = Segment(code, [line - first for line in lines], BB.src.constants,
+            [(name, count, line - first) for name, count, line in parser.calls])
+        if tokens and tokens[0][1][0] == "FUNC":
+            segment.opens = tokens[0][1][1]
+        segment.depth = len(parser.functions)
+        for name, old in before.items():
+            new = state(name)
+            if new != old:
+                segment.names[name] = new
+                if new[0] is not None:
+                    ids.add(new[0])
+        ids.update(range(entry_id + 1, BB._current_id + 1))
+        segment.ids = {id: (id in BB.existing_ids, decoder.slots.get(id)) for id in sorted(ids)}
+        segment.counters = (BB._current_id, decoder.free, decoder.registers)
+        segment.scopes = [list(scope) for scope in decoder.scopes]
+        # the calls are part of the state, they are only checked at the end
+        segment.state = (entry, segment.opens, segment.depth, tuple(sorted(segment.names.items())), tuple(segment.ids.items()),
+            segment.counters, tuple(map(tuple, segment.scopes)), tuple((name, count) for name, count, _ in segment.calls))
+        if segment.state not in self.states:
+            self.states[segment.state] = next(self.numbers)
+        segment.exit = self.states[segment.state]
+        return segment
+
+    def replay(self, segment:Segment, parser:Parser, BB:BytecodeBuilder, decoder:Decoder):
+        """Brings the compiler to the state after a segment, without compiling it again."""
+        if segment.opens is not None:
+            parser.functions.append((segment.opens, dict(parser.vars)))
+        del parser.functions[segment.depth:]
+        for name, (id, pending, label, params) in segment.names.items():
+            if id is None:
+                parser.vars.pop(name, None)
+            else:
+                parser.vars[name] = id
+            if pending:
+                parser.pending.add(name)
+            else:
+                parser.pending.discard(name)
+            if label:
+                parser.labels.add(name)
+            if params is not None:
+                parser.params[name] = params
+        for id, (exists, slot) in segment.ids.items():
+            if exists:
+                BB.existing_ids.add(id)
+            else:
+                BB.existing_ids.discard(id)
+            if slot is not None:
+                decoder.slots[id] = slot
+        BB._current_id, decoder.free, decoder.registers = segment.counters
+        decoder.scopes = [list(scope) for scope in segment.scopes]
+
+    def assemble(self, plan:list[tuple[Segment, int]]):
+        """Puts the program together from its segments, merging their constant pools and relinking the blocks."""
+        code:list[tuple[int, tuple]] = []
+        lines:list[int] = []
+        constants:list = []
+        constant_ids:dict[tuple[type, int | float | str], int] = {}
+        for segment, first in plan:
+            if segment.constants:
+                remap = []
+                for value in segment.constants:
+                    key = (type(value), value)
+                    if key not in constant_ids:
+                        constant_ids[key] = len(constants)
+                        constants.append(value)
+                    remap.append(constant_ids[key])
+                if segment.placed is None or segment.placed[0] != remap:
+                    segment.placed = (remap, [(op, (operands[0], remap[operands[1]])) if op in (bc.NUM, bc.STR) else (op, operands)
+                        for op, operands in segment.code])
+                code += segment.placed[1]
+            else:
+                code += segment.code
+            lines += [line + first for line in segment.lines]
+        registers = plan[-1][0].counters[2] if plan else 0
+        program = Program(code, {}, 0, registers, constants, lines)
+        program.link()
+        return program
@@ -1,180 +1,323 @@
-from typing import Iterable
-from VM import BytecodeBuilder, Executor
+import re
+from typing import BinaryIO, Iterable, TextIO
+from VM import BytecodeBuilder, Decoder, Executor, binary
+
+TOKEN = re.compile(r'"([^"\\]*(?:\\.[^"\\]*)*)"|([^\s"]+)|(")')
+"""
+A string literal, a bare word, or a quote that never ends. The literal's
+loop is unrolled, `(?:[^"\\]|\\.)*` keeps backtracking state for every
+character, which is hundreds of bytes per character of a long string.
+"""
+
+ESCAPE = re.compile(r"\\(.)")
+ESCAPES = {"n": "\n", "t": "\t"}
+"""
+Escapes other than these stand for the escaped character itself, like \\" and \\\\.
+"""
+
+INSTRUCTIONS = {
+    "ALLOCA": "N",
+    "DEL": "F",
+    "STORE": "RR",
+    "NUM": "N#",
+    "STR": "N$",
+    "FMT_NUM": "NRR",
+    "STDIN": "N",
+    "CAST_NUM": "DR",
+    "CAST_STR": "DR",
+    **{op: "DRR" for op in ("EQ", "NEQ", "GT", "LT", "LTE", "GTE", "ADD", "SUB", "MUL", "DIV", "EXP", "MOD")},
+    "FMT": "DR*",
+    **{op: "DR" for op in ("ARRAY", "LOAD", "LEN", "SUM", "MIN", "MAX", "MEAN")},
+    **{op: "DRR" for op in ("FILL", "RANGE", "INDEX")},
+    "SLICE": "DRRR",
+    "STDOUT": "R",
+    "BLOCK": "L",
+    "JUMP": "B",
+    "START": "",
+    "COND_JUMP": "BR",
+    "FUNC": "L+",
+    "END_FUNC": "^",
+    "CALL": "DC*",
+    "RET": "R",
+    "CHAN": "NR",
+    "SPAWN": "DB",
+    "SEND": "RR",
+    "RECV": "DR",
+    "JOIN": "DR",
+}
+"""
+The operands of every instruction, one character each, which is all the
+parser needs to know to emit it through the builder's write_ method:
+
+N   a variable the instruction declares, it gets a new register
+D   a variable the instruction writes, declared if it does not exist yet
+L   a block the instruction declares
+R   a variable the instruction reads
+*   any number of variables it reads, passed as a list
+F   a variable the instruction frees, it is gone afterwards
+#   a number
+$   a string literal
+B   a block the instruction jumps to
++   the parameters of the function the instruction declares, any number of them
+^   the function the instruction ends, its variables are gone afterwards, not written in the source
+C   a function the instruction calls, with the rest of the operands as arguments
+
+N, D and L come first. Everything else is passed to the write_ method in order.
+"""
+
+OPERANDS = {
+    "R": "variables[parts[{i}]]",
+    "*": "[variables[item] for item in parts[{i}:]]",
+    "#": "parser._parse_num(parts[{i}])",
+    "$": "parts[{i}]",
+    "B": "parser.block(BB, parts[{i}])",
+    "F": "variables.pop(parts[{i}])",
+    "+": "parser.function(BB, parts[1], parts[{i}:])",
+    "^": "parser.end_function()",
+    "C": "parser.call(BB, parts[{i}], len(parts) - {i} - 1)",
+}
+"""
+The Python expression each kind of operand is passed to the write_ method
+as, parts[{i}] being the operand.
+"""
+
+def _emitter(signature:str):
+    """Generates the function that emits an instruction with the signature, see INSTRUCTIONS."""
+    target = signature[0] if signature[:1] in ("N", "D", "L") else None
+    offset = 2 if target else 1 # parts[0] is the mnemonic
+    args = ", ".join(OPERANDS[kind].format(i=i) for i, kind in enumerate(signature[offset - 1:], offset))
+    match target:
+        case "N":
+            body = [f"variables[parts[1]] = write({args})"]
+        case "D":
+            body = [
+                "if parts[1] in variables:",
+                f"    write({args}{', ' if args else ''}variables[parts[1]])",
+                "else:",
+                f"    variables[parts[1]] = write({args})",
+            ]
+        case "L":
+            body = [
+                "parser.labels.add(parts[1])",
+                "if parts[1] in parser.pending:",
+                "    parser.pending.remove(parts[1])",
+                f"    write({args}{', ' if args else ''}variables[parts[1]])",
+                "else:",
+                f"    variables[parts[1]] = write({args})",
+            ]
+        case _:
+            body = [f"write({args})"]
+    namespace = {}
+    exec("\n".join(["def emit(parser, variables, BB, write, parts):", *(f"    {line}" for line in body)]), namespace)
+    return namespace["emit"]
+
+EMITTERS = {signature: _emitter(signature) for signature in set(INSTRUCTIONS.values())}
 
 class Parser:
-    def __init__(self, src:str) -> None:
+    def __init__(self, src:str | TextIO) -> None:
         self.src = src
+        """
+        The source, or a file it is read from one line at a time.
+        """
         self.vars:dict[str, int] = {}
+        self.pending:set[str] = set()
+        """
+        The blocks jumped to before they were created, their id is handed
+        out by the first jump and taken by the BLOCK.
+        """
+        self.labels:set[str] = set()
+        """
+        The blocks and functions declared so far, which outlive the function they are declared in.
+        """
+        self.functions:list[tuple[str, dict[str, int]]] = []
+        """
+        The functions being declared, innermost last, along with the variables from outside them.
+        """
+        self.params:dict[str, int] = {}
+        """
+        How many parameters each function takes.
+        """
+        self.calls:list[tuple[str, int, int]] = []
+        """
+        The function, argument count and line of every CALL, checked once every function is declared.
+        """
+        self.writers:dict[str, tuple] = {}
+        self.builder:BytecodeBuilder = None
+        """
+        The builder `writers` holds the write_ method, emitter, size and
+        signature of every instruction emitted so far for.
+        """
 
     def parse_instr(self, instr:str):
-        instr:Iterable[str] = iter(instr)
-        str_buff = ""
-        ret_inst:list[str] = []
-        for c in instr:
-            match c:
-                case "\"":
-                    ret_inst.append(self._parse_str(instr))
-                case " " | "\t" | "\r" | "\n":
-                    ret_inst.append(str_buff)
-                    str_buff = ""
-                case _:
-                    str_buff += c
-        if str_buff != "":
-            ret_inst.append(str_buff)
-            str_buff = ""
-        return ret_inst
-
-
-    def _parse_str(self, instr:Iterable[str]):
-        escape = False
-        string = ""
-        for c in instr:
-            match c:
-                case "\\":
-                    escape = True
-                case "\"":
-                    if escape:
-                        string += "\""
-                        escape = False
-                    else:
-                        return string
-                case "n":
-                    if escape:
-                        string += "\n"
-                        escape = False
-                    else:
-                        string += "n"
-                case "t":
-                    if escape:
-                        string += "\t"
-                        escape = False
-                    else:
-                        string += "t"
-                case _:
-                    string += c
+        """Splits an instruction into its mnemonic and operands, string literals already unescaped."""
+        if "\"" not in instr:
+            return instr.split()
+        parts:list[str] = []
+        for string, word, unterminated in TOKEN.findall(instr):
+            if unterminated:
+                raise RuntimeError(f"Unterminated string in `{instr}`")
+            parts.append(word or self._parse_str(string))
+        return parts
 
+    def _parse_num(self, num:str):
+        try:
+            return int(num)
+        except ValueError:
+            pass
+        try:
+            return float(num)
+        except ValueError:
+            raise RuntimeError(f"{num} is not a number") from None
 
+    def _parse_str(self, string:str):
+        if "\\" not in string:
+            return string
+        return ESCAPE.sub(lambda match: ESCAPES.get(match[1], match[1]), string)
 
+    def block(self, BB:BytecodeBuilder, name:str):
+        """The id of the block a jump goes to, handing one out if the block does not exist yet."""
+        if name not in self.vars:
+            self.vars[name] = BB.current_id
+            self.pending.add(name)
+        return self.vars[name]
 
-    def run(self):
-        instructions = self.src.splitlines()
-        BB = BytecodeBuilder()
-        for instr in instructions:
+    def function(self, BB:BytecodeBuilder, name:str, params:list[str]):
+        """Opens the scope of a function, returning the ids of its parameters."""
+        self.functions.append((name, dict(self.vars)))
+        self.params[name] = len(params)
+        ids = []
+        for param in params:
+            self.vars[param] = BB.current_id
+            ids.append(self.vars[param])
+        return ids
+
+    def end_function(self):
+        """Closes the innermost function's scope, returning its id. Variables from outside it that it shadowed come back."""
+        if not self.functions:
+            raise RuntimeError("END_FUNC without a FUNC")
+        name, outer = self.functions.pop()
+        for var in list(self.vars):
+            if var in self.labels or var in self.pending:
+                continue
+            if var in outer:
+                self.vars[var] = outer[var]
+            else:
+                del self.vars[var]
+        return self.vars[name]
+
+    def call(self, BB:BytecodeBuilder, name:str, count:int):
+        self.calls.append((name, count, BB.line))
+        return self.block(BB, name)
+
+    def instructions(self, first:int = 1):
+        """Yields the parts of each instruction along with its line, as the source is read, first being the source's first line."""
+        parse_instr = self.parse_instr
+        for line, instr in enumerate(self.src.splitlines() if isinstance(self.src, str) else self.src, first):
             instr = instr.strip()
-            if instr == "" or instr.startswith("#"):
+            if instr == "" or instr[0] == "#":
                 continue
-            instr_prts = self.parse_instr(instr)
-            match instr_prts[0]:
-                case "ALLOCA":
-                    self.vars[instr_prts[1]] = BB.write_ALLOCA()
-                case "STORE":
-                    BB.write_STORE(self.vars[instr_prts[1]], self.vars[instr_prts[2]])
-                case "NUM":
-                    self.vars[instr_prts[1]] = BB.write_NUM(int(instr_prts[2]))
-                case "CAST_NUM":
-                    if instr_prts[1] not in self.vars.keys():
-                        self.vars[instr_prts[1]] = BB.write_CAST_NUM(self.vars[instr_prts[2]])
-                    else:
-                        BB.write_CAST_NUM(self.vars[instr_prts[2]], self.vars[instr_prts[1]])
-                case "FMT_NUM":
-                    self.vars[instr_prts[1]] = BB.write_FMT_NUM(self.vars[instr_prts[2]], self.vars[instr_prts[3]])
-                case "STR":
-                    self.vars[instr_prts[1]] = BB.write_STR(str(instr_prts[2]))
-                case "CAST_STR":
-                    if instr_prts[1] not in self.vars.keys():
-                        self.vars[instr_prts[1]] = BB.write_CAST_STR(self.vars[instr_prts[2]])
-                    else:
-                        BB.write_CAST_STR(self.vars[instr_prts[2]], self.vars[instr_prts[1]])
-                case "EQ":
-                    if instr_prts[1] not in self.vars.keys():
-                        self.vars[instr_prts[1]] = BB.write_EQ(self.vars[instr_prts[2]], self.vars[instr_prts[3]])
-                    else:
-                        BB.write_EQ(self.vars[instr_prts[2]], self.vars[instr_prts[3]], self.vars[instr_prts[1]])
-                case "NEQ":
-                    if instr_prts[1] not in self.vars.keys():
-                        self.vars[instr_prts[1]] = BB.write_NEQ(self.vars[instr_prts[2]], self.vars[instr_prts[3]])
-                    else:
-                        BB.write_NEQ(self.vars[instr_prts[2]], self.vars[instr_prts[3]], self.vars[instr_prts[1]])
-                case "GT":
-                    if instr_prts[1] not in self.vars.keys():
-                        self.vars[instr_prts[1]] = BB.write_GT(self.vars[instr_prts[2]], self.vars[instr_prts[3]])
-                    else:
-                        BB.write_GT(self.vars[instr_prts[2]], self.vars[instr_prts[3]], self.vars[instr_prts[1]])
-                case "LT":
-                    if instr_prts[1] not in self.vars.keys():
-                        self.vars[instr_prts[1]] = BB.write_LT(self.vars[instr_prts[2]], self.vars[instr_prts[3]])
-                    else:
-                        BB.write_LT(self.vars[instr_prts[2]], self.vars[instr_prts[3]], self.vars[instr_prts[1]])
-                case "LTE":
-                    if instr_prts[1] not in self.vars.keys():
-                        self.vars[instr_prts[1]] = BB.write_LTE(self.vars[instr_prts[2]], self.vars[instr_prts[3]])
-                    else:
-                        BB.write_LTE(self.vars[instr_prts[2]], self.vars[instr_prts[3]], self.vars[instr_prts[1]])
-                case "GTE":
-                    if instr_prts[1] not in self.vars.keys():
-                        self.vars[instr_prts[1]] = BB.write_GTE(self.vars[instr_prts[2]], self.vars[instr_prts[3]])
-                    else:
-                        BB.write_GTE(self.vars[instr_prts[2]], self.vars[instr_prts[3]], self.vars[instr_prts[1]])
-                case "ADD":
-                    if instr_prts[1] not in self.vars.keys():
-                        self.vars[instr_prts[1]] = BB.write_ADD(self.vars[instr_prts[2]], self.vars[instr_prts[3]])
-                    else:
-                        BB.write_ADD(self.vars[instr_prts[2]], self.vars[instr_prts[3]], self.vars[instr_prts[1]])
-                case "SUB":
-                    if instr_prts[1] not in self.vars.keys():
-                        self.vars[instr_prts[1]] = BB.write_SUB(self.vars[instr_prts[2]], self.vars[instr_prts[3]])
-                    else:
-                        BB.write_SUB(self.vars[instr_prts[2]], self.vars[instr_prts[3]], self.vars[instr_prts[1]])
-                case "MUL":
-                    if instr_prts[1] not in self.vars.keys():
-                        self.vars[instr_prts[1]] = BB.write_MUL(self.vars[instr_prts[2]], self.vars[instr_prts[3]])
-                    else:
-                        BB.write_MUL(self.vars[instr_prts[2]], self.vars[instr_prts[3]], self.vars[instr_prts[1]])
-                case "DIV":
-                    if instr_prts[1] not in self.vars.keys():
-                        self.vars[instr_prts[1]] = BB.write_DIV(self.vars[instr_prts[2]], self.vars[instr_prts[3]])
-                    else:
-                        BB.write_DIV(self.vars[instr_prts[2]], self.vars[instr_prts[3]], self.vars[instr_prts[1]])
-                case "EXP":
-                    if instr_prts[1] not in self.vars.keys():
-                        self.vars[instr_prts[1]] = BB.write_EXP(self.vars[instr_prts[2]], self.vars[instr_prts[3]])
-                    else:
-                        BB.write_EXP(self.vars[instr_prts[2]], self.vars[instr_prts[3]], self.vars[instr_prts[1]])
-                case "MOD":
-                    if instr_prts[1] not in self.vars.keys():
-                        self.vars[instr_prts[1]] = BB.write_MOD(self.vars[instr_prts[2]], self.vars[instr_prts[3]])
-                    else:
-                        BB.write_MOD(self.vars[instr_prts[2]], self.vars[instr_prts[3]], self.vars[instr_prts[1]])
-                case "FMT":
-                    if instr_prts[1] not in self.vars.keys():
-                        self.vars[instr_prts[1]] = BB.write_FMT(self.vars[instr_prts[2]], [self.vars[arg] for arg in instr_prts[3:]])
-                    else:
-                        BB.write_FMT(self.vars[instr_prts[2]], [self.vars[arg] for arg in instr_prts[3:]], self.vars[instr_prts[1]])
-                case "STDOUT":
-                    BB.write_STDOUT(self.vars[instr_prts[1]])
-                case "STDIN":
-                    self.vars[instr_prts[1]] = BB.write_STDIN()
-                case "BLOCK":
-                    self.vars[instr_prts[1]] = BB.write_BLOCK()
-                case "JUMP":
-                    if instr_prts[1] in self.vars.keys():
-                        BB.write_JUMP(self.vars[instr_prts[1]])
-                    else:
-                        BB.write_JUMP((instr_prts[1],)) # blocks that havent been created yet are wrapped in tuples
-                case "START":
-                    BB.write_START()
-                case "COND_JUMP":
-                    
-                    if instr_prts[1] in self.vars.keys():
-                        BB.write_COND_JUMP(self.vars[instr_prts[1]], self.vars[instr_prts[2]])
-                    else:
-                        BB.write_COND_JUMP((instr_prts[1],), self.vars[instr_prts[2]]) # blocks that havent been created yet are wrapped in tuples
-        
-        # substitute the jumps:
-        for i in range(len(BB.src)):
-            if isinstance(BB.src[i], tuple):
-                BB.src[i] = self.vars[BB.src[i][0]]
-        
-        EXEC = Executor(BB.src)
+            try:
+                parts = parse_instr(instr)
+            except RuntimeError as e:
+                raise RuntimeError(f"{e.args[0]} on line {line}.") from None
+            yield line, parts
+
+    def tokenize(self):
+        """Splits the source into the parts of each instruction, along with its line."""
+        return list(self.instructions())
+
+    def build(self):
+        """
+        Emits the bytecode for the source, each instruction as soon as it is
+        split, so the tokens of a big source never pile up for the garbage
+        collector to walk through.
+        """
+        return self.emit(self.instructions())
+
+    def emit(self, tokens:Iterable[tuple[int, list[str]]], BB:BytecodeBuilder = None):
+        """Emits the bytecode for the tokenized source."""
+        BB = self.emit_part(tokens, BB)
+        self.check()
+        return BB
+
+    def emit_part(self, tokens:Iterable[tuple[int, list[str]]], BB:BytecodeBuilder = None):
+        """Emits the bytecode for part of the tokenized source, without the checks that need all of it."""
+        BB = BytecodeBuilder() if BB is None else BB
+        if BB is not self.builder:
+            self.writers, self.builder = {}, BB
+        variables = self.vars
+        writers = self.writers
+        for line, parts in tokens:
+            BB.line = line
+            if parts[0] not in writers:
+                if parts[0] not in INSTRUCTIONS:
+                    raise RuntimeError(f"Unknown instruction {parts[0]} on line {line}.")
+                signature = INSTRUCTIONS[parts[0]]
+                size = sum(kind != "^" for kind in signature) + 1 # ^ is not written in the source
+                writers[parts[0]] = (getattr(BB, f"write_{parts[0]}"), EMITTERS[signature], size, signature)
+            write, emit, size, signature = writers[parts[0]]
+            if len(parts) != size:
+                if signature[-1:] not in ("*", "+"):
+                    raise RuntimeError(f"{parts[0]} takes {size - 1} operands, not {len(parts) - 1}, on line {line}.")
+                if len(parts) < size - 1:
+                    raise RuntimeError(f"{parts[0]} takes at least {size - 2} operands, not {len(parts) - 1}, on line {line}.")
+            try:
+                emit(self, variables, BB, write, parts)
+            except KeyError as e:
+                raise RuntimeError(f"{e.args[0]} is used on line {line} before it is declared.") from None
+            except RuntimeError as e:
+                raise RuntimeError(f"{e.args[0]} on line {line}.") from None
+        return BB
+
+    def check(self):
+        """Checks what can only be checked once the whole source is emitted."""
+        if self.pending:
+            raise RuntimeError(f"Jumps to blocks that do not exist: {', '.join(sorted(self.pending))}.")
+        if self.functions:
+            raise RuntimeError(f"Functions without an END_FUNC: {', '.join(name for name, _ in self.functions)}.")
+        for name, count, line in self.calls:
+            if name not in self.params:
+                raise RuntimeError(f"CALL of {name}, which is not a function, on line {line}.")
+            if count != self.params[name]:
+                raise RuntimeError(f"{name} takes {self.params[name]} arguments, not {count}, on line {line}.")
+
+    def stream(self, f:BinaryIO, chunk:int = 1 << 16):
+        """
+        Compiles the source straight into the compiled program format in f.
+
+        Every time the bytecode passes chunk words it is decoded, written
+        out and dropped, so with a file as the source, memory only grows
+        with the variables, blocks and constants of the program and never
+        with its length.
+        """
+        BB = BytecodeBuilder()
+        decoder = Decoder(BB.src)
+        writer = binary.Writer(f)
+
+        def flush():
+            writer.write(*decoder.feed(BB.src.bytecode, BB.src.lines))
+            BB.src.clear()
+
+        def instructions():
+            # emit asks for the next instruction once the last one is written, which is when a chunk can go
+            for instr in self.instructions():
+                if len(BB.src.bytecode) >= chunk:
+                    flush()
+                yield instr
+
+        self.emit(instructions(), BB)
+        flush()
+        names = {id: name for name, id in self.vars.items() if id in decoder.blocks}
+        start = decoder.count if decoder.start is None else decoder.start
+        writer.close(start, decoder.registers, BB.src.constants, decoder.blocks, names)
+
+    def compile(self):
+        """Compiles the source into a decoded program."""
+        program = Decoder(self.build().src).decode()
+        program.names = {id: name for name, id in self.vars.items() if id in program.blocks}
+        return program
+
+    def run(self):
+        EXEC = Executor(self.compile())
 
         EXEC.run({})
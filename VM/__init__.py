@@ -1,2 +1,13 @@
 from .bytecodes import BytecodeBuilder
-from .executor import Executor
\ No newline at end of file
+from .decoder import Decoder, Program
+from .channels import Input, Output
+from .executor import Executor
+from .adaptive import AdaptiveExecutor
+from .tracing import TracingExecutor
+from .batch import BatchExecutor
+from .scheduler import Scheduler
+from .codegen import CompiledExecutor
+from .cfg import CFG
+from .profiler import Profiler
+from .optimizer import Optimizer
+from . import binary
\ No newline at end of file
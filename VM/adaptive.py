@@ -0,0 +1,168 @@
+from . import bytecodes as bc
+from .decoder import Program
+from .executor import Executor
+from .channels import Input, Output
+from .rope import Rope
+
+BINARY = {
+    "ADD_NUM_NUM": (bc.ADD, float, float, "a + b"),
+    "ADD_STR_STR": (bc.ADD, str, str, "a + b if len(a) < Rope.MIN_LENGTH else Rope(a) + b"),
+    "ADD_ROPE_STR": (bc.ADD, Rope, str, "a + b"),
+    "SUB_NUM_NUM": (bc.SUB, float, float, "a - b"),
+    "MUL_NUM_NUM": (bc.MUL, float, float, "a * b"),
+    "DIV_NUM_NUM": (bc.DIV, float, float, "a / b"),
+    "MOD_NUM_NUM": (bc.MOD, float, float, "a % b"),
+    "EXP_NUM_NUM": (bc.EXP, float, float, "a ** b"),
+    "EQ_NUM": (bc.EQ, float, float, "a == b"),
+    "EQ_STR": (bc.EQ, str, str, "a == b"),
+    "NEQ_NUM": (bc.NEQ, float, float, "a != b"),
+    "NEQ_STR": (bc.NEQ, str, str, "a != b"),
+    "GT_NUM": (bc.GT, float, float, "a > b"),
+    "LT_NUM": (bc.LT, float, float, "a < b"),
+    "GTE_NUM": (bc.GTE, float, float, "a >= b"),
+    "LTE_NUM": (bc.LTE, float, float, "a <= b"),
+}
+"""
+Specialized variants of the binary instructions, keyed by name, as the
+instruction they specialize, the operand types they guard on and the
+expression they compute.
+"""
+
+UNARY = {
+    "CAST_NUM_STR": (bc.CAST_NUM, str, "float(a)"),
+    "CAST_NUM_NUM": (bc.CAST_NUM, float, "a"),
+    "CAST_STR_NUM": (bc.CAST_STR, float, "str(a)"),
+    "CAST_STR_STR": (bc.CAST_STR, str, "a"),
+}
+
+BINARY_TEMPLATE = """
+def make(regs, dst, lhs, rhs, miss):
+    def {name}():
+        a = regs[lhs]
+        b = regs[rhs]
+        if type(a) is {lhs} and type(b) is {rhs}:
+            regs[dst] = {expr}
+        else:
+            miss()
+    return {name}
+"""
+
+UNARY_TEMPLATE = """
+def make(regs, dst, src, miss):
+    def {name}():
+        a = regs[src]
+        if type(a) is {src}:
+            regs[dst] = {expr}
+        else:
+            miss()
+    return {name}
+"""
+
+COND_JUMP_TEMPLATE = """
+def make(regs, target, cond, miss):
+    def COND_JUMP_BOOL():
+        c = regs[cond]
+        if c is True:
+            return target
+        if c is not False:
+            return miss()
+    return COND_JUMP_BOOL
+"""
+
+def _factory(template:str, **fields):
+    namespace = {"Rope": Rope}
+    exec(template.format(**fields), namespace)
+    return namespace["make"]
+
+SPECIALIZE:dict[tuple, tuple] = {}
+"""
+Each (instruction, operand types...) is associated with the
+name and factory of its specialized variant.
+"""
+for name, (op, lhs, rhs, expr) in BINARY.items():
+    SPECIALIZE[op, lhs, rhs] = (name, _factory(BINARY_TEMPLATE, name=name, lhs=lhs.__name__, rhs=rhs.__name__, expr=expr))
+for name, (op, src, expr) in UNARY.items():
+    SPECIALIZE[op, src] = (name, _factory(UNARY_TEMPLATE, name=name, src=src.__name__, expr=expr))
+SPECIALIZE[bc.COND_JUMP, bool] = ("COND_JUMP_BOOL", _factory(COND_JUMP_TEMPLATE))
+
+ADAPTIVE = {op for op, *_ in SPECIALIZE}
+"""
+The instructions that start out adaptive.
+"""
+
+class AdaptiveExecutor(Executor):
+    """
+    Runs the supplied bytecode, rewriting generic instructions in place
+    into variants specialized on the operand types they have seen.
+
+    A specialized instruction guards on its operand types and falls back
+    to the generic instruction when the guard fails, it is specialized
+    again after warming up, until it has failed too often.
+    """
+
+    WARMUP = 2
+    """
+    How often an adaptive instruction runs before it is specialized.
+    """
+    MAX_MISSES = 4
+    """
+    How often a specialized instruction can fail its guard before it stays generic.
+    """
+
+    def __init__(self, bytecode:bc.ByteCode | Program, stdin:Input = None, stdout:Output = None) -> None:
+        super().__init__(bytecode, stdin, stdout)
+        self.stats:dict[str, int] = {}
+        """
+        How often each specialized variant was installed, and how often
+        one had to fall back (as "miss").
+        """
+
+    def bind(self, program:Program):
+        code = super().bind(program)
+        self.generic = list(code)
+        """
+        The generic handler of each instruction, which adaptive and
+        specialized instructions fall back to.
+        """
+        self.counters = [0] * len(code)
+        self.misses = [0] * len(code)
+        for i, (op, _) in enumerate(program.code):
+            if op in ADAPTIVE:
+                code[i] = (self._adaptive, (i,))
+        return code
+
+    def _adaptive(self, i):
+        handler, operands = self.generic[i]
+        target = handler(*operands)
+        self.counters[i] += 1
+        if self.counters[i] >= self.WARMUP:
+            self.specialize(i)
+        return target
+
+    def specialize(self, i:int):
+        op, operands = self.program.code[i]
+        regs = self.regs
+        miss = lambda: self.miss(i)
+        if op == bc.COND_JUMP:
+            key = (op, type(regs[operands[1]]))
+            args = (self.generic[i][1][0], operands[1])
+        else:
+            key = (op, *[type(regs[reg]) for reg in operands[1:]])
+            args = operands
+        if key not in SPECIALIZE:
+            self.code[i] = self.generic[i] # the types it sees have no variant
+            return
+        name, make = SPECIALIZE[key]
+        self.code[i] = (make(regs, *args, miss), ())
+        self.stats[name] = self.stats.get(name, 0) + 1
+
+    def miss(self, i:int):
+        self.stats["miss"] = self.stats.get("miss", 0) + 1
+        self.misses[i] += 1
+        self.counters[i] = 0
+        if self.misses[i] >= self.MAX_MISSES:
+            self.code[i] = self.generic[i]
+        else:
+            self.code[i] = (self._adaptive, (i,))
+        handler, operands = self.generic[i]
+        return handler(*operands)
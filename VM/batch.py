@@ -0,0 +1,267 @@
+import operator
+import numpy as np
+from . import bytecodes as bc
+from .decoder import Decoder, Program
+from .executor import Executor, format_num
+from .channels import Input, Output
+
+class BatchExecutor(Executor):
+    """
+    Runs one program over many inputs at once, in lock step.
+
+    Every register holds a column with one value per lane, so each
+    instruction is dispatched once for all of the lanes it runs on.
+    Lanes that take different sides of a COND_JUMP each get their own
+    program counter, the lanes furthest behind always run next (masking
+    out the others) so they meet again where the paths join.
+    """
+
+    UNSUPPORTED = {bc.ARRAY, bc.FILL, bc.RANGE, bc.LOAD, bc.INDEX, bc.SLICE, bc.LEN, bc.SUM, bc.MIN, bc.MAX, bc.MEAN, *bc.CALLS, *bc.PARALLEL}
+    """
+    Instructions on arrays, which would need a column of arrays per register,
+    calls, which would need a return address stack per lane, and workers.
+    """
+
+    def __init__(self, bytecode:bc.ByteCode | Program, stdins:list[Input], stdouts:list[Output] = None) -> None:
+        self.program = bytecode if isinstance(bytecode, Program) else Decoder(bytecode).decode()
+        self.lanes = len(stdins)
+        self.stdins = stdins
+        self.stdouts = [Output.memory() for _ in stdins] if stdouts is None else stdouts
+        """
+        The channels of each lane.
+        """
+        self.regs:list[np.ndarray] = [self.column(None)] * self.program.registers
+        """
+        Each register holds a column of one value per lane. Columns are
+        never changed in place, so registers can share them.
+        """
+        self.pc = 0
+        """
+        The instruction being run, so branches know where falling through goes.
+        """
+        self.code = self.bind(self.program)
+
+    def bind(self, program:Program):
+        for op, _ in program.code:
+            if op in self.UNSUPPORTED:
+                raise RuntimeError(f"{bc.OPNAMES[op]} cannot run in batch mode.")
+        return super().bind(program)
+
+    def column(self, value):
+        """A column holding the value in every lane."""
+        if isinstance(value, float):
+            return np.full(self.lanes, value)
+        column = np.empty(self.lanes, dtype=object) # strings stay python strings, numpy would cap their length
+        column[:] = [value] * self.lanes
+        return column
+
+    def gather(self, reg:int, lanes:np.ndarray):
+        column = self.regs[reg]
+        return column if lanes is None else column[lanes]
+
+    def scatter(self, reg:int, lanes:np.ndarray, values:np.ndarray):
+        if lanes is None:
+            self.regs[reg] = values
+            return
+        column = self.regs[reg]
+        if column.dtype != values.dtype:
+            column = column.astype(object)
+            values = values.astype(object)
+        else:
+            column = column.copy()
+        column[lanes] = values
+        self.regs[reg] = column
+
+    def each(self, lanes:np.ndarray):
+        return range(self.lanes) if lanes is None else lanes.tolist()
+
+    def width(self, lanes:np.ndarray):
+        return self.lanes if lanes is None else len(lanes)
+
+    def strings(self, values:list):
+        column = np.empty(len(values), dtype=object)
+        column[:] = values
+        return column
+
+    def run(self, metadata:dict, profiler = None):
+        """
+        Runs the program on every lane. Profiling is not supported in
+        batch mode, the profiler is ignored.
+        """
+        try:
+            with np.errstate(divide="raise", invalid="raise"):
+                self._run()
+        finally:
+            for stdout in self.stdouts:
+                stdout.flush()
+
+    def _run(self):
+        code = self.code
+        start = self.program.start
+        for i in range(start):
+            if self.program.code[i][0] in self.PRELUDE:
+                handler, operands = code[i]
+                handler(None, *operands)
+
+        end = len(code)
+        pc = start + 1
+        pcs = None # the program counter of each lane, None while they all share pc
+        while True:
+            if pcs is None:
+                if pc >= end:
+                    return
+                handler, operands = code[pc]
+                self.pc = pc
+                target = handler(None, *operands)
+                if target is None:
+                    pc += 1
+                elif isinstance(target, int):
+                    pc = target
+                else:
+                    pcs = target # the lanes went different ways
+                continue
+
+            live = pcs < end
+            if not live.any():
+                return
+            pc = int(pcs[live].min())
+            at = pcs == pc
+            if at.all():
+                pcs = None
+                continue
+            lanes = np.flatnonzero(at)
+            handler, operands = code[pc]
+            self.pc = pc
+            target = handler(lanes, *operands)
+            pcs[lanes] = pc + 1 if target is None else target
+
+    def _nop(self, lanes, *operands):
+        pass
+
+    def _alloca(self, lanes, cid):
+        self.scatter(cid, lanes, self.column(None)[:self.width(lanes)])
+
+    def _store(self, lanes, cid, src):
+        self.scatter(cid, lanes, self.gather(src, lanes))
+
+    def _del(self, lanes, cid):
+        self.scatter(cid, lanes, self.column(None)[:self.width(lanes)])
+
+    def binary(self, lanes, cid, lhs, rhs, op):
+        self.scatter(cid, lanes, np.asarray(op(self.gather(lhs, lanes), self.gather(rhs, lanes))))
+
+    def _eq(self, lanes, cid, lhs, rhs):
+        self.binary(lanes, cid, lhs, rhs, operator.eq)
+
+    def _gt(self, lanes, cid, lhs, rhs):
+        self.binary(lanes, cid, lhs, rhs, operator.gt)
+
+    def _lt(self, lanes, cid, lhs, rhs):
+        self.binary(lanes, cid, lhs, rhs, operator.lt)
+
+    def _gte(self, lanes, cid, lhs, rhs):
+        self.binary(lanes, cid, lhs, rhs, operator.ge)
+
+    def _lte(self, lanes, cid, lhs, rhs):
+        self.binary(lanes, cid, lhs, rhs, operator.le)
+
+    def _neq(self, lanes, cid, lhs, rhs):
+        self.binary(lanes, cid, lhs, rhs, operator.ne)
+
+    def _add(self, lanes, cid, lhs, rhs):
+        self.binary(lanes, cid, lhs, rhs, operator.add)
+
+    _append = _add
+
+    def _sub(self, lanes, cid, lhs, rhs):
+        self.binary(lanes, cid, lhs, rhs, operator.sub)
+
+    def _mul(self, lanes, cid, lhs, rhs):
+        self.binary(lanes, cid, lhs, rhs, operator.mul)
+
+    def _div(self, lanes, cid, lhs, rhs):
+        self.binary(lanes, cid, lhs, rhs, operator.truediv)
+
+    def _mod(self, lanes, cid, lhs, rhs):
+        self.binary(lanes, cid, lhs, rhs, operator.mod)
+
+    def _exp(self, lanes, cid, lhs, rhs):
+        self.binary(lanes, cid, lhs, rhs, operator.pow)
+
+    def _stdin(self, lanes, cid):
+        values = []
+        for lane in self.each(lanes):
+            if self.stdins[lane].interactive:
+                self.stdouts[lane].flush()
+            values.append(self.stdins[lane].readline())
+        self.scatter(cid, lanes, self.strings(values))
+
+    def _stdout(self, lanes, out):
+        stdouts = self.stdouts
+        for lane, value in zip(self.each(lanes), self.gather(out, lanes).tolist()):
+            stdouts[lane].write(str(value))
+
+    def _num(self, lanes, cid, num):
+        self.scatter(cid, lanes, self.column(num)[:self.width(lanes)])
+
+    def _str(self, lanes, cid, string):
+        self.scatter(cid, lanes, self.column(string)[:self.width(lanes)])
+
+    def _cast_num(self, lanes, cid, src):
+        self.scatter(cid, lanes, self.gather(src, lanes).astype(float))
+
+    def _cast_str(self, lanes, cid, src):
+        self.scatter(cid, lanes, self.strings([str(value) for value in self.gather(src, lanes).tolist()]))
+
+    def _fmt_num(self, lanes, cid, src, precision):
+        values = zip(self.gather(src, lanes).tolist(), self.gather(precision, lanes).tolist())
+        self.scatter(cid, lanes, self.strings([format_num(num, p) for num, p in values]))
+
+    def format(self, lanes, string, items):
+        strings = self.gather(string, lanes).tolist()
+        columns = [self.gather(item, lanes).tolist() for item in items]
+        return self.strings([str(string).format(*args) for string, *args in zip(strings, *columns)])
+
+    def _fmt(self, lanes, cid, string, *items):
+        self.scatter(cid, lanes, self.format(lanes, string, items))
+
+    def _begin_scope(self, lanes, base):
+        pass
+
+    def _end_scope(self, lanes, base, top):
+        for reg in range(base, top):
+            self._del(lanes, reg)
+
+    def _jump(self, lanes, target):
+        return target
+
+    def branch(self, cond:np.ndarray, target:int):
+        """Where each lane goes, given whether it takes the jump."""
+        if cond.all():
+            return target
+        if not cond.any():
+            return None
+        return np.where(cond, target, self.pc + 1)
+
+    def _cond_jump(self, lanes, target, cond):
+        return self.branch(self.gather(cond, lanes).astype(bool), target)
+
+    def _cmp_jump(self, lanes, target, compare, lhs, rhs):
+        return self.branch(np.asarray(compare(self.gather(lhs, lanes), self.gather(rhs, lanes))).astype(bool), target)
+
+    def _cmp_jump_keep(self, lanes, target, compare, cond, lhs, rhs):
+        self.binary(lanes, cond, lhs, rhs, compare)
+        return self._cond_jump(lanes, target, cond)
+
+    def _add_store_keep(self, lanes, dst, tmp, lhs, rhs):
+        self._add(lanes, tmp, lhs, rhs)
+        self._store(lanes, dst, tmp)
+
+    def _fmt_stdout(self, lanes, string, *items):
+        stdouts = self.stdouts
+        for lane, text in zip(self.each(lanes), self.format(lanes, string, items).tolist()):
+            stdouts[lane].write(text)
+
+    def _fmt_stdout_keep(self, lanes, msg, string, *items):
+        self._fmt(lanes, msg, string, *items)
+        self._stdout(lanes, msg)
@@ -0,0 +1,228 @@
+"""
+Compiled program format, all integers little endian:
+
+header      magic, version, flags, start, registers and the length of each section
+code        u32 words of {instruction}{operand count}{operands...}
+lines       u32 source line per instruction, 0 when unknown
+constants   {tag}{payload} per constant, NUM and STR operands index into this
+strings     {u32 length}{utf-8 bytes} per string, string constants and block names index into this
+blocks      {u32 block id}{u32 instruction index} per block
+names       {u32 block id}{u32 string index} per named block
+"""
+
+import functools
+import hashlib
+import os
+import shutil
+import struct
+import sys
+import tempfile
+from array import array
+from typing import BinaryIO
+from .decoder import Program
+
+MAGIC = b"PASM"
+VERSION = 3
+
+HEADER = struct.Struct("<4sHHIIIIIII")
+BLOCK = struct.Struct("<II")
+LENGTH = struct.Struct("<I")
+
+TAG_FLOAT = 0x1
+TAG_INT = 0x2
+TAG_STR = 0x3
+TAG_BOOL = 0x4
+
+FLOAT = struct.Struct("<Bd")
+INT = struct.Struct("<Bq")
+STR = struct.Struct("<BI")
+BOOL = struct.Struct("<B?")
+
+TAGS = {TAG_FLOAT: FLOAT, TAG_INT: INT, TAG_STR: STR, TAG_BOOL: BOOL}
+
+@functools.cache
+def sources(*directories:str):
+    """
+    The hash of the Python sources in the directories, which changes with
+    every change to the code that compiled a cached file.
+    """
+    digest = hashlib.sha256()
+    for directory in directories:
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".py"):
+                digest.update(name.encode())
+                with open(os.path.join(directory, name), "rb") as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+def _words(data:bytes | memoryview):
+    words = array("I")
+    words.frombytes(data)
+    if sys.byteorder != "little":
+        words.byteswap()
+    return words
+
+def _code(code:list[tuple[int, tuple]]):
+    words = array("I")
+    for op, operands in code:
+        words.extend([op, len(operands), *operands])
+    if sys.byteorder != "little":
+        words.byteswap()
+    return words
+
+def _lines(lines:list[int]):
+    words = array("I", lines)
+    if sys.byteorder != "little":
+        words.byteswap()
+    return words
+
+def _tables(constants:list, blocks:dict[int, int], names:dict[int, str]):
+    """The constants, strings, blocks and names sections, along with how many strings there are."""
+    strings:list[str] = []
+    string_ids:dict[str, int] = {}
+
+    def string_id(string:str):
+        if string not in string_ids:
+            string_ids[string] = len(strings)
+            strings.append(string)
+        return string_ids[string]
+
+    pool = bytearray()
+    for value in constants:
+        if isinstance(value, bool):
+            pool += BOOL.pack(TAG_BOOL, value)
+        elif isinstance(value, int):
+            pool += INT.pack(TAG_INT, value)
+        elif isinstance(value, float):
+            pool += FLOAT.pack(TAG_FLOAT, value)
+        elif isinstance(value, str):
+            pool += STR.pack(TAG_STR, string_id(value))
+        else:
+            raise RuntimeError(f"The constant {value!r} cannot be compiled.")
+
+    named = bytearray()
+    for block, name in names.items():
+        named += BLOCK.pack(block, string_id(name))
+
+    table = bytearray()
+    for string in strings:
+        encoded = string.encode("utf-8")
+        table += LENGTH.pack(len(encoded))
+        table += encoded
+
+    indices = bytearray()
+    for block, index in blocks.items():
+        indices += BLOCK.pack(block, index)
+
+    return b"".join([pool, table, indices, named]), len(strings)
+
+def dumps(program:Program):
+    """Serializes a program into the compiled program format."""
+    code = _code(program.code)
+    tables, n_strings = _tables(program.constants, program.blocks, program.names)
+    header = HEADER.pack(
+        MAGIC, VERSION, 0, program.start, program.registers,
+        len(code), len(program.constants), n_strings, len(program.blocks), len(program.names)
+    )
+    return b"".join([header, code.tobytes(), _lines(program.lines).tobytes(), tables])
+
+class Writer:
+    """
+    Writes the compiled program format a chunk of instructions at a time,
+    for programs too big to hold in memory whole.
+
+    The code goes straight into the file and the lines into a temporary
+    file, which is copied in after the code. The header is written last,
+    over the space kept for it, once the lengths of the sections are
+    known, so the file has to be seekable.
+    """
+    def __init__(self, f:BinaryIO) -> None:
+        self.f = f
+        self.origin = f.tell()
+        self.lines = tempfile.TemporaryFile()
+        self.words = 0
+        f.write(bytes(HEADER.size))
+
+    def write(self, code:list[tuple[int, tuple]], lines:list[int]):
+        words = _code(code)
+        self.f.write(words.tobytes())
+        self.lines.write(_lines(lines).tobytes())
+        self.words += len(words)
+
+    def close(self, start:int, registers:int, constants:list, blocks:dict[int, int], names:dict[int, str]):
+        f = self.f
+        self.lines.seek(0)
+        shutil.copyfileobj(self.lines, f)
+        self.lines.close()
+        tables, n_strings = _tables(constants, blocks, names)
+        f.write(tables)
+        end = f.tell()
+        f.seek(self.origin)
+        f.write(HEADER.pack(MAGIC, VERSION, 0, start, registers, self.words, len(constants), n_strings, len(blocks), len(names)))
+        f.seek(end)
+
+def loads(data:bytes | memoryview):
+    """Rebuilds a program from the compiled program format."""
+    data = memoryview(data)
+    magic, version, _, start, registers, code_len, n_constants, n_strings, n_blocks, n_names = HEADER.unpack_from(data, 0)
+    if magic != MAGIC:
+        raise RuntimeError("The file is not a compiled program.")
+    if version != VERSION:
+        raise RuntimeError(f"The compiled program is version {version}, expected version {VERSION}.")
+    offset = HEADER.size
+
+    words = _words(data[offset:offset + code_len * 4])
+    offset += code_len * 4
+
+    code:list[tuple[int, tuple]] = []
+    cursor = 0
+    while cursor < len(words):
+        op = words[cursor]
+        count = words[cursor + 1]
+        operands = words[cursor + 2:cursor + 2 + count].tolist()
+        cursor += 2 + count
+        code.append((op, tuple(operands)))
+
+    lines = _words(data[offset:offset + len(code) * 4]).tolist()
+    offset += len(code) * 4
+
+    tags = []
+    for _ in range(n_constants):
+        tag = data[offset]
+        if tag not in TAGS:
+            raise RuntimeError(f"Unknown constant tag {tag}.")
+        tags.append(TAGS[tag].unpack_from(data, offset))
+        offset += TAGS[tag].size
+
+    strings:list[str] = []
+    for _ in range(n_strings):
+        (length,) = LENGTH.unpack_from(data, offset)
+        offset += LENGTH.size
+        strings.append(sys.intern(str(data[offset:offset + length], "utf-8")))
+        offset += length
+
+    constants = [strings[value] if tag == TAG_STR else value for tag, value in tags]
+
+    blocks:dict[int, int] = {}
+    for _ in range(n_blocks):
+        block, index = BLOCK.unpack_from(data, offset)
+        offset += BLOCK.size
+        blocks[block] = index
+
+    names:dict[int, str] = {}
+    for _ in range(n_names):
+        block, string = BLOCK.unpack_from(data, offset)
+        offset += BLOCK.size
+        names[block] = strings[string]
+
+    if offset != len(data):
+        raise RuntimeError("The compiled program is truncated.")
+    return Program(code, blocks, start, registers, constants, lines, names)
+
+def dump(program:Program, path:str):
+    with open(path, "wb") as f:
+        f.write(dumps(program))
+
+def load(path:str):
+    with open(path, "rb") as f:
+        return loads(f.read())
@@ -1,4 +1,6 @@
 from __future__ import annotations
+import sys
+from array import array
 import numpy as np
 
 """
@@ -7,30 +9,24 @@ Format:
 
 {instruction}{parameter}{parameter}\x00
 
+Instructions and their operands are all unsigned 32 bit words, laid out
+back to back in one array.
 """
 
-__MAX_INSTR_INT__ = 0x32
+__MAX_INSTR_INT__ = 0x40
 """
-There are 50 reserved bytes
+There are 64 reserved words
 
-40 of these bytes are instructions.
+54 of these words are instructions.
 
-bytes 0 to 9 are reserved for representing decimal numbers.
+words 0 to 9 are reserved.
 
-characters are represented as their decimal value then converted as needed
+numbers and strings live in the constant pool and are referenced by their index
 
-this leaves 205 bytes left for variables, instructions, etc (will change later when I think of better solution)
+ids are handed out from 65 upwards, so they never read as ENDL where FMT's
+operands end, and there is room for billions of them.
 """
 
-def MAX_INSTR_guard(bt:int | list[int]):
-    if isinstance(bt, int):
-        if 10 < bt <= __MAX_INSTR_INT__:
-            raise RuntimeError(f"The byte of value {bt} is an instruction byte and cannot be used dynamically.")
-    elif isinstance(bt, list):
-        for byt in bt:
-            if 10 < byt <= __MAX_INSTR_INT__:
-                raise RuntimeError(f"The byte of value {byt} is an instruction byte and cannot be used dynamically.")
-
 # instruction byte values
 ENDL = 0xA
 ALLOCA = 0xB
@@ -63,10 +59,141 @@ CAST_STR = 0x25
 FMT_NUM = 0x26
 START = 0x27
 
+# superinstructions, only ever emitted by the optimizer
+CMP_JUMP = 0x28
+ADD_STORE = 0x29
+FMT_STDOUT = 0x2A
+
+# arrays, backed by numpy, ADD to LTE work on them element-wise
+ARRAY = 0x2B
+FILL = 0x2C
+RANGE = 0x2D
+LOAD = 0x2E
+INDEX = 0x2F
+SLICE = 0x30
+LEN = 0x31
+SUM = 0x32
+MIN = 0x33
+MAX = 0x34
+MEAN = 0x35
+
+# subroutines, each call saves the registers of the function's scope in a frame
+FUNC = 0x36
+END_FUNC = 0x37
+CALL = 0x38
+RET = 0x39
+
+# workers, blocks spawned into other processes, and the channels between them
+CHAN = 0x3A
+SPAWN = 0x3B
+SEND = 0x3C
+RECV = 0x3D
+JOIN = 0x3E
+
+JUMPS = {JUMP, COND_JUMP, CMP_JUMP}
+"""
+Instructions whose first operand is the block they can jump to.
+"""
+
+CALLS = {FUNC, END_FUNC, CALL, RET}
+"""
+Instructions that move control between a call and its function, which
+only the executors follow.
+"""
+
+PARALLEL = {CHAN, SPAWN, SEND, RECV, JOIN}
+"""
+Instructions that start workers or talk to them. A worker starts at a
+block no jump goes to, with the registers as they were when it was
+spawned, which only the executors follow.
+"""
+
+OPERANDS:dict[int, int] = {
+    ALLOCA: 1,
+    STORE: 2,
+    DEL: 1,
+    ADD: 3,
+    SUB: 3,
+    MUL: 3,
+    DIV: 3,
+    MOD: 3,
+    JUMP: 1,
+    BLOCK: 1,
+    COND_JUMP: 2,
+    EQ: 3,
+    GT: 3,
+    LT: 3,
+    GTE: 3,
+    LTE: 3,
+    NUM: 2,
+    STDOUT: 1,
+    STDIN: 1,
+    EXP: 3,
+    STR: 2,
+    FMT: 2,
+    BEGIN_SCOPE: 0,
+    END_SCOPE: 0,
+    NEQ: 3,
+    CAST_NUM: 2,
+    CAST_STR: 2,
+    FMT_NUM: 3,
+    START: 0,
+    ARRAY: 2,
+    FILL: 3,
+    RANGE: 3,
+    LOAD: 2,
+    INDEX: 3,
+    SLICE: 4,
+    LEN: 2,
+    SUM: 2,
+    MIN: 2,
+    MAX: 2,
+    MEAN: 2,
+    FUNC: 1,
+    END_FUNC: 1,
+    CALL: 2,
+    RET: 1,
+    CHAN: 2,
+    SPAWN: 2,
+    SEND: 2,
+    RECV: 2,
+    JOIN: 2,
+}
+"""
+The number of fixed operands that follow each instruction byte.
+"""
+
+VARIADIC = {FMT, FUNC, CALL}
+"""
+Instructions whose fixed operands are followed by any number of
+extra operands, terminated by ENDL.
+"""
+
+NO_ENDL = {JUMP, BEGIN_SCOPE, END_SCOPE, START}
+"""
+Instructions that are not terminated by ENDL.
+"""
+
+OPNAMES:dict[int, str] = {
+    op: name for name, op in list(globals().items())
+    if isinstance(op, int) and name.isupper() and ENDL < op <= __MAX_INSTR_INT__
+}
+
 class ByteCode:
     def __init__(self, builder:BytecodeBuilder):
-        self.bytecode = []
-        self.strings:dict[int, str] = {}
+        self.bytecode = array("I")
+        """
+        Every instruction and operand as one unsigned word, without a
+        Python object per element.
+        """
+        self.constants:list[int | float | str] = []
+        """
+        The constant pool, NUM and STR refer to their value by its index in here.
+        """
+        self.lines:dict[int, int] = {}
+        """
+        The source line of each instruction, keyed by the index of its instruction byte.
+        """
         self.current = 0
         self.builder:BytecodeBuilder = builder
     
@@ -75,17 +202,10 @@ class ByteCode:
             raise StopIteration
         cur = self.bytecode[self.current]
         self.current += 1
-        if cur in self.strings.keys():
-            return self.strings[cur]
-        else:
-            return cur
+        return cur
         
     def __getitem__(self, index:int):
-        cur = self.bytecode[index]
-        if cur in self.strings.keys():
-            return self.strings[cur]
-        else:
-            return cur
+        return self.bytecode[index]
         
     def __setitem__(self, index:int, value):
         self.bytecode[index] = value
@@ -93,20 +213,18 @@ class ByteCode:
     def __len__(self):
         return len(self.bytecode)
     
-    def append(self, item:int | str):
-        if isinstance(item, str):
-            cid = self.builder.current_id
-            self.strings[cid] = item
-            item = cid
+    def append(self, item:int):
+        self.lines[len(self.bytecode)] = self.builder.line
         self.bytecode.append(item)
     
-    def extend(self, items:list[int | str]):
-        for i in range(len(items)):
-            if isinstance(items[i], str):
-                cid = self.builder.current_id
-                self.strings[cid] = items[i]
-                items[i] = cid
+    def extend(self, items:list[int]):
+        self.lines[len(self.bytecode)] = self.builder.line
         self.bytecode.extend(items)
+
+    def clear(self):
+        """Drops the words written so far, once they have been decoded. The constant pool stays."""
+        del self.bytecode[:]
+        self.lines.clear()
     
 
 
@@ -114,62 +232,71 @@ class BytecodeBuilder:
     def __init__(self) -> None:
         self._current_id = __MAX_INSTR_INT__
         self.existing_ids:set = set()
+        self.constant_ids:dict[tuple[type, int | float | str], int] = {}
+        self.line = 0
+        """
+        The source line the next instruction is written for, 0 when unknown.
+        """
         self.src = ByteCode(self)
     
     @property
     def current_id(self):
         self._current_id += 0x1
-        while self._current_id in self.existing_ids:
-            self._current_id += 0x1
+        self.existing_ids.add(self._current_id)
         return self._current_id
     
+    def constant(self, value:int | float | str):
+        """Returns the index of the value in the constant pool, adding it if needed."""
+        if isinstance(value, str):
+            value = sys.intern(value) # programs built in one process share their strings, and equal ones compare by identity
+        key = (type(value), value)
+        if key not in self.constant_ids:
+            self.constant_ids[key] = len(self.src.constants)
+            self.src.constants.append(value)
+        return self.constant_ids[key]
+
     def add_id(self, id:int):
         if id in self.existing_ids:
             raise RuntimeError(f"The dynamic id {id} was instantiated twice.")
         self.existing_ids.add(id)
+        self._current_id = max(self._current_id, id) # ids handed out later never clash with it
     
     def remove_id(self, id:int):
-        if id in self.existing_ids:
+        if id not in self.existing_ids:
             raise RuntimeError(f"The dynamic id {id} was deleted twice.")
         self.existing_ids.remove(id)
     
     def write_EQ(self, lhs:int, rhs:int, cid = None):
-        MAX_INSTR_guard([lhs, rhs])
         cid = self.current_id if cid == None else cid
 
         self.src.extend([EQ, cid, lhs, rhs, ENDL])
         return cid
 
     def write_GT(self, lhs:int, rhs:int, cid = None):
-        MAX_INSTR_guard([lhs, rhs])
         cid = self.current_id if cid == None else cid
 
         self.src.extend([GT, cid, lhs, rhs, ENDL])
         return cid
 
     def write_LT(self, lhs:int, rhs:int, cid = None):
-        MAX_INSTR_guard([lhs, rhs])
         cid = self.current_id if cid == None else cid
 
         self.src.extend([LT, cid, lhs, rhs, ENDL])
         return cid
 
     def write_GTE(self, lhs:int, rhs:int, cid = None):
-        MAX_INSTR_guard([lhs, rhs])
         cid = self.current_id if cid == None else cid
 
         self.src.extend([GTE, cid, lhs, rhs, ENDL])
         return cid
 
     def write_LTE(self, lhs:int, rhs:int, cid = None):
-        MAX_INSTR_guard([lhs, rhs])
         cid = self.current_id if cid == None else cid
 
         self.src.extend([LTE, cid, lhs, rhs, ENDL])
         return cid
     
     def write_NEQ(self, lhs:int, rhs:int, cid = None):
-        MAX_INSTR_guard([lhs, rhs])
         cid = self.current_id if cid == None else cid
 
         self.src.extend([NEQ, cid, lhs, rhs, ENDL])
@@ -177,7 +304,6 @@ class BytecodeBuilder:
 
     def write_ALLOCA(self, id:int = None, cid = None):
         if id != None:
-            MAX_INSTR_guard(id)
             self.add_id(id)
 
             self.src.extend([ALLOCA, id, ENDL])
@@ -189,62 +315,53 @@ class BytecodeBuilder:
             
 
     def write_STORE(self, id:int, value:int):
-        MAX_INSTR_guard([id, value])
 
         self.src.extend([STORE, id, value, ENDL])
         return id
 
     def write_DEL(self, id:int):
-        MAX_INSTR_guard(id)
         self.remove_id(id)
         
         self.src.extend([DEL, id, ENDL])
         return id
 
     def write_ADD(self, lhs:int, rhs:int, cid:int = None):
-        MAX_INSTR_guard([lhs, rhs])
         cid = self.current_id if cid == None else cid
 
         self.src.extend([ADD, cid, lhs, rhs, ENDL])
         return cid
 
     def write_SUB(self, lhs:int, rhs:int, cid = None):
-        MAX_INSTR_guard([lhs, rhs])
         cid = self.current_id if cid == None else cid
 
         self.src.extend([SUB, cid, lhs, rhs, ENDL])
         return cid
 
     def write_MUL(self, lhs:int, rhs:int, cid = None):
-        MAX_INSTR_guard([lhs, rhs])
         cid = self.current_id if cid == None else cid
 
         self.src.extend([MUL, cid, lhs, rhs, ENDL])
         return cid
 
     def write_DIV(self, lhs:int, rhs:int, cid = None):
-        MAX_INSTR_guard([lhs, rhs])
         cid = self.current_id if cid == None else cid
 
         self.src.extend([DIV, cid, lhs, rhs, ENDL])
         return cid
     
     def write_EXP(self, lhs:int, rhs:int, cid = None):
-        MAX_INSTR_guard([lhs, rhs])
         cid = self.current_id if cid == None else cid
 
         self.src.extend([EXP, cid, lhs, rhs, ENDL])
         return cid
 
     def write_MOD(self, lhs:int, rhs:int, cid = None):
-        MAX_INSTR_guard([lhs, rhs])
         cid = self.current_id if cid == None else cid
 
         self.src.extend([MOD, cid, lhs, rhs, ENDL])
         return cid
 
     def write_JUMP(self, block:int):
-        MAX_INSTR_guard(block)
 
         self.src.extend([JUMP, block])
         return block
@@ -269,12 +386,12 @@ class BytecodeBuilder:
     def write_END_SCOPE(self):
         self.src.append(END_SCOPE)
     
-    def write_NUM(self, num:int, cid = None):
-        num = [int(i) for i in str(num)]
+    def write_NUM(self, num:int | float, cid = None):
+        num = self.constant(float(num)) # numbers are always floats inside the VM
 
         cid = self.current_id if cid == None else cid
         
-        self.src.extend([NUM, cid, *num, ENDL])
+        self.src.extend([NUM, cid, num, ENDL])
         return cid
     
     def write_CAST_NUM(self, id:int, cid = None):
@@ -295,7 +412,7 @@ class BytecodeBuilder:
 
         cid = self.current_id if cid == None else cid
         
-        self.src.extend([STR, cid, string, ENDL])
+        self.src.extend([STR, cid, self.constant(string), ENDL])
         return cid
     
     def write_FMT(self, string:int, items:list, cid = None):
@@ -332,3 +449,143 @@ class BytecodeBuilder:
         self.src.extend([STDIN, cid, ENDL])
         return cid
 
+    def write_ARRAY(self, size:int, cid = None):
+        """An array of size zeros."""
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([ARRAY, cid, size, ENDL])
+        return cid
+
+    def write_FILL(self, size:int, value:int, cid = None):
+        """An array of size copies of value."""
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([FILL, cid, size, value, ENDL])
+        return cid
+
+    def write_RANGE(self, start:int, stop:int, cid = None):
+        """An array of the numbers from start up to, but not including, stop."""
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([RANGE, cid, start, stop, ENDL])
+        return cid
+
+    def write_LOAD(self, path:int, cid = None):
+        """An array of the whitespace separated numbers in the file at path."""
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([LOAD, cid, path, ENDL])
+        return cid
+
+    def write_INDEX(self, array:int, index:int, cid = None):
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([INDEX, cid, array, index, ENDL])
+        return cid
+
+    def write_SLICE(self, array:int, start:int, stop:int, cid = None):
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([SLICE, cid, array, start, stop, ENDL])
+        return cid
+
+    def write_LEN(self, array:int, cid = None):
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([LEN, cid, array, ENDL])
+        return cid
+
+    def write_SUM(self, array:int, cid = None):
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([SUM, cid, array, ENDL])
+        return cid
+
+    def write_MIN(self, array:int, cid = None):
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([MIN, cid, array, ENDL])
+        return cid
+
+    def write_MAX(self, array:int, cid = None):
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([MAX, cid, array, ENDL])
+        return cid
+
+    def write_MEAN(self, array:int, cid = None):
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([MEAN, cid, array, ENDL])
+        return cid
+
+    def write_FUNC(self, params:list, cid = None):
+        """
+        A block that is only entered by CALL, params are the ids of its
+        parameters, which the call's arguments are copied into.
+        """
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([FUNC, cid, *params, ENDL])
+        return cid
+
+    def write_END_FUNC(self, func:int):
+        self.src.extend([END_FUNC, func, ENDL])
+        return func
+
+    def write_CALL(self, func:int, args:list, cid = None):
+        """Calls the function with the args, cid gets what it returns."""
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([CALL, func, cid, *args, ENDL])
+        return cid
+
+    def write_RET(self, value:int):
+        self.src.extend([RET, value, ENDL])
+
+    def write_CHAN(self, capacity:int, cid = None):
+        """A channel that holds up to capacity values, SEND waits while it is full."""
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([CHAN, cid, capacity, ENDL])
+        return cid
+
+    def write_SPAWN(self, block:int, cid = None):
+        """Starts a worker at the block, with a copy of the registers, cid gets the worker to JOIN."""
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([SPAWN, block, cid, ENDL])
+        return cid
+
+    def write_SEND(self, chan:int, value:int):
+        self.src.extend([SEND, chan, value, ENDL])
+
+    def write_RECV(self, chan:int, cid = None):
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([RECV, cid, chan, ENDL])
+        return cid
+
+    def write_JOIN(self, task:int, cid = None):
+        """Waits for the worker to end, cid gets what it returned."""
+
+        cid = self.current_id if cid == None else cid
+
+        self.src.extend([JOIN, cid, task, ENDL])
+        return cid
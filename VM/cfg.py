@@ -0,0 +1,169 @@
+from __future__ import annotations
+from . import bytecodes as bc
+from .decoder import Program
+
+class BasicBlock:
+    """A run of instructions that is only entered at its first instruction."""
+    def __init__(self, index:int, first:int, end:int) -> None:
+        self.index = index
+        self.first = first
+        self.end = end
+        """
+        The block covers the instructions from first up to, but not including, end.
+        """
+        self.succs:list[int] = []
+        self.preds:list[int] = []
+
+    def __repr__(self) -> str:
+        return f"BasicBlock({self.index}, {self.first}:{self.end}, succs={self.succs})"
+
+class Loop:
+    """A natural loop, found through the back edges to its header."""
+    def __init__(self, header:int, body:set[int], latches:list[int]) -> None:
+        self.header = header
+        self.body = body
+        """
+        The basic blocks in the loop, including the header.
+        """
+        self.latches = latches
+        """
+        The basic blocks that jump back to the header.
+        """
+
+    def exits(self, cfg:CFG):
+        """The basic blocks in the loop that can leave it."""
+        return [b for b in self.body if any(s not in self.body for s in cfg.blocks[b].succs)]
+
+class CFG:
+    """The control flow graph and dominator tree of a decoded program."""
+    def __init__(self, program:Program) -> None:
+        self.program = program
+        self.blocks:list[BasicBlock] = []
+        self.block_of:list[int] = []
+        """
+        The basic block each instruction belongs to.
+        """
+        self.labels:dict[int, int] = {}
+        """
+        Each block id is associated with the basic block its BLOCK instruction starts.
+        """
+        self.entry:int = None
+        """
+        The basic block execution starts in, None when there is no START.
+        """
+        self.build()
+        self.idom:list[int] = self.dominators()
+        """
+        The immediate dominator of each basic block, the entry is its own
+        immediate dominator and unreachable blocks have None.
+        """
+
+    def build(self):
+        code = self.program.code
+        leaders = {0} if code else set()
+        for i, (op, _) in enumerate(code):
+            if op in (bc.BLOCK, bc.START):
+                leaders.add(i)
+            elif op in bc.JUMPS and i + 1 < len(code):
+                leaders.add(i + 1)
+
+        leaders = sorted(leaders)
+        for n, first in enumerate(leaders):
+            end = leaders[n + 1] if n + 1 < len(leaders) else len(code)
+            self.blocks.append(BasicBlock(n, first, end))
+            self.block_of.extend([n] * (end - first))
+            if code[first][0] == bc.BLOCK:
+                self.labels[code[first][1][0]] = n
+            elif code[first][0] == bc.START and self.entry is None:
+                self.entry = n
+
+        for block in self.blocks:
+            op, operands = code[block.end - 1]
+            if op in bc.JUMPS and operands[0] in self.labels:
+                block.succs.append(self.labels[operands[0]])
+            if op != bc.JUMP and block.index + 1 < len(self.blocks):
+                if block.index + 1 not in block.succs:
+                    block.succs.append(block.index + 1)
+            for succ in block.succs:
+                self.blocks[succ].preds.append(block.index)
+
+    def postorder(self):
+        order:list[int] = []
+        if self.entry is None:
+            return order
+        seen = {self.entry}
+        stack = [(self.entry, iter(self.blocks[self.entry].succs))]
+        while stack:
+            block, succs = stack[-1]
+            for succ in succs:
+                if succ not in seen:
+                    seen.add(succ)
+                    stack.append((succ, iter(self.blocks[succ].succs)))
+                    break
+            else:
+                stack.pop()
+                order.append(block)
+        return order
+
+    def dominators(self):
+        """Finds the immediate dominators (Cooper, Harvey and Kennedy)."""
+        idom:list[int] = [None] * len(self.blocks)
+        order = self.postorder()
+        if not order:
+            return idom
+        number = {block: n for n, block in enumerate(order)}
+        idom[self.entry] = self.entry
+
+        def intersect(a, b):
+            while a != b:
+                while number[a] < number[b]:
+                    a = idom[a]
+                while number[b] < number[a]:
+                    b = idom[b]
+            return a
+
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(order):
+                if block == self.entry:
+                    continue
+                preds = [p for p in self.blocks[block].preds if idom[p] is not None]
+                new = preds[0]
+                for pred in preds[1:]:
+                    new = intersect(pred, new)
+                if idom[block] != new:
+                    idom[block] = new
+                    changed = True
+        return idom
+
+    def dominates(self, a:int, b:int):
+        """Whether basic block a dominates basic block b."""
+        if self.idom[b] is None:
+            return False
+        while b != a:
+            if b == self.entry:
+                return False
+            b = self.idom[b]
+        return True
+
+    def loops(self):
+        """Finds the natural loops, innermost first."""
+        latches:dict[int, list[int]] = {}
+        for block in self.blocks:
+            for succ in block.succs:
+                if self.dominates(succ, block.index):
+                    latches.setdefault(succ, []).append(block.index)
+
+        loops:list[Loop] = []
+        for header, ends in latches.items():
+            body = {header}
+            stack = list(ends)
+            while stack:
+                block = stack.pop()
+                if block not in body and self.idom[block] is not None:
+                    body.add(block)
+                    stack.extend(self.blocks[block].preds)
+            loops.append(Loop(header, body, ends))
+        loops.sort(key=lambda loop: len(loop.body))
+        return loops
@@ -0,0 +1,126 @@
+"""
+The channels STDOUT writes to and STDIN reads from.
+"""
+
+import io
+import os
+import sys
+from typing import Iterable, TextIO
+
+class Output:
+    """
+    Buffers what STDOUT writes and hands it to a text stream in bulk.
+
+    policy decides when the buffer is flushed:
+
+    line    after every write that contains a newline
+    full    once the buffer holds at least `size` characters
+    exit    only when flushed explicitly, or when the program ends
+    """
+
+    POLICIES = ("line", "full", "exit")
+    SIZE = 1 << 16
+
+    def __init__(self, stream:TextIO, policy:str = "full", size:int = SIZE) -> None:
+        if policy not in self.POLICIES:
+            raise RuntimeError(f"Unknown flush policy {policy}.")
+        self.stream = stream
+        self.policy = policy
+        self.size = size if policy == "full" else sys.maxsize
+        self.buffer:list[str] = []
+        self.buffered = 0
+        """
+        The number of characters in the buffer.
+        """
+
+    @classmethod
+    def stdout(cls, policy:str = None):
+        """The process' STDOUT, line buffered when it is a terminal."""
+        if policy is None:
+            policy = "line" if sys.stdout.isatty() else "full"
+        return cls(sys.stdout, policy)
+
+    @classmethod
+    def memory(cls):
+        """
+        Keeps everything written in memory, read it back with getvalue. A
+        StringIO is a buffer already, so writes go straight into it instead
+        of piling up in the list and being joined into it once more.
+        """
+        output = cls(io.StringIO(), "exit")
+        output.write = output.stream.write
+        return output
+
+    @classmethod
+    def file(cls, path:str, policy:str = "full"):
+        return cls(open(path, "w", encoding="utf-8"), policy)
+
+    @classmethod
+    def pipe(cls, fd:int, policy:str = "line"):
+        """The write end of a pipe, line buffered so the reader sees every line as it is written."""
+        return cls(os.fdopen(fd, "w", encoding="utf-8"), policy)
+
+    def write(self, text:str):
+        self.buffer.append(text)
+        self.buffered += len(text)
+        if self.buffered >= self.size or (self.policy == "line" and "\n" in text):
+            self.flush()
+
+    def flush(self):
+        if self.buffer:
+            self.stream.write("".join(self.buffer))
+            self.buffer.clear()
+            self.buffered = 0
+        self.stream.flush()
+
+    def getvalue(self):
+        """Everything written so far, for in-memory channels."""
+        self.flush()
+        return self.stream.getvalue()
+
+    def close(self):
+        self.flush()
+        if self.stream not in (sys.stdout, sys.stderr):
+            self.stream.close()
+
+class Input:
+    """
+    Hands STDIN one line at a time, without the trailing newline, from any
+    iterable of lines.
+    """
+    def __init__(self, lines:Iterable[str], interactive:bool = False) -> None:
+        self.lines = iter(lines)
+        self.interactive = interactive
+        """
+        Whether the lines come from something that may be waiting on
+        the program's output, STDOUT is flushed before each read if so.
+        """
+
+    @classmethod
+    def stdin(cls):
+        return cls.stream(sys.stdin)
+
+    @classmethod
+    def stream(cls, stream:TextIO):
+        """Reads lines from a stream as the program asks for them."""
+        return cls(stream, interactive=True)
+
+    @classmethod
+    def pipe(cls, fd:int):
+        return cls.stream(os.fdopen(fd, "r", encoding="utf-8"))
+
+    @classmethod
+    def file(cls, path:str):
+        """Reads the whole file up front."""
+        with open(path, encoding="utf-8") as f:
+            return cls(f.read().splitlines())
+
+    @classmethod
+    def text(cls, text:str):
+        return cls(text.splitlines())
+
+    def readline(self):
+        try:
+            return next(self.lines).rstrip("\r\n")
+        except StopIteration:
+            raise EOFError("STDIN ran out of lines.") from None
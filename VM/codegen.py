@@ -0,0 +1,301 @@
+"""
+Compiles a decoded program into Python source, so it runs without any per
+instruction dispatch.
+
+Registers become local variables of one generated function. The code is cut
+into regions at every jump target, each region is a branch of a state
+machine: falling through into the next region costs one comparison and
+jumps go back to the top of the machine. A region that only ever jumps back
+to its own start becomes a plain while loop.
+
+CALL pushes the state to return to along with the registers of the
+function's scope onto a list of frames, RET pops them and lands on a small
+region of its own that stores the value returned and carries on after the
+CALL.
+"""
+
+import os
+import sys
+import math
+import marshal
+import hashlib
+import numpy as np
+from . import bytecodes as bc
+from .decoder import Decoder, Program
+from .executor import Executor, format_num
+from .channels import Input, Output
+from . import binary
+
+BINARY = {
+    bc.ADD: "+", bc.SUB: "-", bc.MUL: "*", bc.DIV: "/", bc.MOD: "%", bc.EXP: "**",
+    bc.EQ: "==", bc.NEQ: "!=", bc.GT: ">", bc.LT: "<", bc.GTE: ">=", bc.LTE: "<=",
+}
+
+REDUCTIONS = {bc.SUM: "np.sum", bc.MIN: "np.min", bc.MAX: "np.max", bc.MEAN: "np.mean"}
+
+def _load(path:str):
+    with open(path) as f:
+        return np.array(f.read().split(), dtype=float)
+
+class Codegen:
+    """Generates, compiles and caches the Python function of a program."""
+
+    cache:dict[str, object] = {}
+    """
+    Compiled functions' code objects, keyed by the hash of the compiled program and the code generator.
+    """
+
+    def __init__(self, directory:str = None) -> None:
+        self.directory = directory
+        """
+        Where code objects are kept on disk between runs, None keeps them in memory only.
+        """
+
+    def constant(self, value):
+        if isinstance(value, float) and not math.isfinite(value):
+            return f"float({str(value)!r})"
+        return repr(value)
+
+    def register(self, reg:int):
+        """The Python expression a register is read and written through."""
+        return f"r{reg}"
+
+    def instruction(self, op:int, operands:tuple, blocks:dict[int, int], constants:list):
+        """The lines of Python an instruction becomes."""
+        r = self.register
+        match op:
+            case bc.BLOCK | bc.START | bc.BEGIN_SCOPE:
+                return []
+            case bc.ALLOCA | bc.DEL:
+                return [f"{r(operands[0])} = None"]
+            case bc.END_SCOPE:
+                base, top = operands
+                return [" = ".join([*(r(reg) for reg in range(base, top)), "None"])] if top > base else []
+            case bc.STORE:
+                return [f"{r(operands[0])} = {r(operands[1])}"]
+            case bc.NUM | bc.STR:
+                return [f"{r(operands[0])} = {self.constant(constants[operands[1]])}"]
+            case _ if op in BINARY:
+                cid, lhs, rhs = operands
+                return [f"{r(cid)} = {r(lhs)} {BINARY[op]} {r(rhs)}"]
+            case bc.STDIN:
+                return ["if interactive: flush()", f"{r(operands[0])} = readline()"]
+            case bc.STDOUT:
+                return [f"write(str({r(operands[0])}))"]
+            case bc.CAST_NUM:
+                return [f"{r(operands[0])} = float({r(operands[1])})"]
+            case bc.CAST_STR:
+                return [f"{r(operands[0])} = str({r(operands[1])})"]
+            case bc.FMT_NUM:
+                return [f"{r(operands[0])} = format_num({r(operands[1])}, {r(operands[2])})"]
+            case bc.FMT:
+                cid, string, *items = operands
+                return [f"{r(cid)} = str({r(string)}).format({', '.join(map(r, items))})"]
+            case bc.JUMP:
+                return [f"state = {blocks[operands[0]]}", "continue"]
+            case bc.COND_JUMP:
+                return [f"if {r(operands[1])}:", f"    state = {blocks[operands[0]]}", "    continue"]
+            case bc.CMP_JUMP:
+                block, compare, cond, lhs, rhs, keep = operands
+                test = f"{r(lhs)} {BINARY[compare]} {r(rhs)}"
+                lines = []
+                if keep:
+                    lines.append(f"{r(cond)} = {test}")
+                    test = r(cond)
+                return lines + [f"if {test}:", f"    state = {blocks[block]}", "    continue"]
+            case bc.ADD_STORE:
+                dst, tmp, lhs, rhs, keep = operands
+                return [f"{r(dst)} = {r(tmp)} = {r(lhs)} + {r(rhs)}" if keep else f"{r(dst)} = {r(lhs)} + {r(rhs)}"]
+            case bc.FMT_STDOUT:
+                msg, string, keep, *items = operands
+                text = f"str({r(string)}).format({', '.join(map(r, items))})"
+                if keep:
+                    return [f"{r(msg)} = {text}", f"write(str({r(msg)}))"]
+                return [f"write(str({text}))"]
+            case bc.ARRAY:
+                return [f"{r(operands[0])} = np.zeros(int({r(operands[1])}))"]
+            case bc.FILL:
+                return [f"{r(operands[0])} = np.full(int({r(operands[1])}), {r(operands[2])}, dtype=float)"]
+            case bc.RANGE:
+                return [f"{r(operands[0])} = np.arange({r(operands[1])}, {r(operands[2])}, dtype=float)"]
+            case bc.LOAD:
+                return [f"{r(operands[0])} = load({r(operands[1])})"]
+            case bc.INDEX:
+                return [f"{r(operands[0])} = float({r(operands[1])}[int({r(operands[2])})])"]
+            case bc.SLICE:
+                cid, array, start, stop = operands
+                return [f"{r(cid)} = {r(array)}[int({r(start)}):int({r(stop)})]"]
+            case bc.LEN:
+                return [f"{r(operands[0])} = float(len({r(operands[1])}))"]
+            case _ if op in REDUCTIONS:
+                return [f"{r(operands[0])} = float({REDUCTIONS[op]}({r(operands[1])}))"]
+        raise RuntimeError(f"{bc.OPNAMES.get(op, op)} cannot be compiled to Python.")
+
+    def functions(self, code:list[tuple[int, tuple]]):
+        """
+        Each function's block id associated with the index after its END_FUNC
+        and the registers of its scope, and the registers RET at each index
+        puts back, those of the function it is in.
+        """
+        functions:dict[int, tuple[int, int, int]] = {}
+        scopes:dict[int, tuple[int, int]] = {}
+        inside:list[int] = []
+        rets:list[int] = []
+        for i, (op, operands) in enumerate(code):
+            match op:
+                case bc.FUNC:
+                    inside.append(operands[0])
+                case bc.RET:
+                    rets.append((i, inside[-1] if inside else None))
+                case bc.END_FUNC:
+                    func, base, top = operands
+                    inside.pop()
+                    functions[func] = (i + 1, base, top)
+                    scopes[i] = (base, top)
+        for i, func in rets:
+            scopes[i] = functions[func][1:] if func is not None else (0, 0)
+        return functions, scopes
+
+    def call(self, i:int, op:int, operands:tuple, blocks:dict[int, int], functions:dict, scopes:dict):
+        """The lines of Python the FUNC, END_FUNC, CALL or RET at index i becomes."""
+        r = self.register
+        registers = lambda regs: "".join(f"{r(reg)}, " for reg in regs).rstrip() # as a tuple, without the parentheses
+        match op:
+            case bc.FUNC:
+                # the body only runs when it is called, falling into it skips it
+                return [f"state = {functions[operands[0]][0]}", "continue"]
+            case bc.CALL:
+                func, dst, *args = operands
+                _, base, top = functions[func]
+                lines = [f"frames.append(({-i - 1}, ({registers(range(base, top))})))"]
+                if args:
+                    lines.append(f"{registers(range(base, base + len(args)))} = {registers(args)}")
+                if top > base + len(args):
+                    lines.append(" = ".join([*(r(reg) for reg in range(base + len(args), top)), "None"]))
+                return lines + [f"state = {blocks[func]}", "continue"]
+        base, top = scopes[i]
+        value = r(operands[0]) if op == bc.RET else "None"
+        return [
+            f"value = {value}",
+            "if not frames:",
+            "    raise RuntimeError('Returned from a function that was not called.')",
+            f"state, ({registers(range(base, top))}) = frames.pop()",
+            "continue",
+        ]
+
+    def generate(self, program:Program):
+        """The Python source of the program's function."""
+        code = program.code
+        blocks = program.blocks
+        entry = program.start + 1
+        functions, scopes = self.functions(code)
+        returns = {i + 1: (-i - 1, operands[1]) for i, (op, operands) in enumerate(code) if op == bc.CALL}
+        """
+        The index after each CALL, associated with the state RET goes back to
+        and the register that gets the value returned.
+        """
+        starts = sorted({
+            entry, *(index for index in blocks.values() if index < len(code)),
+            *(index for index in returns if index < len(code)),
+            *(end for end, _, _ in functions.values() if end < len(code)),
+        })
+        names = [f"r{reg}" for reg in range(program.registers)]
+
+        lines = ["def program(regs, readline, write, flush, interactive, format_num, np, load):"]
+        if names:
+            lines.append(f"    {', '.join(names)}, = regs")
+        for i in range(program.start):
+            if code[i][0] in Executor.PRELUDE:
+                lines += [f"    {line}" for line in self.instruction(*code[i], blocks, program.constants)]
+
+        lines += [f"    state = {entry}"]
+        if returns:
+            lines.append("    frames = []")
+        lines.append("    while True:")
+
+        def returned(index):
+            if index in returns:
+                state, dst = returns[index]
+                lines.extend([f"        if state == {state}:", f"            r{dst} = value", f"            state = {index}"])
+
+        for n, first in enumerate(starts):
+            end = starts[n + 1] if n + 1 < len(starts) else len(code)
+            jumps = [i for i in range(first, end) if code[i][0] in bc.JUMPS]
+            body:list[str] = []
+            tail = first
+            returned(first)
+            if (len(jumps) == 1 and code[jumps[0]][0] != bc.JUMP and blocks.get(code[jumps[0]][1][0]) == first
+                    and not any(code[i][0] in bc.CALLS for i in range(first, end))):
+                # the region only ever jumps back to its own start, which is a plain loop
+                op, operands = code[jumps[0]]
+                for i in range(first, jumps[0]):
+                    body += self.instruction(*code[i], blocks, program.constants)
+                if op == bc.COND_JUMP:
+                    test = f"r{operands[1]}"
+                else:
+                    _, compare, cond, lhs, rhs, keep = operands
+                    test = f"r{lhs} {BINARY[compare]} r{rhs}"
+                    if keep:
+                        body.append(f"r{cond} = {test}")
+                        test = f"r{cond}"
+                body = ["while True:", *(f"    {line}" for line in body), f"    if not {test}:", "        break"]
+                tail = jumps[0] + 1
+            for i in range(tail, end):
+                if code[i][0] in bc.CALLS:
+                    body += self.call(i, *code[i], blocks, functions, scopes)
+                else:
+                    body += self.instruction(*code[i], blocks, program.constants)
+            if end < len(code):
+                body.append(f"state = {end}")
+            lines.append(f"        if state == {first}:")
+            lines += [f"            {line}" for line in body or ["pass"]]
+        returned(len(code))
+        lines.append(f"        return ({', '.join(names)}{',' if names else ''})")
+        return "\n".join(lines) + "\n"
+
+    def path(self, key:str):
+        return os.path.join(self.directory, f"{key[:16]}.{sys.implementation.cache_tag}.pyc")
+
+    def compile(self, program:Program):
+        """The program's function, generated and compiled only if it is not cached."""
+        # the code generator's own sources are part of the key, so code it generated before a change is never reused
+        key = hashlib.sha256(binary.dumps(program) + binary.sources(os.path.dirname(__file__)).encode()).hexdigest()
+        if key not in self.cache and self.directory is not None:
+            try:
+                with open(self.path(key), "rb") as f:
+                    self.cache[key] = marshal.load(f)
+            except (OSError, EOFError, ValueError, TypeError):
+                pass
+        if key not in self.cache:
+            self.cache[key] = compile(self.generate(program), f"<pasm {key[:16]}>", "exec")
+            if self.directory is not None:
+                try:
+                    os.makedirs(self.directory, exist_ok=True)
+                    tmp = f"{self.path(key)}.{os.getpid()}.tmp"
+                    with open(tmp, "wb") as f:
+                        marshal.dump(self.cache[key], f)
+                    os.replace(tmp, self.path(key))
+                except OSError:
+                    pass
+        namespace = {}
+        exec(self.cache[key], namespace)
+        return namespace["program"]
+
+class CompiledExecutor(Executor):
+    """Runs the supplied bytecode as generated Python, see Codegen."""
+    def __init__(self, bytecode:bc.ByteCode | Program, stdin:Input = None, stdout:Output = None, directory:str = None) -> None:
+        self.codegen = Codegen(directory)
+        super().__init__(bytecode, stdin, stdout)
+
+    def bind(self, program:Program):
+        return self.codegen.compile(program)
+
+    def run(self, metadata:dict, profiler = None):
+        """Runs the program. Compiled programs cannot be profiled, the profiler is ignored."""
+        try:
+            self.regs[:] = self.code(
+                self.regs, self.stdin.readline, self.write, self.stdout.flush,
+                self.stdin.interactive, format_num, np, _load
+            )
+        finally:
+            self.stdout.flush()
@@ -0,0 +1,234 @@
+from . import bytecodes as bc
+
+class Program:
+    """A decoded program, ready to be bound to an executor."""
+    def __init__(self, code:list[tuple[int, tuple]], blocks:dict[int, int], start:int, registers:int, constants:list[int | float | str],
+                 lines:list[int] = None, names:dict[int, str] = None) -> None:
+        self.code = code
+        """
+        Each instruction is an (instruction byte, operands) pair.
+
+        JUMP, COND_JUMP, CALL and SPAWN refer to their block by id, the
+        executor resolves them through `blocks` when binding.
+        NUM and STR refer to their value by its index in `constants`.
+        """
+        self.blocks = blocks
+        """
+        Each block id is associated with the index of the
+        first instruction after its BLOCK or FUNC instruction.
+        """
+        self.start = start
+        """
+        The index of the START instruction, or the length of
+        the code if there is none.
+        """
+        self.registers = registers
+        """
+        The size of the register file the program needs.
+        """
+        self.constants = constants
+        """
+        The constant pool.
+        """
+        self.lines = [0] * len(code) if lines is None else lines
+        """
+        The source line of each instruction, 0 when unknown.
+        Passes that add or remove instructions keep this in step with the code.
+        """
+        self.names = {} if names is None else names
+        """
+        Each block id is associated with its label in the source, if known.
+        """
+
+    def link(self):
+        """Rebuilds the block table and finds START again after the code was rewritten."""
+        self.blocks = {}
+        self.start = None
+        for i, (op, operands) in enumerate(self.code):
+            if op in (bc.BLOCK, bc.FUNC):
+                self.blocks[operands[0]] = i + 1
+            elif op == bc.START and self.start is None:
+                self.start = i
+        if self.start is None:
+            self.start = len(self.code)
+
+WRITES = {
+    bc.ALLOCA, bc.STORE, bc.DEL, bc.NUM, bc.STR, bc.STDIN, bc.FMT, bc.FMT_NUM,
+    bc.CAST_NUM, bc.CAST_STR, bc.ADD, bc.SUB, bc.MUL, bc.DIV, bc.MOD, bc.EXP,
+    bc.EQ, bc.NEQ, bc.GT, bc.LT, bc.GTE, bc.LTE,
+    bc.ARRAY, bc.FILL, bc.RANGE, bc.LOAD, bc.INDEX, bc.SLICE, bc.LEN,
+    bc.SUM, bc.MIN, bc.MAX, bc.MEAN, bc.CHAN, bc.RECV, bc.JOIN,
+}
+"""
+Decoded instructions that write their first operand.
+"""
+
+READS_FROM = {
+    bc.STORE: 1, bc.FMT: 1, bc.FMT_NUM: 1, bc.CAST_NUM: 1, bc.CAST_STR: 1,
+    bc.ADD: 1, bc.SUB: 1, bc.MUL: 1, bc.DIV: 1, bc.MOD: 1, bc.EXP: 1,
+    bc.EQ: 1, bc.NEQ: 1, bc.GT: 1, bc.LT: 1, bc.GTE: 1, bc.LTE: 1,
+    bc.STDOUT: 0, bc.COND_JUMP: 1, bc.CALL: 2, bc.RET: 0,
+    bc.ARRAY: 1, bc.FILL: 1, bc.RANGE: 1, bc.LOAD: 1, bc.INDEX: 1, bc.SLICE: 1, bc.LEN: 1,
+    bc.SUM: 1, bc.MIN: 1, bc.MAX: 1, bc.MEAN: 1,
+    bc.CHAN: 1, bc.SEND: 0, bc.RECV: 1, bc.JOIN: 1,
+}
+"""
+The position of the first register read by each decoded instruction,
+every operand from there on is read.
+"""
+
+def writes(op:int, operands:tuple):
+    """Returns the register a decoded instruction writes, if any."""
+    if op in WRITES:
+        return operands[0]
+    return None
+
+def reads(op:int, operands:tuple):
+    """Returns the registers a decoded instruction reads."""
+    if op in READS_FROM:
+        return operands[READS_FROM[op]:]
+    return ()
+
+def effects(op:int, operands:tuple):
+    """Returns the registers a decoded instruction reads and writes, fused instructions included."""
+    match op:
+        case bc.CMP_JUMP:
+            _, _, cond, lhs, rhs, keep = operands
+            return (lhs, rhs), ((cond,) if keep else ())
+        case bc.ADD_STORE:
+            dst, tmp, lhs, rhs, keep = operands
+            return (lhs, rhs), ((dst, tmp) if keep else (dst,))
+        case bc.FMT_STDOUT:
+            msg, string, keep, *items = operands
+            return (string, *items), ((msg,) if keep else ())
+        case bc.END_SCOPE:
+            return (), tuple(range(*operands))
+        case bc.END_FUNC:
+            return (), tuple(range(*operands[1:]))
+        case bc.FUNC:
+            return (), operands[1:]
+        case bc.CALL:
+            return operands[2:], (operands[1],)
+        case bc.SPAWN:
+            return (), (operands[1],) # the worker reads whatever it likes, from its own copy
+    dst = writes(op, operands)
+    return reads(op, operands), (() if dst is None else (dst,))
+
+def replace_reads(op:int, operands:tuple, mapping:dict[int, int]):
+    """Returns the operands with every register read renamed through the mapping."""
+    if op not in READS_FROM:
+        return operands
+    pos = READS_FROM[op]
+    return operands[:pos] + tuple(mapping.get(reg, reg) for reg in operands[pos:])
+
+class Decoder:
+    """Turns raw bytecode into a Program in a single pass."""
+
+    LITERALS = {
+        bc.NUM: {1},
+        bc.STR: {1},
+        bc.JUMP: {0},
+        bc.BLOCK: {0},
+        bc.COND_JUMP: {0},
+        bc.FUNC: {0},
+        bc.END_FUNC: {0},
+        bc.CALL: {0},
+        bc.SPAWN: {0},
+    }
+    """
+    The operand positions of each instruction that are not variables.
+    """
+
+    def __init__(self, src:bc.ByteCode) -> None:
+        self.src = src
+        self.slots:dict[int, int] = {}
+        """
+        Each variable id is associated with the register it lives in.
+        """
+        self.scopes:list[list[int]] = []
+        """
+        The first and last used register of each enclosing scope,
+        registers allocated inside a scope are reused once it ends.
+        """
+        self.free = 0
+        self.registers = 0
+        self.blocks:dict[int, int] = {}
+        self.start:int = None
+        self.count = 0
+        """
+        How many instructions were decoded so far, over every call to feed.
+        """
+
+    def slot(self, id:int):
+        if id not in self.slots:
+            self.slots[id] = self.free
+            self.free += 1
+            self.registers = max(self.registers, self.free)
+            if self.scopes:
+                self.scopes[-1][1] = max(self.scopes[-1][1], self.free)
+        return self.slots[id]
+
+    def feed(self, words, line_map:dict[int, int]):
+        """
+        Decodes a run of complete instructions, line_map being keyed by word
+        offsets into words like ByteCode.lines. Returns their code and lines,
+        the blocks, start and registers seen so far are kept on the decoder,
+        so a program can be decoded a chunk at a time.
+        """
+        code:list[tuple[int, tuple]] = []
+        lines:list[int] = []
+        blocks = self.blocks
+        cursor = 0
+        while cursor < len(words):
+            op = words[cursor]
+            line = line_map.get(cursor, 0)
+            cursor += 1
+            if op == bc.ENDL:
+                continue
+            if op not in bc.OPERANDS:
+                raise RuntimeError(f"Unknown instruction byte {op} at {cursor - 1}.")
+
+            end = cursor + bc.OPERANDS[op]
+            operands = words[cursor:end].tolist()
+            cursor = end
+            if op in bc.VARIADIC:
+                end = words.index(bc.ENDL, cursor)
+                operands += words[cursor:end].tolist()
+                cursor = end
+            if op not in bc.NO_ENDL:
+                cursor += 1 # endl
+
+            if op == bc.FUNC:
+                # a function is a scope, its parameters take the first registers of it
+                self.scopes.append([self.free, self.free])
+            literals = self.LITERALS.get(op, ())
+            for i in range(len(operands)):
+                if i not in literals:
+                    operands[i] = self.slot(operands[i])
+
+            match op:
+                case bc.BEGIN_SCOPE:
+                    self.scopes.append([self.free, self.free])
+                    operands = [self.free]
+                case bc.END_SCOPE | bc.END_FUNC:
+                    # the scope's registers are handed back for reuse
+                    base, top = self.scopes.pop()
+                    if self.scopes:
+                        self.scopes[-1][1] = max(self.scopes[-1][1], top)
+                    operands = [*operands, base, top]
+                    self.free = base
+                case bc.BLOCK | bc.FUNC:
+                    blocks[operands[0]] = self.count + len(code) + 1
+                case bc.START:
+                    if self.start is None:
+                        self.start = self.count + len(code)
+            code.append((op, tuple(operands)))
+            lines.append(line)
+
+        self.count += len(code)
+        return code, lines
+
+    def decode(self):
+        code, lines = self.feed(self.src.bytecode, self.src.lines)
+        start = self.count if self.start is None else self.start
+        return Program(code, self.blocks, start, self.registers, list(self.src.constants), lines)
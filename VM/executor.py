@@ -1,305 +1,514 @@
-import sys
+import time
+import operator
 from . import bytecodes as bc
+from .decoder import Decoder, Program
+from .profiler import Profiler
+from .channels import Input, Output
+from .rope import Rope
+from .workers import Workers
 import numpy as np
 
-class ScopeStack:
-    def __init__(self) -> None:
-        self.stack:list[dict[int, int | float | str | bool]] = [{}]
-
-    @property
-    def top(self):
-        return self.stack[-1]
-    
-    def new_scope(self):
-        self.stack.append({})
-    
-    def alloca(self, key:int):
-        self.top[key] = None
-    
-    def set(self, key:int, val:any):
-        self.top[key] = val
-    
-    def get(self, key:int):
-        for scope in reversed(self.stack):
-            if key in scope.keys():
-                return scope[key]
-        raise RuntimeError(f"Unknown memory {key} referenced.")
-    
-    def remove(self, key:int):
-        for scope in reversed(self.stack):
-            if key in scope.keys():
-                del scope[key]
-                return
-        raise RuntimeError(f"Tried to delete memory {key} which does not exist.")
-    
-    def pop_scope(self):
-        self.stack.pop()
-
-class ByteCursor:
-    def __init__(self, src:bc.ByteCode) -> None:
-        self.src = src
-        self.cursor = -1
-
-    def next(self):
-        if self.finished:
-            self.cursor = -1
-            raise StopIteration
-        self.cursor += 1
-        
-        return self.src[self.cursor]
-    
-    def __getitem__(self, ind):
-        self.cursor = ind
-        ret = self.src[ind]
-        return ret
+COMPARE = {
+    bc.EQ: operator.eq,
+    bc.NEQ: operator.ne,
+    bc.GT: operator.gt,
+    bc.LT: operator.lt,
+    bc.GTE: operator.ge,
+    bc.LTE: operator.le,
+}
+
+def format_num(num:float, precision:float):
+    """Formats a number the way FMT_NUM does."""
+    precision = int(precision)
+    if precision == 0:
+        return f"{int(num)}"
+    return f"%.{precision}f" % num
+
+class RegisterFile:
+    def __init__(self, size:int) -> None:
+        self.regs:list[int | float | str | bool] = [None] * size
+        """
+        Every variable lives in a fixed register, assigned by the decoder.
+        """
+        self.frames:list[int] = []
+        """
+        The base register of each open scope.
+        """
+        self.calls:list[tuple[int, int, int, int, list]] = []
+        """
+        The frame of each call in progress, innermost last, which is the
+        return address stack. A frame is the index to return to, the
+        register that gets the value returned, and the registers of the
+        function's scope from base to top along with what they held before
+        the call.
+
+        Frames are tuples, which CPython hands out from a free list of
+        recently released ones, so calling allocates no new objects besides
+        the saved registers.
+        """
+
+    def new_scope(self, base:int):
+        self.frames.append(base)
 
-    def __next__(self):
-        return self.next()
-    
-    def prev(self):
-        self.cursor -= 1
-        return self.src[self.cursor]
-    
-    def jump(self, ind:int):
-        self.cursor = ind
-
-    @property
-    def current(self):
-        return self.src[self.cursor]
-    
-    @property
-    def finished(self):
-        return self.cursor+1 == len(self.src)
+    def pop_scope(self, top:int):
+        base = self.frames.pop()
+        self.regs[base:top] = [None] * (top - base)
+
+    def call(self, ret:int, dst:int, base:int, top:int, blank:tuple):
+        """
+        Saves the registers of a function's scope and clears them for the
+        call, blank being top - base Nones. A recursive call saves the
+        scope of the call it was made from, and every other call saves
+        whatever of the caller's shares registers with the scope.
+        """
+        regs = self.regs
+        self.calls.append((ret, dst, base, top, regs[base:top]))
+        regs[base:top] = blank
+
+    def ret(self, value):
+        """
+        Puts the registers saved by the innermost call back, stores the value
+        returned and gives the index to carry on from.
+        """
+        if not self.calls:
+            raise RuntimeError("Returned from a function that was not called.")
+        ret, dst, base, top, saved = self.calls.pop()
+        regs = self.regs
+        regs[base:top] = saved
+        regs[dst] = value
+        return ret
 
 class Executor:
     """Runs the supplied bytecode."""
-    def __init__(self, bytecode:list[int | str]) -> None:
-        self.blocks:dict[int, int] = {}
+
+    PRELUDE = {bc.ALLOCA, bc.NUM, bc.STR}
+    """
+    The instructions that are executed before START is reached.
+    """
+    BOUND = {bc.NUM, bc.STR, bc.CMP_JUMP, bc.ADD, bc.ADD_STORE, bc.FMT_STDOUT, bc.FUNC, bc.END_FUNC, bc.CALL, bc.SPAWN}
+    """
+    The instructions bind does more for than look up their handler, the
+    rest skip its match.
+    """
+
+    def __init__(self, bytecode:bc.ByteCode | Program, stdin:Input = None, stdout:Output = None) -> None:
+        self.program = bytecode if isinstance(bytecode, Program) else Decoder(bytecode).decode()
+        """
+        This is the decoded program that is interpreted by the executor.
+        """
+        self.stdin = Input.stdin() if stdin is None else stdin
+        self.stdout = Output.stdout() if stdout is None else stdout
+        """
+        The channels STDIN reads from and STDOUT writes to, STDOUT is
+        flushed when the program ends.
         """
-        Each block name is associated with an integer which
-        tells the bytecode parser where to jump to.
+        self.write = self.stdout.write
+        self.registers = RegisterFile(self.program.registers)
+        self.regs = self.registers.regs
+        self.code = self.bind(self.program)
         """
-        self.bytecode = ByteCursor(bytecode)
+        Every instruction of the program as a (handler, operands) pair.
+        Jump targets are already resolved to instruction indices.
         """
-        This is the raw bytecode that is interpreted by the executor.
+        self.workers:Workers = None
         """
-        self.stack = ScopeStack()
+        The workers the program spawned and the channels it made, only set
+        up by the first instruction that needs them.
+        """
+
+    def bind(self, program:Program):
+        handlers = {
+            bc.ALLOCA: self._alloca,
+            bc.STORE: self._store,
+            bc.DEL: self._del,
+            bc.EQ: self._eq,
+            bc.GT: self._gt,
+            bc.GTE: self._gte,
+            bc.LT: self._lt,
+            bc.LTE: self._lte,
+            bc.NEQ: self._neq,
+            bc.ADD: self._add,
+            bc.SUB: self._sub,
+            bc.MUL: self._mul,
+            bc.DIV: self._div,
+            bc.MOD: self._mod,
+            bc.EXP: self._exp,
+            bc.NUM: self._num,
+            bc.STR: self._str,
+            bc.FMT: self._fmt,
+            bc.STDOUT: self._stdout,
+            bc.STDIN: self._stdin,
+            bc.BEGIN_SCOPE: self._begin_scope,
+            bc.END_SCOPE: self._end_scope,
+            bc.BLOCK: self._nop,
+            bc.START: self._nop,
+            bc.JUMP: self._jump,
+            bc.COND_JUMP: self._cond_jump,
+            bc.CAST_STR: self._cast_str,
+            bc.CAST_NUM: self._cast_num,
+            bc.FMT_NUM: self._fmt_num,
+            bc.ARRAY: self._array,
+            bc.FILL: self._fill,
+            bc.RANGE: self._range,
+            bc.LOAD: self._load,
+            bc.INDEX: self._index,
+            bc.SLICE: self._slice,
+            bc.LEN: self._len,
+            bc.SUM: self._sum,
+            bc.MIN: self._min,
+            bc.MAX: self._max,
+            bc.MEAN: self._mean,
+            bc.RET: self._ret,
+            bc.END_FUNC: self._end_func,
+            bc.CHAN: self._chan,
+            bc.SEND: self._send,
+            bc.RECV: self._recv,
+            bc.JOIN: self._join,
+        }
+        code:list[tuple] = []
+        append = self._append
+        functions:dict[int, tuple] = {}
+        """
+        Each function's block id is associated with where its body ends,
+        and the registers of its scope, filled in at its END_FUNC.
+        """
+        later:list[int] = []
+        """
+        The FUNCs and CALLs, bound once every function's end is known.
+        """
+        for op, operands in program.code:
+            if op in bc.JUMPS:
+                operands = (program.blocks[operands[0]], *operands[1:])
+            if op in self.BOUND:
+                match op:
+                    case bc.NUM | bc.STR:
+                        operands = (operands[0], program.constants[operands[1]])
+                    case bc.CMP_JUMP:
+                        target, compare, cond, lhs, rhs, keep = operands
+                        if keep:
+                            code.append((self._cmp_jump_keep, (target, COMPARE[compare], cond, lhs, rhs)))
+                        else:
+                            code.append((self._cmp_jump, (target, COMPARE[compare], lhs, rhs)))
+                        continue
+                    case bc.ADD if operands[0] == operands[1]:
+                        code.append((append, operands))
+                        continue
+                    case bc.ADD_STORE:
+                        dst, tmp, lhs, rhs, keep = operands
+                        if keep:
+                            code.append((self._add_store_keep, (dst, tmp, lhs, rhs)))
+                        else:
+                            code.append((append if dst == lhs else self._add, (dst, lhs, rhs)))
+                        continue
+                    case bc.FMT_STDOUT:
+                        msg, string, keep, *items = operands
+                        if keep:
+                            code.append((self._fmt_stdout_keep, (msg, string, *items)))
+                        else:
+                            code.append((self._fmt_stdout, (string, *items)))
+                        continue
+                    case bc.FUNC | bc.CALL:
+                        later.append(len(code))
+                        code.append(None)
+                        continue
+                    case bc.END_FUNC:
+                        func, base, top = operands
+                        functions[func] = (len(code) + 1, base, top, (None,) * (top - base))
+                    case bc.SPAWN:
+                        code.append((self._spawn, (program.blocks[operands[0]], operands[1])))
+                        continue
+            code.append((handlers[op], operands))
+        for i in later:
+            op, operands = program.code[i]
+            if op == bc.FUNC:
+                # the body only runs when it is called, falling into it skips it
+                code[i] = (self._jump, (functions[operands[0]][0],))
+            else:
+                func, dst, *args = operands
+                _, base, top, blank = functions[func]
+                code[i] = (self._call_one if len(args) == 1 else self._call, (program.blocks[func], i + 1, dst, base, top, blank, *args))
+        return code
 
-    def run(self, metadata:dict):
+    def run(self, metadata:dict, profiler:Profiler = None):
         """
         Runs the bytecode contained within the executor.
-        
+
         metadata is the cli args and related things.
 
+        Passing a profiler runs the program through a separate, slower loop
+        that records every instruction into it. Workers that were never
+        joined are joined once the program ends.
         """
-        for byt in self.bytecode:
-            if byt == bc.BLOCK:
-                self._block()
-        
-        self.bytecode.cursor = -1
-        
-        start = False
-        while not self.bytecode.finished:
-            byt = self.bytecode.next()
-            if start:
-                match byt:
-                    case bc.ENDL:
-                        pass
-                    case bc.ALLOCA:
-                        self._alloca()
-                    case bc.STORE:
-                        self._store()
-                    case bc.DEL:
-                        self._del()
-                    case bc.EQ:
-                        self._eq()
-                    case bc.GT:
-                        self._gt()
-                    case bc.GTE:
-                        self._gte()
-                    case bc.LT:
-                        self._lt()
-                    case bc.LTE:
-                        self._lte()
-                    case bc.NEQ:
-                        self._neq()
-                    case bc.ADD:
-                        self._add()
-                    case bc.SUB:
-                        self._sub()
-                    case bc.MUL:
-                        self._mul()
-                    case bc.DIV:
-                        self._div()
-                    case bc.MOD:
-                        self._mod()
-                    case bc.EXP:
-                        self._exp()
-                    case bc.NUM:
-                        self._num()
-                    case bc.STR:
-                        self._str()
-                    case bc.FMT:
-                        self._fmt()
-                    case bc.STDOUT:
-                        self._stdout()
-                    case bc.STDIN:
-                        self._stdin()
-                    case bc.BEGIN_SCOPE:
-                        self.stack.new_scope()
-                    case bc.END_SCOPE:
-                        self.stack.pop_scope()
-                    case bc.BLOCK:
-                        self._block()
-                    case bc.JUMP:
-                        self._jump()
-                    case bc.COND_JUMP:
-                        self._cond_jump()
-                    case bc.CAST_STR:
-                        self._cast_str()
-                    case bc.CAST_NUM:
-                        self._cast_num()
-                    case bc.FMT_NUM:
-                        self._fmt_num()
-                    case _:
-                        pass
+        try:
+            self._run(profiler)
+            if self.workers is not None:
+                self.workers.join_all(self.write)
+        finally:
+            if self.workers is not None:
+                self.workers.close()
+            self.stdout.flush()
+
+    def _run(self, profiler:Profiler):
+        code = self.code
+        start = self.program.start
+        for i in range(start):
+            if self.program.code[i][0] in self.PRELUDE:
+                handler, operands = code[i]
+                handler(*operands)
+
+        if profiler is not None:
+            return self._run_profiled(profiler)
+        self.run_from(start + 1)
+
+    def run_from(self, pc:int):
+        """Runs from the instruction at pc until the code ends."""
+        code = self.code
+        end = len(code)
+        while pc < end:
+            handler, operands = code[pc]
+            pc += 1
+            target = handler(*operands)
+            if target is not None:
+                pc = target
+
+    def _run_profiled(self, profiler:Profiler):
+        code = self.code
+        counts = profiler.counts
+        times = profiler.times
+        follows = profiler.follows
+        retain = profiler.retain
+        regs = self.regs
+        clock = time.perf_counter_ns
+        pc = self.program.start + 1
+        end = len(code)
+        profiler.begin(regs)
+        while pc < end:
+            handler, operands = code[pc]
+            began = clock()
+            target = handler(*operands)
+            times[pc] += clock() - began
+            counts[pc] += 1
+            retain(regs, pc)
+            if target is None:
+                pc += 1
+                if pc < end:
+                    follows[pc] += 1
             else:
-                match byt:
-                    case bc.ALLOCA:
-                        self._alloca()
-                    case bc.NUM:
-                        self._num()
-                    case bc.STR:
-                        self._str()
-                    case bc.START:
-                        start = True
-    
-    def _alloca(self):
-        self.stack.alloca(next(self.bytecode))
-        next(self.bytecode)
-
-    def _store(self):
-        self.stack.set(next(self.bytecode), self.stack.get(next(self.bytecode)))
-        next(self.bytecode)
-
-    def _del(self):
-        self.stack.remove(next(self.bytecode))
-        next(self.bytecode)
-    
-    def _eq(self):
-        self.stack.set(next(self.bytecode), self.stack.get(next(self.bytecode)) == self.stack.get(next(self.bytecode)))
-        next(self.bytecode)
-
-    def _gt(self):
-        self.stack.set(next(self.bytecode), self.stack.get(next(self.bytecode)) > self.stack.get(next(self.bytecode)))
-        next(self.bytecode)
-
-    def _lt(self):
-        self.stack.set(next(self.bytecode), self.stack.get(next(self.bytecode)) < self.stack.get(next(self.bytecode)))
-        next(self.bytecode)
-
-    def _gte(self):
-        self.stack.set(next(self.bytecode), self.stack.get(next(self.bytecode)) >= self.stack.get(next(self.bytecode)))
-        next(self.bytecode)
-    
-    def _lte(self):
-        self.stack.set(next(self.bytecode), self.stack.get(next(self.bytecode)) <= self.stack.get(next(self.bytecode)))
-        next(self.bytecode)
-    
-    def _neq(self):
-        self.stack.set(next(self.bytecode), self.stack.get(next(self.bytecode)) != self.stack.get(next(self.bytecode)))
-        next(self.bytecode)
-
-    def _add(self):
-        cid = next(self.bytecode)
-        var1 = self.stack.get(next(self.bytecode))
-        var2 = self.stack.get(next(self.bytecode))
-        self.stack.set(cid, var1 + var2)
-        next(self.bytecode)
-    
-    def _sub(self):
-        self.stack.set(next(self.bytecode), self.stack.get(next(self.bytecode)) - self.stack.get(next(self.bytecode)))
-        next(self.bytecode)
-
-    def _mul(self):
-        self.stack.set(next(self.bytecode), self.stack.get(next(self.bytecode)) * self.stack.get(next(self.bytecode)))
-        next(self.bytecode)
-    
-    def _div(self):
-        self.stack.set(next(self.bytecode), self.stack.get(next(self.bytecode)) / self.stack.get(next(self.bytecode)))
-        next(self.bytecode)
-
-    def _mod(self):
-        self.stack.set(next(self.bytecode), self.stack.get(next(self.bytecode)) % self.stack.get(next(self.bytecode)))
-        next(self.bytecode)
-
-    def _exp(self):
-        self.stack.set(next(self.bytecode), self.stack.get(next(self.bytecode)) ** self.stack.get(next(self.bytecode)))
-        next(self.bytecode)
-    
-    def _stdin(self):
-        cid = next(self.bytecode)
-        self.stack.set(cid, input())
-        next(self.bytecode)
-    
-    def _stdout(self):
-        sys.stdout.write(str(self.stack.get(next(self.bytecode))))
-        next(self.bytecode)
-
-    def _num(self):
-        cid = next(self.bytecode)
-        num = ""
-        while (byt := next(self.bytecode)) != bc.ENDL:
-            num += f"{byt}"
-        
-        self.stack.set(cid, float(num))
-    
-    def _str(self):
-        cid = next(self.bytecode)
-        self.stack.set(cid, next(self.bytecode))
-        next(self.bytecode) # endl
-    
-    def _cast_num(self):
-        cid = next(self.bytecode)
-        self.stack.set(cid, float(self.stack.get(next(self.bytecode))))
-        next(self.bytecode) # endl
-
-    def _fmt_num(self):
-        cid = next(self.bytecode)
-        num = self.stack.get(next(self.bytecode))
-        precision = int(self.stack.get(next(self.bytecode)))
-        if precision == 0:
-            self.stack.set(cid, f"{int(num)}")
-        else:
-            self.stack.set(cid, f"%.{precision}f" % num)
-        next(self.bytecode) # endl
-
-    def _cast_str(self):
-        cid = next(self.bytecode)
-        self.stack.set(cid, str(self.stack.get(next(self.bytecode))))
-        next(self.bytecode) # endl
-
-    def _fmt(self):
-        cid = next(self.bytecode)
-        string:str = self.stack.get(next(self.bytecode))
-        fmt_args = []
-        while (byt := next(self.bytecode)) != bc.ENDL:
-            fmt_args.append(self.stack.get(byt))
-        self.stack.set(cid, string.format(*fmt_args))
-
-    def _block(self):
-        self.blocks[next(self.bytecode)] = self.bytecode.cursor
-        next(self.bytecode)
-    
-    def _jump(self):
-        self.bytecode.jump(self.blocks[next(self.bytecode)])
-
-    def _cond_jump(self):
-        block = next(self.bytecode)
-        cond = self.stack.get(next(self.bytecode))
+                pc = target
+
+    def _nop(self, *operands):
+        pass
+
+    def _alloca(self, cid):
+        self.regs[cid] = None
+
+    def _store(self, cid, src):
+        regs = self.regs
+        regs[cid] = regs[src]
+
+    def _del(self, cid):
+        self.regs[cid] = None
+
+    def _eq(self, cid, lhs, rhs):
+        regs = self.regs
+        regs[cid] = regs[lhs] == regs[rhs]
+
+    def _gt(self, cid, lhs, rhs):
+        regs = self.regs
+        regs[cid] = regs[lhs] > regs[rhs]
+
+    def _lt(self, cid, lhs, rhs):
+        regs = self.regs
+        regs[cid] = regs[lhs] < regs[rhs]
+
+    def _gte(self, cid, lhs, rhs):
+        regs = self.regs
+        regs[cid] = regs[lhs] >= regs[rhs]
+
+    def _lte(self, cid, lhs, rhs):
+        regs = self.regs
+        regs[cid] = regs[lhs] <= regs[rhs]
+
+    def _neq(self, cid, lhs, rhs):
+        regs = self.regs
+        regs[cid] = regs[lhs] != regs[rhs]
+
+    def _add(self, cid, lhs, rhs):
+        regs = self.regs
+        regs[cid] = regs[lhs] + regs[rhs]
+
+    def _append(self, cid, lhs, rhs):
+        """ADD onto its own left operand, which turns long strings into ropes so appending stays cheap."""
+        regs = self.regs
+        value = regs[lhs]
+        if type(value) is str and len(value) >= Rope.MIN_LENGTH:
+            value = Rope(value)
+        regs[cid] = value + regs[rhs]
+
+    def _sub(self, cid, lhs, rhs):
+        regs = self.regs
+        regs[cid] = regs[lhs] - regs[rhs]
+
+    def _mul(self, cid, lhs, rhs):
+        regs = self.regs
+        regs[cid] = regs[lhs] * regs[rhs]
+
+    def _div(self, cid, lhs, rhs):
+        regs = self.regs
+        regs[cid] = regs[lhs] / regs[rhs]
+
+    def _mod(self, cid, lhs, rhs):
+        regs = self.regs
+        regs[cid] = regs[lhs] % regs[rhs]
+
+    def _exp(self, cid, lhs, rhs):
+        regs = self.regs
+        regs[cid] = regs[lhs] ** regs[rhs]
+
+    def _stdin(self, cid):
+        if self.stdin.interactive:
+            self.stdout.flush() # whoever is typing gets to see the prompt
+        self.regs[cid] = self.stdin.readline()
+
+    def _stdout(self, out):
+        self.write(str(self.regs[out]))
+
+    def _num(self, cid, num):
+        self.regs[cid] = num
+
+    def _str(self, cid, string):
+        self.regs[cid] = string
+
+    def _cast_num(self, cid, src):
+        regs = self.regs
+        regs[cid] = float(regs[src])
+
+    def _fmt_num(self, cid, src, precision):
+        regs = self.regs
+        regs[cid] = format_num(regs[src], regs[precision])
+
+    def _cast_str(self, cid, src):
+        regs = self.regs
+        regs[cid] = str(regs[src])
+
+    def _fmt(self, cid, string, *items):
+        regs = self.regs
+        regs[cid] = str(regs[string]).format(*[regs[item] for item in items])
+
+    def _begin_scope(self, base):
+        self.registers.new_scope(base)
+
+    def _end_scope(self, base, top):
+        self.registers.pop_scope(top)
+
+    def _jump(self, target):
+        return target
+
+    def _call(self, target, ret, dst, base, top, blank, *args):
+        regs = self.regs
+        values = [regs[arg] for arg in args] # the arguments may live in the scope the call clears
+        self.registers.call(ret, dst, base, top, blank)
+        regs[base:base + len(values)] = values
+        return target
+
+    def _call_one(self, target, ret, dst, base, top, blank, arg):
+        regs = self.regs
+        arg = regs[arg]
+        self.registers.call(ret, dst, base, top, blank)
+        regs[base] = arg
+        return target
+
+    def _ret(self, value):
+        return self.registers.ret(self.regs[value])
+
+    def _end_func(self, func, base, top):
+        # running off the end of a function returns nothing
+        return self.registers.ret(None)
+
+    def _workers(self) -> Workers:
+        if self.workers is None:
+            self.workers = Workers(self.program)
+        return self.workers
+
+    def _chan(self, cid, capacity):
+        self.regs[cid] = self._workers().channel(self.regs[capacity])
+
+    def _spawn(self, target, cid):
+        self.regs[cid] = self._workers().spawn(target, self.regs)
+
+    def _send(self, chan, value):
+        self._workers().send(self.regs[chan], self.regs[value])
+
+    def _recv(self, cid, chan):
+        self.regs[cid] = self._workers().recv(self.regs[chan])
+
+    def _join(self, cid, task):
+        self.regs[cid] = self._workers().join(self.regs[task], self.write)
+
+    def _cond_jump(self, target, cond):
+        if self.regs[cond]:
+            return target
+
+    def _cmp_jump(self, target, compare, lhs, rhs):
+        regs = self.regs
+        if compare(regs[lhs], regs[rhs]):
+            return target
+
+    def _cmp_jump_keep(self, target, compare, cond, lhs, rhs):
+        regs = self.regs
+        regs[cond] = cond = compare(regs[lhs], regs[rhs])
         if cond:
-            self.bytecode.jump(self.blocks[block])
-        else:
-            next(self.bytecode)
-    
-    
+            return target
+
+    def _add_store_keep(self, dst, tmp, lhs, rhs):
+        regs = self.regs
+        regs[dst] = regs[tmp] = regs[lhs] + regs[rhs]
+
+    def _fmt_stdout(self, string, *items):
+        regs = self.regs
+        self.write(str(regs[string]).format(*[regs[item] for item in items]))
+
+    def _fmt_stdout_keep(self, msg, string, *items):
+        regs = self.regs
+        regs[msg] = str(regs[string]).format(*[regs[item] for item in items])
+        self.write(str(regs[msg]))
+
+    # arrays are never changed in place, so slices can share memory with their array
+
+    def _array(self, cid, size):
+        self.regs[cid] = np.zeros(int(self.regs[size]))
+
+    def _fill(self, cid, size, value):
+        regs = self.regs
+        regs[cid] = np.full(int(regs[size]), regs[value], dtype=float)
+
+    def _range(self, cid, start, stop):
+        regs = self.regs
+        regs[cid] = np.arange(regs[start], regs[stop], dtype=float)
+
+    def _load(self, cid, path):
+        with open(self.regs[path]) as f:
+            self.regs[cid] = np.array(f.read().split(), dtype=float)
+
+    def _index(self, cid, array, index):
+        regs = self.regs
+        regs[cid] = float(regs[array][int(regs[index])])
+
+    def _slice(self, cid, array, start, stop):
+        regs = self.regs
+        regs[cid] = regs[array][int(regs[start]):int(regs[stop])]
+
+    def _len(self, cid, array):
+        self.regs[cid] = float(len(self.regs[array]))
+
+    def _sum(self, cid, array):
+        self.regs[cid] = float(np.sum(self.regs[array]))
+
+    def _min(self, cid, array):
+        self.regs[cid] = float(np.min(self.regs[array]))
+
+    def _max(self, cid, array):
+        self.regs[cid] = float(np.max(self.regs[array]))
+
+    def _mean(self, cid, array):
+        self.regs[cid] = float(np.mean(self.regs[array]))
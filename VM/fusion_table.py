@@ -0,0 +1,11 @@
+# generated by `python -m VM.superinstructions`, edit by regenerating from profiling data
+FUSIONS = [
+    ("NEQ", "COND_JUMP"),
+    ("ADD", "STORE"),
+    ("FMT", "STDOUT"),
+    ("EQ", "COND_JUMP"),
+    ("LT", "COND_JUMP"),
+    ("GT", "COND_JUMP"),
+    ("LTE", "COND_JUMP"),
+    ("GTE", "COND_JUMP"),
+]
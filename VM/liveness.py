@@ -0,0 +1,280 @@
+"""
+Liveness analysis over the control flow graph, and the register
+allocator built on it.
+"""
+
+import heapq
+from . import bytecodes as bc
+from .decoder import Program, effects
+from .cfg import CFG
+
+LITERALS = {
+    bc.NUM: {1}, bc.STR: {1}, bc.JUMP: {0}, bc.BLOCK: {0}, bc.COND_JUMP: {0},
+    bc.CMP_JUMP: {0, 1, 5}, bc.ADD_STORE: {4}, bc.FMT_STDOUT: {2},
+}
+"""
+The operand positions of each decoded instruction that are not registers.
+"""
+
+NUMERIC = {bc.ADD, bc.SUB, bc.MUL, bc.DIV, bc.MOD, bc.EXP, bc.EQ, bc.NEQ, bc.GT, bc.LT, bc.GTE, bc.LTE, bc.ADD_STORE, bc.CMP_JUMP}
+"""
+Instructions that write a number when they only read numbers, and maybe
+a long string or an array otherwise.
+"""
+
+SMALL = {
+    bc.NUM: "num", bc.CAST_NUM: "num", bc.INDEX: "num", bc.LEN: "num", bc.SUM: "num",
+    bc.MIN: "num", bc.MAX: "num", bc.MEAN: "num", bc.ALLOCA: "num", bc.DEL: "num",
+    bc.STR: "const", bc.FMT_NUM: "const",
+}
+"""
+Instructions that always write something small, "const" for strings that
+are either shared with the constant pool or short.
+"""
+
+KINDS = ("num", "const", "big")
+
+class Liveness:
+    """Which registers are live on entry to and exit from every basic block."""
+    def __init__(self, program:Program, cfg:CFG = None) -> None:
+        self.program = program
+        self.cfg = CFG(program) if cfg is None else cfg
+        self.live_in:list[set[int]] = [set() for _ in self.cfg.blocks]
+        self.live_out:list[set[int]] = [set() for _ in self.cfg.blocks]
+        self.solve()
+
+    def solve(self):
+        code = self.program.code
+        gen:list[set[int]] = []
+        kill:list[set[int]] = []
+        for block in self.cfg.blocks:
+            used, defined = set(), set()
+            for i in range(block.first, block.end):
+                read, wrote = effects(*code[i])
+                used.update(reg for reg in read if reg not in defined)
+                defined.update(wrote)
+            gen.append(used)
+            kill.append(defined)
+
+        changed = True
+        while changed:
+            changed = False
+            for block in reversed(self.cfg.blocks):
+                out = set()
+                for succ in block.succs:
+                    out |= self.live_in[succ]
+                live = gen[block.index] | (out - kill[block.index])
+                if len(live) != len(self.live_in[block.index]) or len(out) != len(self.live_out[block.index]):
+                    self.live_in[block.index] = live
+                    self.live_out[block.index] = out
+                    changed = True
+
+    def walk(self, block:int):
+        """
+        Yields (index, read, wrote, live) for the block's instructions, last
+        first, live being the registers live right after the instruction.
+        The set is updated in place as the walk goes on.
+        """
+        code = self.program.code
+        live = set(self.live_out[block])
+        block = self.cfg.blocks[block]
+        for i in range(block.end - 1, block.first - 1, -1):
+            read, wrote = effects(*code[i])
+            yield i, read, wrote, live
+            live.difference_update(wrote)
+            live.update(read)
+
+class RegisterAllocator:
+    """
+    Packs a program into as few registers as it needs, and frees large
+    values once nothing reads them any more.
+
+    Every register gets a live range, from the first to the last
+    instruction (in code order) it is live at, and ranges that do not
+    overlap share a register (linear scan). DEL is inserted where a
+    register that may hold a long string or an array stops being live,
+    except inside loops that write it again anyway, where the DEL goes on
+    the loop's exits instead.
+    """
+    def __init__(self) -> None:
+        self.before = 0
+        self.after = 0
+        self.freed = 0
+        """
+        How many DELs were inserted.
+        """
+
+    def allocate(self, program:Program):
+        """Rewrites the program in place."""
+        self.before = self.after = program.registers
+        if any(op in (bc.BEGIN_SCOPE, bc.END_SCOPE) or op in bc.CALLS or op in bc.PARALLEL for op, _ in program.code):
+            return # scopes and functions hand out fixed register ranges, workers read registers from where they were spawned
+        cfg = CFG(program)
+        if cfg.entry is None:
+            return
+        # frees go in first, while every register still holds one kind of value
+        if self.free(program, cfg):
+            program.link()
+            cfg = CFG(program)
+        self.rename(program, cfg)
+        self.prune(program)
+        program.link()
+
+    def rename(self, program:Program, cfg:CFG):
+        liveness = Liveness(program, cfg)
+        code = program.code
+        start:dict[int, int] = {}
+        end:dict[int, int] = {}
+        def extend(reg, i):
+            if reg not in start or i < start[reg]:
+                start[reg] = i
+            if reg not in end or i > end[reg]:
+                end[reg] = i
+
+        # the prelude writes its registers before anything runs, and registers
+        # read before they are written have to still be None then
+        for i in range(program.start):
+            for reg in effects(*code[i])[1]:
+                extend(reg, -1)
+        for reg in liveness.live_in[cfg.entry]:
+            extend(reg, -1)
+        for block in cfg.blocks:
+            for reg in liveness.live_in[block.index]:
+                extend(reg, block.first)
+            for reg in liveness.live_out[block.index]:
+                extend(reg, block.end - 1)
+            for i, read, wrote, _ in liveness.walk(block.index):
+                for reg in (*read, *wrote):
+                    extend(reg, i)
+
+        mapping:dict[int, int] = {}
+        active:list[tuple[int, int]] = [] # (end, register) of the ranges still going
+        free:list[int] = []
+        registers = 0
+        for reg in sorted(start, key=lambda reg: (start[reg], reg)):
+            while active and active[0][0] < start[reg]:
+                heapq.heappush(free, heapq.heappop(active)[1])
+            if free:
+                mapping[reg] = heapq.heappop(free)
+            else:
+                mapping[reg] = registers
+                registers += 1
+            heapq.heappush(active, (end[reg], mapping[reg]))
+
+        for i, (op, operands) in enumerate(code):
+            literals = LITERALS.get(op, ())
+            # fused instructions that skip their temporary keep an unused operand, any register does
+            code[i] = (op, tuple(
+                value if n in literals else mapping.get(value, 0)
+                for n, value in enumerate(operands)
+            ))
+            if registers == 0 and len(literals) < len(operands):
+                registers = 1
+        program.registers = self.after = registers
+
+    def kinds(self, program:Program):
+        """Whether each register only ever holds numbers, short strings, or maybe something big."""
+        kinds:dict[int, str] = {}
+        changed = True
+        while changed:
+            changed = False
+            for op, operands in program.code:
+                read, wrote = effects(op, operands)
+                if op in SMALL:
+                    kind = SMALL[op]
+                elif op == bc.STORE:
+                    kind = kinds.get(operands[1], "num")
+                elif op in NUMERIC:
+                    kind = "num" if all(kinds.get(reg, "num") == "num" for reg in read) else "big"
+                else:
+                    kind = "big"
+                for reg in wrote:
+                    if KINDS.index(kind) > KINDS.index(kinds.get(reg, "num")):
+                        kinds[reg] = kind
+                        changed = True
+        return kinds
+
+    def free(self, program:Program, cfg:CFG):
+        liveness = Liveness(program, cfg)
+        code = program.code
+        kinds = self.kinds(program)
+        loops = cfg.loops()
+        written = [
+            {reg for b in loop.body for i in range(cfg.blocks[b].first, cfg.blocks[b].end) for reg in effects(*code[i])[1]}
+            for loop in loops
+        ]
+        rewritten:list[set[int]] = [set() for _ in cfg.blocks]
+        """
+        The registers each basic block's enclosing loops write again.
+        """
+        for loop, regs in zip(loops, written):
+            for b in loop.body:
+                rewritten[b] |= regs
+        frees:dict[int, set[int]] = {}
+        """
+        Each index is associated with the registers freed right before it.
+        """
+        def release(block:int, at:int, regs):
+            regs = {reg for reg in regs if kinds.get(reg) == "big" and reg not in rewritten[block]}
+            if regs and at > program.start:
+                frees.setdefault(at, set()).update(regs)
+
+        for block in cfg.blocks:
+            if cfg.idom[block.index] is None:
+                continue
+            for i, read, wrote, live in liveness.walk(block.index):
+                if code[i][0] not in bc.JUMPS:
+                    release(block.index, i + 1, [reg for reg in read if reg not in live and reg not in wrote])
+            # values that stop being live on the way into the block, or that a loop left behind
+            dead = set()
+            for pred in block.preds:
+                dead |= liveness.live_out[pred]
+            for loop, regs in zip(loops, written):
+                if block.index not in loop.body and any(pred in loop.body for pred in block.preds):
+                    dead |= regs
+            at = block.first + 1 if code[block.first][0] == bc.BLOCK else block.first
+            release(block.index, at, dead - liveness.live_in[block.index])
+
+        if not frees:
+            return False
+        rewritten_code:list[tuple[int, tuple]] = []
+        lines:list[int] = []
+        for i, instr in enumerate(code):
+            for reg in sorted(frees.get(i, ())):
+                rewritten_code.append((bc.DEL, (reg,)))
+                lines.append(program.lines[i - 1])
+                self.freed += 1
+            rewritten_code.append(instr)
+            lines.append(program.lines[i])
+        for reg in sorted(frees.get(len(code), ())):
+            rewritten_code.append((bc.DEL, (reg,)))
+            lines.append(program.lines[-1])
+            self.freed += 1
+        program.code = rewritten_code
+        program.lines = lines
+        return True
+
+    def prune(self, program:Program):
+        """
+        Drops the DELs that renaming put right before another write of the
+        same register, and the ones the program ends on anyway.
+        """
+        code = program.code
+        keep = [True] * len(code)
+        for i in range(len(code) - 1, -1, -1):
+            if code[i][0] != bc.DEL:
+                continue
+            reg = code[i][1][0]
+            for j in range(i + 1, len(code)):
+                if code[j][0] == bc.DEL and keep[j]:
+                    continue
+                read, wrote = effects(*code[j])
+                if reg in wrote and reg not in read and code[j][0] not in (bc.BLOCK, *bc.JUMPS):
+                    keep[i] = False
+                    self.freed -= 1
+                break
+            else:
+                keep[i] = False
+                self.freed -= 1
+        program.code = [instr for instr, kept in zip(code, keep) if kept]
+        program.lines = [line for line, kept in zip(program.lines, keep) if kept]
@@ -0,0 +1,516 @@
+import operator
+from . import bytecodes as bc
+from .decoder import Program, writes, reads, replace_reads
+from .executor import Executor, format_num
+from .cfg import CFG, Loop
+from .liveness import RegisterAllocator
+
+FOLD = {
+    bc.ADD: operator.add,
+    bc.SUB: operator.sub,
+    bc.MUL: operator.mul,
+    bc.DIV: operator.truediv,
+    bc.MOD: operator.mod,
+    bc.EXP: operator.pow,
+    bc.EQ: operator.eq,
+    bc.NEQ: operator.ne,
+    bc.GT: operator.gt,
+    bc.LT: operator.lt,
+    bc.GTE: operator.ge,
+    bc.LTE: operator.le,
+    bc.CAST_NUM: float,
+    bc.CAST_STR: str,
+    bc.FMT_NUM: format_num,
+    bc.FMT: lambda string, *items: string.format(*items),
+}
+"""
+Instructions that can be evaluated at compile time once all of
+the registers they read hold known constants.
+"""
+
+IMPURE = {bc.STDIN, bc.STDOUT, *bc.JUMPS, bc.BLOCK, bc.START, bc.BEGIN_SCOPE, bc.END_SCOPE, bc.ADD_STORE, bc.FMT_STDOUT, bc.LOAD}
+"""
+Instructions that are never removed, even if nothing reads what they write.
+"""
+
+SAFE = {bc.STORE, bc.NUM, bc.STR, bc.ALLOCA, bc.DEL, bc.CAST_STR}
+"""
+Instructions that never raise, whatever their registers hold.
+"""
+
+SAFE_ON = {
+    float: {bc.ADD, bc.SUB, bc.MUL, bc.EQ, bc.NEQ, bc.GT, bc.LT, bc.GTE, bc.LTE, bc.CAST_NUM},
+    str: {bc.ADD, bc.EQ, bc.NEQ, bc.GT, bc.LT, bc.GTE, bc.LTE},
+}
+"""
+Instructions that never raise when every register they read holds a number,
+or every one a string. DIV, MOD and EXP can still raise on numbers.
+"""
+
+def _kind(value):
+    if isinstance(value, str):
+        return str
+    if isinstance(value, (int, float)):
+        return float # booleans included
+    return None
+
+class Optimizer:
+    """
+    Rewrites a decoded program before it is executed.
+
+    Code before START doubles as the prelude, so the passes never
+    add a prelude instruction there or change what the prelude leaves
+    in a register that is read.
+    """
+
+    PASSES = ("thread", "fold", "copy", "licm", "dse", "fuse", "regs")
+    """
+    thread  retargets jumps that land on another JUMP and drops jumps to the next instruction
+    fold    folds instructions on constants into NUM or STR and propagates the result
+    copy    renames reads of STORE copies and writes results straight into their STORE target
+    licm    hoists loop invariant instructions into the loop's preheader
+    dse     removes writes that are never read
+    fuse    replaces the instruction pairs in the fusion table with superinstructions,
+            this always runs once, after the other passes settle
+    regs    packs the registers by liveness and frees long strings and arrays after their last read,
+            this runs once, last
+    """
+
+    ROUNDS = 8
+
+    def __init__(self, passes:list[str] = None) -> None:
+        self.passes = list(self.PASSES if passes is None else passes)
+        for name in self.passes:
+            if name not in self.PASSES:
+                raise RuntimeError(f"Unknown optimization pass {name}.")
+        self.before = 0
+        self.after = 0
+        self.registers = (0, 0)
+        """
+        The register count before and after the regs pass.
+        """
+
+    def optimize(self, program:Program):
+        """Returns an optimized copy of the program."""
+        self.program = Program(list(program.code), dict(program.blocks), program.start, program.registers, list(program.constants),
+                               list(program.lines), dict(program.names))
+        self.constant_ids = {(type(value), value): i for i, value in enumerate(self.program.constants)}
+        self.before = self.after = len(self.program.code)
+        self.registers = (self.program.registers, self.program.registers)
+        if any(op in bc.CALLS or op in bc.PARALLEL for op, _ in self.program.code):
+            return self.program # RET goes back to wherever the call came from and workers start anywhere, which the passes cannot follow
+
+        for _ in range(self.ROUNDS):
+            changed = False
+            for name in self.passes:
+                if name in ("fuse", "regs"):
+                    continue
+                changed |= getattr(self, f"_{name}")()
+                self.compact()
+                self.program.link()
+            if not changed:
+                break
+        if "fuse" in self.passes:
+            from .superinstructions import Fuser
+            Fuser().fuse(self.program)
+        self.registers = (self.program.registers, self.program.registers)
+        if "regs" in self.passes:
+            allocator = RegisterAllocator()
+            allocator.allocate(self.program)
+            self.registers = (allocator.before, allocator.after)
+
+        self.after = len(self.program.code)
+        return self.program
+
+    def report(self):
+        before, after = self.registers
+        return f"optimizer ({', '.join(self.passes)}): {self.before} -> {self.after} instructions, {before} -> {after} registers"
+
+    def compact(self):
+        """Drops the removed instructions, along with their source lines."""
+        program = self.program
+        program.lines = [line for instr, line in zip(program.code, program.lines) if instr is not None]
+        program.code = [instr for instr in program.code if instr is not None]
+
+    def constant(self, value:int | float | str | bool):
+        key = (type(value), value)
+        if key not in self.constant_ids:
+            self.constant_ids[key] = len(self.program.constants)
+            self.program.constants.append(value)
+        return self.constant_ids[key]
+
+    def regions(self):
+        """Yields the (first, end) index of every straight line run of code."""
+        code = self.program.code
+        first = 0
+        for i, (op, _) in enumerate(code):
+            if op in (bc.BLOCK, bc.START) and i > first:
+                yield first, i
+                first = i
+            elif op in bc.JUMPS:
+                yield first, i + 1
+                first = i + 1
+        if first < len(code):
+            yield first, len(code)
+
+    def counts(self):
+        """Counts how often every register is written and read."""
+        defs:dict[int, int] = {}
+        uses:dict[int, int] = {}
+        for op, operands in self.program.code:
+            if op == bc.END_SCOPE:
+                for reg in range(*operands):
+                    defs[reg] = defs.get(reg, 0) + 1
+                continue
+            dst = writes(op, operands)
+            if dst is not None:
+                defs[dst] = defs.get(dst, 0) + 1
+            for reg in reads(op, operands):
+                uses[reg] = uses.get(reg, 0) + 1
+        return defs, uses
+
+    def prelude(self, i:int):
+        """Whether the instruction at i also runs as part of the prelude."""
+        return i < self.program.start and self.program.code[i][0] in Executor.PRELUDE
+
+    def prelude_constants(self, defs:dict[int, int]):
+        """The registers the prelude defines once, before anything reads them, and their constants."""
+        code = self.program.code
+        known = {}
+        for i in range(self.program.start):
+            op, operands = code[i]
+            if op in (bc.NUM, bc.STR) and defs.get(operands[0]) == 1:
+                known[operands[0]] = self.program.constants[operands[1]]
+        return known
+
+    def raising(self):
+        """
+        The indices of the instructions that might raise, going by what kind
+        of value the registers they read are known to hold on every path there.
+        """
+        code = self.program.code
+        constants = self.program.constants
+        defs, _ = self.counts()
+        kinds_everywhere = {reg: _kind(value) for reg, value in self.prelude_constants(defs).items()}
+        raising:set[int] = set()
+        for first, end in self.regions():
+            kinds = dict(kinds_everywhere)
+            for i in range(first, end):
+                op, operands = code[i]
+                if op == bc.END_SCOPE:
+                    for reg in range(*operands):
+                        kinds.pop(reg, None)
+                    continue
+                args = {kinds.get(reg) for reg in reads(op, operands)}
+                safe = op in SAFE or (len(args) == 1 and op in SAFE_ON.get(next(iter(args)), ()))
+                if not safe:
+                    raising.add(i)
+                dst = writes(op, operands)
+                if dst is None:
+                    continue
+                match op:
+                    case bc.NUM | bc.STR:
+                        kind = _kind(constants[operands[1]])
+                    case bc.STORE:
+                        kind = kinds.get(operands[1])
+                    case bc.CAST_STR:
+                        kind = str
+                    case bc.CAST_NUM:
+                        kind = float
+                    case bc.EQ | bc.NEQ | bc.GT | bc.LT | bc.GTE | bc.LTE if args in ({float}, {str}):
+                        kind = float # arrays would compare into arrays
+                    case bc.ADD | bc.SUB | bc.MUL | bc.DIV | bc.MOD | bc.EXP if args in ({float}, {str}):
+                        kind = next(iter(args)) # unless it raised
+                    case _:
+                        kind = None
+                if kind is None:
+                    kinds.pop(dst, None)
+                else:
+                    kinds[dst] = kind
+        return raising
+
+    def _thread(self):
+        code = self.program.code
+        blocks = self.program.blocks
+        changed = False
+
+        def final(block):
+            seen = set()
+            while block in blocks and block not in seen:
+                seen.add(block)
+                i = blocks[block]
+                while i < len(code) and code[i][0] == bc.BLOCK:
+                    i += 1
+                if i == len(code) or code[i][0] != bc.JUMP:
+                    break
+                block = code[i][1][0]
+            return block
+
+        for i, (op, operands) in enumerate(code):
+            if op in bc.JUMPS:
+                target = final(operands[0])
+                if target != operands[0]:
+                    code[i] = (op, (target, *operands[1:]))
+                    changed = True
+
+        for i, (op, operands) in enumerate(code):
+            if op != bc.JUMP:
+                continue
+            j = i + 1
+            while j < len(code) and code[j][0] == bc.BLOCK:
+                if code[j][1][0] == operands[0]:
+                    code[i] = None # falls through to its block anyway
+                    changed = True
+                    break
+                j += 1
+
+        targets = set()
+        for instr in code:
+            if instr is not None and instr[0] in bc.JUMPS:
+                targets.add(instr[1][0])
+        for i, instr in enumerate(code):
+            if instr is not None and instr[0] == bc.BLOCK and instr[1][0] not in targets:
+                code[i] = None
+                changed = True
+        return changed
+
+    def _fold(self):
+        code = self.program.code
+        constants = self.program.constants
+        defs, _ = self.counts()
+        changed = False
+
+        known_everywhere = self.prelude_constants(defs)
+        for first, end in self.regions():
+            known = dict(known_everywhere)
+            for i in range(first, end):
+                op, operands = code[i]
+                if op in (bc.NUM, bc.STR):
+                    known[operands[0]] = constants[operands[1]]
+                    continue
+                if op == bc.END_SCOPE:
+                    for reg in range(*operands):
+                        known.pop(reg, None)
+                    continue
+                dst = writes(op, operands)
+                if dst is None:
+                    continue
+                args = reads(op, operands)
+                if op in FOLD and all(reg in known for reg in args):
+                    try:
+                        value = FOLD[op](*[known[reg] for reg in args])
+                    except Exception:
+                        value = None # left for the executor to raise
+                    # before START a NUM or STR would also run as part of the prelude
+                    if isinstance(value, (float, str, bool)) and i > self.program.start:
+                        kind = bc.STR if isinstance(value, str) else bc.NUM
+                        code[i] = (kind, (dst, self.constant(value)))
+                        known[dst] = value
+                        changed = True
+                        continue
+                known.pop(dst, None)
+        return changed
+
+    def _copy(self):
+        code = self.program.code
+        defs, uses = self.counts()
+        changed = False
+
+        for first, end in self.regions():
+            copies:dict[int, int] = {}
+            for i in range(first, end):
+                op, operands = code[i]
+                renamed = replace_reads(op, operands, copies)
+                if renamed != operands:
+                    code[i] = (op, renamed)
+                    operands = renamed
+                    changed = True
+
+                if op == bc.END_SCOPE:
+                    dead = set(range(*operands))
+                    copies = {dst: src for dst, src in copies.items() if dst not in dead and src not in dead}
+                    continue
+                dst = writes(op, operands)
+                if dst is None:
+                    continue
+                copies = {key: src for key, src in copies.items() if key != dst and src != dst}
+                if op != bc.STORE:
+                    continue
+
+                src = operands[1]
+                if src == dst:
+                    code[i] = None
+                    changed = True
+                    continue
+                if self._coalesce(first, i, dst, src, defs, uses):
+                    changed = True
+                    continue
+                copies[dst] = src
+        return changed
+
+    def _coalesce(self, first:int, i:int, dst:int, src:int, defs:dict, uses:dict):
+        """Writes the only definition of src straight into dst when STORE dst src is its only reader."""
+        code = self.program.code
+        if defs.get(src) != 1 or uses.get(src) != 1:
+            return False
+        for j in range(i - 1, first - 1, -1):
+            if code[j] is None:
+                continue
+            op, operands = code[j]
+            if op == bc.END_SCOPE:
+                return False
+            if writes(op, operands) == src:
+                if op in (bc.ALLOCA, bc.DEL) or self.prelude(j):
+                    return False
+                code[j] = (op, (dst, *operands[1:]))
+                code[i] = None
+                return True
+            if writes(op, operands) == dst or dst in reads(op, operands):
+                return False
+        return False
+
+    def _dse(self):
+        code = self.program.code
+        changed = False
+
+        while True:
+            _, uses = self.counts()
+            raising = self.raising() # a write nothing reads still has to raise where it would have
+            removed = False
+            for i, (op, operands) in enumerate(code):
+                dst = writes(op, operands)
+                if dst is not None and op not in IMPURE and dst not in uses and i not in raising:
+                    code[i] = None
+                    removed = True
+            self.compact()
+            self.program.link()
+            code = self.program.code
+            if not removed:
+                break
+            changed = True
+
+        raising = self.raising()
+        for first, end in self.regions():
+            pending:dict[int, int] = {}
+            for i in range(first, end):
+                op, operands = code[i]
+                for reg in reads(op, operands):
+                    pending.pop(reg, None)
+                if op == bc.END_SCOPE:
+                    for reg in range(*operands):
+                        pending.pop(reg, None)
+                    continue
+                dst = writes(op, operands)
+                if dst is None:
+                    continue
+                if dst in pending:
+                    j = pending[dst]
+                    # overwritten before anything read it, the prelude only
+                    # sees the overwrite if it is a prelude instruction too
+                    if code[j][0] not in IMPURE and j not in raising and (not self.prelude(j) or op in Executor.PRELUDE):
+                        code[j] = None
+                        changed = True
+                pending[dst] = i
+        return changed
+
+    def _licm(self):
+        changed = False
+        while True:
+            cfg = CFG(self.program)
+            for loop in cfg.loops():
+                hoist = self.invariants(cfg, loop)
+                if hoist:
+                    self.hoist(cfg, loop, hoist)
+                    changed = True
+                    break
+            else:
+                return changed
+
+    def invariants(self, cfg:CFG, loop:Loop):
+        """Returns the indices of the instructions that can be hoisted out of the loop, in order."""
+        code = self.program.code
+        blocks = [cfg.blocks[b] for b in loop.body]
+        if any(block.first <= self.program.start for block in blocks):
+            return [] # code before START doubles as the prelude
+        indices = sorted(i for block in blocks for i in range(block.first, block.end))
+        if any(code[i][0] in (bc.BEGIN_SCOPE, bc.END_SCOPE) for i in indices):
+            return []
+
+        header = cfg.blocks[loop.header]
+        if code[header.first][0] != bc.BLOCK:
+            return []
+        if header.index - 1 in loop.body and header.index - 1 in header.preds and code[header.first - 1][0] != bc.JUMP:
+            return [] # the preheader would sit on a back edge
+
+        defs:dict[int, int] = {}
+        for i in indices:
+            dst = writes(*code[i])
+            if dst is not None:
+                defs[dst] = defs.get(dst, 0) + 1
+        exits = loop.exits(cfg)
+
+        # instructions that might raise are only hoisted if they would run
+        # first thing on every iteration, before any I/O
+        unconditional = set()
+        for i in range(header.first, header.end):
+            if code[i][0] in (bc.STDIN, bc.STDOUT):
+                break
+            unconditional.add(i)
+
+        hoist:list[int] = []
+        hoisted:set[int] = set()
+        found = True
+        while found:
+            found = False
+            for i in indices:
+                op, operands = code[i]
+                if i in hoist or (op not in FOLD and op not in (bc.NUM, bc.STR)):
+                    continue
+                dst = operands[0]
+                if defs[dst] != 1 or (op in FOLD and i not in unconditional):
+                    continue
+                if any(reg in defs and reg not in hoisted for reg in reads(op, operands)):
+                    continue
+                block = cfg.block_of[i]
+                if not all(cfg.dominates(block, exit) for exit in exits):
+                    continue
+                if not all(
+                    (cfg.block_of[j] == block and j > i) or (cfg.block_of[j] != block and cfg.dominates(block, cfg.block_of[j]))
+                    for j in indices if dst in reads(*code[j])
+                ):
+                    continue # some read would see the value from before the loop
+                hoist.append(i)
+                hoisted.add(dst)
+                found = True
+        return hoist
+
+    def hoist(self, cfg:CFG, loop:Loop, hoist:list[int]):
+        code = self.program.code
+        lines = self.program.lines
+        header = cfg.blocks[loop.header]
+        label = code[header.first][1][0]
+        preheader = [code[i] for i in hoist]
+        preheader_lines = [lines[i] for i in hoist]
+        for i in hoist:
+            code[i] = None
+
+        entries = []
+        for pred in cfg.blocks[loop.header].preds:
+            last = cfg.blocks[pred].end - 1
+            if pred not in loop.body and code[last] is not None and code[last][0] in bc.JUMPS and code[last][1][0] == label:
+                entries.append(last)
+        if entries:
+            # jumps into the loop go through a new block that holds the preheader
+            new = max(self.program.blocks) + 1
+            for i in entries:
+                op, operands = code[i]
+                code[i] = (op, (new, *operands[1:]))
+            preheader.insert(0, (bc.BLOCK, (new,)))
+            preheader_lines.insert(0, lines[header.first])
+            if label in self.program.names:
+                self.program.names[new] = f"{self.program.names[label]}.preheader"
+
+        code[header.first:header.first] = preheader
+        lines[header.first:header.first] = preheader_lines
+        self.compact()
+        self.program.link()
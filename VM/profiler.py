@@ -0,0 +1,150 @@
+import sys
+import json
+from . import bytecodes as bc
+from .decoder import Program, effects
+
+class Profiler:
+    """
+    Collects execution counts and time per instruction while an executor
+    runs with it, and rolls them up per opcode, per block and per source line.
+    """
+    def __init__(self, program:Program) -> None:
+        self.program = program
+        self.counts = [0] * len(program.code)
+        """
+        How often each instruction ran.
+        """
+        self.times = [0] * len(program.code)
+        """
+        The nanoseconds spent in each instruction.
+        """
+        self.follows = [0] * len(program.code)
+        """
+        How often each instruction ran straight after the instruction before it.
+        """
+        self.written = [effects(op, operands)[1] for op, operands in program.code]
+        self.sizes = [0] * program.registers
+        """
+        The bytes each register retains, as of the last write to it.
+        """
+        self.retained = 0
+        self.held = 0
+        self.peak_bytes = 0
+        """
+        The most bytes the registers retained at once, by sys.getsizeof.
+        """
+        self.peak_registers = 0
+        """
+        The most registers that held something other than None at once.
+        """
+
+    def begin(self, regs:list):
+        """Starts tracking the registers' memory from what the prelude left in them."""
+        for reg, value in enumerate(regs):
+            self.sizes[reg] = 0 if value is None else sys.getsizeof(value)
+        self.retained = sum(self.sizes)
+        self.held = sum(value is not None for value in regs)
+        self.peak_bytes = self.retained
+        self.peak_registers = self.held
+
+    def retain(self, regs:list, pc:int):
+        """Accounts for the registers the instruction at pc just wrote."""
+        sizes = self.sizes
+        for reg in self.written[pc]:
+            value = regs[reg]
+            size = 0 if value is None else sys.getsizeof(value)
+            self.held += (size > 0) - (sizes[reg] > 0)
+            self.retained += size - sizes[reg]
+            sizes[reg] = size
+        if self.retained > self.peak_bytes:
+            self.peak_bytes = self.retained
+        if self.held > self.peak_registers:
+            self.peak_registers = self.held
+
+    def block_names(self):
+        """The name of the block each instruction is in."""
+        program = self.program
+        labels = {index - 1: block for block, index in program.blocks.items()}
+        names:list[str] = []
+        current = "<prelude>"
+        for i, (op, _) in enumerate(program.code):
+            if op == bc.START and i == program.start:
+                current = "<start>"
+            elif i in labels:
+                block = labels[i]
+                current = program.names.get(block, f"block_{block}")
+            names.append(current)
+        return names
+
+    def rollup(self, keys:list):
+        totals:dict = {}
+        for key, count, time in zip(keys, self.counts, self.times):
+            if count:
+                total = totals.setdefault(key, {"count": 0, "time_ns": 0})
+                total["count"] += count
+                total["time_ns"] += time
+        return dict(sorted(totals.items(), key=lambda item: -item[1]["time_ns"]))
+
+    def opcodes(self):
+        return self.rollup([bc.OPNAMES[op] for op, _ in self.program.code])
+
+    def blocks(self):
+        return self.rollup(self.block_names())
+
+    def lines(self):
+        return self.rollup(self.program.lines)
+
+    def pairs(self):
+        """How often each pair of adjacent instructions ran back to back, keyed by "FIRST SECOND"."""
+        code = self.program.code
+        pairs:dict[str, int] = {}
+        for i in range(1, len(code)):
+            if self.follows[i]:
+                key = f"{bc.OPNAMES[code[i - 1][0]]} {bc.OPNAMES[code[i][0]]}"
+                pairs[key] = pairs.get(key, 0) + self.follows[i]
+        return dict(sorted(pairs.items(), key=lambda item: -item[1]))
+
+    def to_json(self):
+        return {
+            "total_ns": sum(self.times),
+            "instructions": sum(self.counts),
+            "registers": self.program.registers,
+            "peak_registers": self.peak_registers,
+            "peak_bytes": self.peak_bytes,
+            "opcodes": self.opcodes(),
+            "blocks": self.blocks(),
+            "lines": {str(line): total for line, total in self.lines().items()},
+            "pairs": self.pairs(),
+        }
+
+    def dump_json(self, path:str):
+        with open(path, "w") as f:
+            json.dump(self.to_json(), f, indent=4)
+
+    def collapsed(self):
+        """
+        The profile in the collapsed stack format flamegraph tools read,
+        one `block;OPCODE;line N nanoseconds` line per instruction that ran.
+        """
+        stacks:dict[str, int] = {}
+        blocks = self.block_names()
+        for i, (op, _) in enumerate(self.program.code):
+            if self.counts[i]:
+                stack = f"{blocks[i]};{bc.OPNAMES[op]};line {self.program.lines[i]}"
+                stacks[stack] = stacks.get(stack, 0) + self.times[i]
+        return "".join(f"{stack} {time}\n" for stack, time in stacks.items())
+
+    def dump_collapsed(self, path:str):
+        with open(path, "w") as f:
+            f.write(self.collapsed())
+
+    def report(self, limit:int = 10):
+        total = sum(self.times) or 1
+        rows = [
+            f"profile: {sum(self.counts)} instructions in {sum(self.times) / 1_000_000:.3f} ms",
+            f"  peak   {self.peak_registers} of {self.program.registers} registers holding {self.peak_bytes} bytes",
+        ]
+        for title, totals in (("opcode", self.opcodes()), ("block", self.blocks())):
+            for key, stats in list(totals.items())[:limit]:
+                rows.append(f"  {title:<6} {key:<20} {stats['count']:>10} {stats['time_ns'] / total:>7.1%}")
+        return "\n".join(rows)
@@ -0,0 +1,116 @@
+"""
+Strings that are built up one ADD at a time.
+
+Python strings are immutable, so `ADD acc acc piece` copies all of acc
+every time it runs and a loop building a string is quadratic. A Rope
+keeps the pieces instead and only joins them when something reads the
+whole string.
+"""
+
+import sys
+
+class Rope:
+    """
+    A string stored as the chunks it was appended from.
+
+    Ropes appended from the same rope share their chunk list, each rope
+    only owns the first `count` chunks of it. Appending to the rope that
+    owns the whole list adds to it in place, appending to an older rope
+    (a copy kept by STORE, say) copies its chunks first, so no rope ever
+    sees another's appends.
+
+    Ropes compare, hash, format and convert like the string they hold.
+    """
+
+    MIN_LENGTH = 16384
+    """
+    How long a string gets before appending to it makes a rope, shorter
+    strings are cheaper to copy than to keep in chunks.
+    """
+
+    __slots__ = ("chunks", "count", "length", "flat")
+
+    def __init__(self, string:str) -> None:
+        self.chunks = [string]
+        self.count = 1
+        self.length = len(string)
+        self.flat:str = string
+        """
+        The joined string, None until something reads it.
+        """
+
+    def __add__(self, other):
+        if type(other) is Rope:
+            other = str(other)
+        elif not isinstance(other, str):
+            return NotImplemented
+        chunks = self.chunks
+        if len(chunks) != self.count:
+            chunks = chunks[:self.count] # someone appended to this rope already
+        chunks.append(other)
+        rope = Rope.__new__(Rope)
+        rope.chunks = chunks
+        rope.count = self.count + 1
+        rope.length = self.length + len(other)
+        rope.flat = None
+        return rope
+
+    def __radd__(self, other):
+        if not isinstance(other, str):
+            return NotImplemented
+        return Rope(other) + str(self)
+
+    def __str__(self):
+        if self.flat is None:
+            self.flat = "".join(self.chunks[:self.count])
+            # later appends start from the joined string instead of every chunk
+            self.chunks = [self.flat]
+            self.count = 1
+        return self.flat
+
+    def __repr__(self):
+        return f"Rope({str(self)!r})"
+
+    def __format__(self, spec:str):
+        return format(str(self), spec)
+
+    def __len__(self):
+        return self.length
+
+    def __bool__(self):
+        return self.length > 0
+
+    def __float__(self):
+        return float(str(self))
+
+    def __getitem__(self, key):
+        return str(self)[key]
+
+    def __hash__(self):
+        return hash(str(self))
+
+    def __eq__(self, other):
+        if isinstance(other, (str, Rope)):
+            return self.length == len(other) and str(self) == str(other)
+        return NotImplemented
+
+    def __ne__(self, other):
+        if isinstance(other, (str, Rope)):
+            return self.length != len(other) or str(self) != str(other)
+        return NotImplemented
+
+    def __lt__(self, other):
+        return str(self) < str(other) if isinstance(other, (str, Rope)) else NotImplemented
+
+    def __le__(self, other):
+        return str(self) <= str(other) if isinstance(other, (str, Rope)) else NotImplemented
+
+    def __gt__(self, other):
+        return str(self) > str(other) if isinstance(other, (str, Rope)) else NotImplemented
+
+    def __ge__(self, other):
+        return str(self) >= str(other) if isinstance(other, (str, Rope)) else NotImplemented
+
+    def __sizeof__(self):
+        # the characters are counted once, however many ropes share the chunks
+        return object.__sizeof__(self) + sys.getsizeof(self.chunks) + self.length
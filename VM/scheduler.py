@@ -0,0 +1,195 @@
+"""
+Runs many programs as asyncio tasks in one process.
+"""
+
+import asyncio
+import functools
+from . import bytecodes as bc
+from .decoder import Program
+from .executor import Executor
+from .channels import Output
+
+WAIT = -1
+"""
+Returned by STDIN instead of a jump target, the run loop awaits the line.
+"""
+
+BLOCKED = -2
+"""
+Returned by SEND, RECV and JOIN instead of a jump target, the run loop
+awaits them in a thread, so the other programs run while they wait on workers.
+"""
+
+class AsyncInput:
+    """STDIN lines that are fed in while the program runs, reading waits for the next one."""
+    def __init__(self) -> None:
+        self.lines:asyncio.Queue[str] = asyncio.Queue()
+        self.interactive = True
+
+    def feed(self, line:str):
+        self.lines.put_nowait(line.rstrip("\r\n"))
+
+    def close(self):
+        """Ends the input, reading past the lines already fed raises EOFError."""
+        self.lines.put_nowait(None)
+
+    async def readline(self):
+        line = await self.lines.get()
+        if line is None:
+            self.lines.put_nowait(None) # later reads hit the end too
+            raise EOFError("STDIN ran out of lines.")
+        return line
+
+class AsyncOutput(Output):
+    """STDOUT as a queue of flushed chunks, that whoever talks to the program reads from."""
+    def __init__(self, policy:str = "line", size:int = Output.SIZE) -> None:
+        super().__init__(None, policy, size)
+        self.chunks:asyncio.Queue[str] = asyncio.Queue()
+
+    def flush(self):
+        if self.buffer:
+            self.chunks.put_nowait("".join(self.buffer))
+            self.buffer.clear()
+            self.buffered = 0
+
+    def close(self):
+        self.flush()
+        self.chunks.put_nowait(None)
+
+    async def read(self):
+        """The next flushed chunk, or "" once the program ended."""
+        chunk = await self.chunks.get()
+        if chunk is None:
+            self.chunks.put_nowait(None)
+            return ""
+        return chunk
+
+class AsyncExecutor(Executor):
+    """
+    Runs the supplied bytecode as a coroutine that hands control back to
+    the event loop after every `budget` instructions and while it waits
+    for STDIN.
+    """
+    def __init__(self, bytecode:bc.ByteCode | Program, stdin:AsyncInput, stdout:AsyncOutput, budget:int = 1000) -> None:
+        super().__init__(bytecode, stdin, stdout)
+        self.budget = budget
+        self.instructions = 0
+        """
+        How many instructions ran so far.
+        """
+        self.waiting:int = None
+        """
+        The register the pending STDIN reads into.
+        """
+        self.blocked:tuple = None
+        """
+        The pending SEND, RECV or JOIN, a call that blocks and what to do with
+        its result back in the event loop.
+        """
+
+    def run(self, metadata:dict, profiler = None):
+        raise RuntimeError("An AsyncExecutor is run with `await executor.run_async()`.")
+
+    async def run_async(self):
+        loop = asyncio.get_running_loop()
+        try:
+            await self._run_async()
+            if self.workers is not None:
+                for task, future in enumerate(self.workers.tasks):
+                    if future is not None:
+                        self._joined(None, await loop.run_in_executor(None, self.workers.result, task))
+        finally:
+            if self.workers is not None and (self.workers.pool is not None or self.workers.manager is not None):
+                await loop.run_in_executor(None, self.workers.close)
+            self.stdout.close()
+
+    async def _run_async(self):
+        code = self.code
+        start = self.program.start
+        for i in range(start):
+            if self.program.code[i][0] in self.PRELUDE:
+                handler, operands = code[i]
+                handler(*operands)
+
+        pc = start + 1
+        end = len(code)
+        budget = self.budget
+        while pc < end:
+            ran = 0
+            while pc < end and ran < budget:
+                handler, operands = code[pc]
+                pc += 1
+                ran += 1
+                target = handler(*operands)
+                if target is not None:
+                    if target == WAIT:
+                        self.stdout.flush()
+                        self.regs[self.waiting] = await self.stdin.readline()
+                    elif target == BLOCKED:
+                        call, then = self.blocked
+                        result = await asyncio.get_running_loop().run_in_executor(None, call)
+                        if then is not None:
+                            then(result)
+                    else:
+                        pc = target
+            self.instructions += ran
+            await asyncio.sleep(0) # let the other programs have a turn
+
+    def _stdin(self, cid):
+        self.waiting = cid
+        return WAIT
+
+    def _send(self, chan, value):
+        self.blocked = (functools.partial(self._workers().send, self.regs[chan], self.regs[value]), None)
+        return BLOCKED
+
+    def _recv(self, cid, chan):
+        self.blocked = (functools.partial(self._workers().recv, self.regs[chan]), functools.partial(self.regs.__setitem__, cid))
+        return BLOCKED
+
+    def _join(self, cid, task):
+        self.blocked = (functools.partial(self._workers().result, self.regs[task]), functools.partial(self._joined, cid))
+        return BLOCKED
+
+    def _joined(self, cid, result:tuple):
+        value, output = result
+        self.write(output)
+        if cid is not None:
+            self.regs[cid] = value
+
+class Session:
+    """One program running under the scheduler, and its channels."""
+    def __init__(self, executor:AsyncExecutor) -> None:
+        self.executor = executor
+        self.stdin:AsyncInput = executor.stdin
+        self.stdout:AsyncOutput = executor.stdout
+        self.task:asyncio.Task = None
+
+    async def output(self):
+        """Everything the program writes, until it ends."""
+        chunks = []
+        while chunk := await self.stdout.read():
+            chunks.append(chunk)
+        return "".join(chunks)
+
+class Scheduler:
+    """
+    Interleaves many programs in one event loop. Each runs as a task that
+    yields after `budget` instructions, so a tight loop cannot starve the
+    others, and waits on its STDIN without using any CPU.
+    """
+    def __init__(self, budget:int = 1000) -> None:
+        self.budget = budget
+        self.sessions:list[Session] = []
+
+    def spawn(self, program:Program, policy:str = "line"):
+        """Starts a program, feed its STDIN and read its STDOUT through the returned session."""
+        session = Session(AsyncExecutor(program, AsyncInput(), AsyncOutput(policy), self.budget))
+        session.task = asyncio.get_running_loop().create_task(session.executor.run_async())
+        self.sessions.append(session)
+        return session
+
+    async def join(self):
+        """Waits for every session to end, returning their errors (None for the ones that finished)."""
+        results = await asyncio.gather(*[session.task for session in self.sessions], return_exceptions=True)
+        return [result if isinstance(result, BaseException) else None for result in results]
@@ -0,0 +1,112 @@
+import json
+import os
+import sys
+from . import bytecodes as bc
+from .decoder import Program, reads
+
+COMPARES = {bc.EQ, bc.NEQ, bc.GT, bc.LT, bc.GTE, bc.LTE}
+
+def _cmp_jump(first:tuple, second:tuple, uses:dict[int, int]):
+    (op, (cond, lhs, rhs)), (_, (block, tested)) = first, second
+    if tested != cond:
+        return None
+    return (bc.CMP_JUMP, (block, op, cond, lhs, rhs, int(uses[cond] > 1)))
+
+def _add_store(first:tuple, second:tuple, uses:dict[int, int]):
+    (_, (tmp, lhs, rhs)), (_, (dst, src)) = first, second
+    if src != tmp or dst == tmp:
+        return None
+    return (bc.ADD_STORE, (dst, tmp, lhs, rhs, int(uses[tmp] > 1)))
+
+def _fmt_stdout(first:tuple, second:tuple, uses:dict[int, int]):
+    (_, (msg, string, *items)), (_, (out,)) = first, second
+    if out != msg:
+        return None
+    return (bc.FMT_STDOUT, (msg, string, int(uses[msg] > 1), *items))
+
+FUSERS = {
+    **{(op, bc.COND_JUMP): _cmp_jump for op in COMPARES},
+    (bc.ADD, bc.STORE): _add_store,
+    (bc.FMT, bc.STDOUT): _fmt_stdout,
+}
+"""
+Each pair of adjacent instructions that has a superinstruction is associated
+with the function that fuses them, or returns None if their operands don't line up.
+
+A fused instruction's last fixed operand says whether the temporary the pair
+passed its result through is read anywhere else, and so still has to be written.
+"""
+
+class Fuser:
+    """Replaces adjacent instruction pairs with superinstructions."""
+    def __init__(self, table:list[tuple[str, str]] = None) -> None:
+        if table is None:
+            from .fusion_table import FUSIONS
+            table = FUSIONS
+        names = {name: op for op, name in bc.OPNAMES.items()}
+        self.pairs = {(names[first], names[second]) for first, second in table}
+        """
+        The instruction pairs that get fused.
+        """
+        for pair in self.pairs:
+            if pair not in FUSERS:
+                raise RuntimeError(f"There is no superinstruction for {bc.OPNAMES[pair[0]]} {bc.OPNAMES[pair[1]]}.")
+        self.fused = 0
+
+    def fuse(self, program:Program):
+        """Fuses the program's code in place."""
+        code = program.code
+        uses:dict[int, int] = {}
+        for op, operands in code:
+            for reg in reads(op, operands):
+                uses[reg] = uses.get(reg, 0) + 1
+
+        fused:list[tuple[int, tuple]] = []
+        lines:list[int] = []
+        i = 0
+        while i < len(code):
+            if i + 1 < len(code) and (code[i][0], code[i + 1][0]) in self.pairs:
+                instr = FUSERS[code[i][0], code[i + 1][0]](code[i], code[i + 1], uses)
+                if instr is not None:
+                    fused.append(instr)
+                    lines.append(program.lines[i])
+                    self.fused += 1
+                    i += 2
+                    continue
+            fused.append(code[i])
+            lines.append(program.lines[i])
+            i += 1
+        program.code = fused
+        program.lines = lines
+        program.link()
+        return program
+
+def regenerate(pairs:dict[str, int], path:str = None, limit:int = None):
+    """
+    Rewrites the fusion table from profiled instruction pair counts,
+    keyed by "FIRST SECOND", so the hottest fusable pairs come first.
+    """
+    path = path or os.path.join(os.path.dirname(__file__), "fusion_table.py")
+    names = {name: op for op, name in bc.OPNAMES.items()}
+    ranked = []
+    for pair, count in sorted(pairs.items(), key=lambda item: -item[1]):
+        first, second = pair.split()
+        if (names.get(first), names.get(second)) in FUSERS and count > 0:
+            ranked.append((first, second))
+    ranked = ranked[:limit]
+
+    with open(path, "w") as f:
+        f.write("# generated by `python -m VM.superinstructions`, edit by regenerating from profiling data\n")
+        f.write("FUSIONS = [\n")
+        for first, second in ranked:
+            f.write(f"    (\"{first}\", \"{second}\"),\n")
+        f.write("]\n")
+    return ranked
+
+if __name__ == "__main__":
+    # python -m VM.superinstructions profile.json [limit]
+    with open(sys.argv[1]) as f:
+        profile = json.load(f)
+    table = regenerate(profile["pairs"], limit=int(sys.argv[2]) if len(sys.argv) > 2 else None)
+    for first, second in table:
+        print(first, second)
@@ -0,0 +1,334 @@
+"""
+A tracing JIT for hot loops.
+
+Every backward jump counts how often it is taken. Once a loop is hot, one
+iteration of it is recorded as it runs and the path it took is compiled
+into a Python closure that replaces the loop's first instruction. The
+closure keeps the registers it touches in locals, computes whatever
+only depends on constants while it is compiled and drops casts its type
+guards prove redundant. Branches that leave the recorded path, and guards that
+fail, hand the registers back and return to the interpreter.
+"""
+
+import operator
+import numpy as np
+from . import bytecodes as bc
+from .decoder import Program, effects
+from .executor import Executor, COMPARE, format_num
+from .channels import Input, Output
+from .rope import Rope
+from .codegen import Codegen, BINARY, _load
+
+TRACEABLE = {
+    bc.BLOCK, bc.ALLOCA, bc.STORE, bc.DEL, bc.NUM, bc.STR, bc.STDIN, bc.STDOUT,
+    bc.ADD, bc.SUB, bc.MUL, bc.DIV, bc.MOD, bc.EXP,
+    bc.EQ, bc.NEQ, bc.GT, bc.LT, bc.GTE, bc.LTE,
+    bc.CAST_NUM, bc.CAST_STR, bc.FMT_NUM, bc.FMT,
+    bc.JUMP, bc.COND_JUMP, bc.CMP_JUMP, bc.ADD_STORE, bc.FMT_STDOUT,
+    bc.ARRAY, bc.FILL, bc.RANGE, bc.LOAD, bc.INDEX, bc.SLICE, bc.LEN,
+    bc.SUM, bc.MIN, bc.MAX, bc.MEAN,
+}
+"""
+The instructions a trace can contain, scopes are left out as the
+interpreter keeps track of them outside of the registers.
+"""
+
+GUARDS = {float: "float", str: "str", bool: "bool", np.ndarray: "np.ndarray", type(None): None}
+"""
+The types a trace can guard on, as they are spelled in the trace.
+"""
+
+RESULTS = {
+    bc.EQ: bool, bc.NEQ: bool, bc.GT: bool, bc.LT: bool, bc.GTE: bool, bc.LTE: bool, bc.CMP_JUMP: bool,
+    bc.CAST_STR: str, bc.FMT: str, bc.FMT_NUM: str, bc.STDIN: str, bc.FMT_STDOUT: str,
+    bc.CAST_NUM: float, bc.INDEX: float, bc.LEN: float, bc.SUM: float, bc.MIN: float, bc.MAX: float, bc.MEAN: float,
+    bc.ARRAY: np.ndarray, bc.FILL: np.ndarray, bc.RANGE: np.ndarray, bc.LOAD: np.ndarray, bc.SLICE: np.ndarray,
+    bc.ALLOCA: type(None), bc.DEL: type(None),
+}
+"""
+The type each instruction writes, whatever its operands are.
+"""
+
+FOLDS = {
+    bc.ADD: operator.add, bc.SUB: operator.sub, bc.MUL: operator.mul, bc.DIV: operator.truediv,
+    bc.MOD: operator.mod, bc.EXP: operator.pow, **COMPARE,
+    bc.CAST_NUM: float, bc.CAST_STR: str, bc.FMT_NUM: format_num, bc.FMT: lambda string, *items: str(string).format(*items),
+}
+"""
+The instructions computed while compiling a trace when all of their operands are constants.
+"""
+
+class TraceCodegen(Codegen):
+    """Generates the Python closure of a recorded trace."""
+    def __init__(self, folded:dict[int, object]) -> None:
+        super().__init__()
+        self.folded = dict(folded)
+        """
+        The registers known to hold a constant at this point of the trace,
+        they are read as literals.
+        """
+        self.types:dict[int, tuple[type, frozenset]] = {reg: (type(value), frozenset()) for reg, value in folded.items()}
+        """
+        The type known to be in each register at this point of the trace,
+        with the registers whose type on entry it follows from.
+        """
+        self.guarded:set[int] = set()
+        """
+        The registers whose type on entry the trace relies on.
+        """
+
+    def register(self, reg:int):
+        if reg in self.folded:
+            return self.constant(self.folded[reg])
+        return f"r{reg}"
+
+    def typeof(self, reg:int):
+        """The type a register is known to hold here, or None."""
+        return self.types[reg][0] if reg in self.types else None
+
+    def guard(self, reg:int):
+        """Makes the trace check the types on entry that the type of the register follows from."""
+        self.guarded |= self.types[reg][1]
+
+    def infer(self, op:int, operands:tuple):
+        """The type an instruction writes and what that follows from, or None if it is not known."""
+        if op in RESULTS:
+            return RESULTS[op], frozenset()
+        match op:
+            case bc.STORE:
+                return self.types.get(operands[1])
+            case bc.ADD | bc.SUB | bc.MUL | bc.DIV | bc.MOD | bc.ADD_STORE:
+                lhs, rhs = operands[2:4] if op == bc.ADD_STORE else operands[1:3]
+                if lhs in self.types and rhs in self.types:
+                    (a, deps), (b, more) = self.types[lhs], self.types[rhs]
+                    if a is b and (a is float or (a is str and op in (bc.ADD, bc.ADD_STORE))):
+                        return a, deps | more
+        return None
+
+    def fold(self, op:int, operands:tuple, constants:list):
+        """The value an instruction writes, if it can be computed now, or None."""
+        if op in (bc.NUM, bc.STR):
+            return constants[operands[1]]
+        if op not in FOLDS or not all(reg in self.folded for reg in operands[1:]):
+            return None
+        try:
+            value = FOLDS[op](*[self.folded[reg] for reg in operands[1:]])
+        except (ArithmeticError, ValueError, TypeError, IndexError, KeyError):
+            return None # left for the trace to raise when it gets there
+        return value if type(value) in (float, str, bool) else None
+
+    def specialized(self, op:int, operands:tuple, program:Program):
+        """The lines of Python an instruction becomes, given what is known at this point."""
+        match op:
+            case bc.CAST_NUM | bc.CAST_STR if self.typeof(operands[1]) is (float if op == bc.CAST_NUM else str):
+                self.guard(operands[1])
+                return [f"r{operands[0]} = {self.register(operands[1])}"]
+            case bc.FMT_NUM if operands[2] in self.folded:
+                precision = int(self.folded[operands[2]])
+                if precision == 0:
+                    return [f"r{operands[0]} = str(int({self.register(operands[1])}))"]
+                return [f"r{operands[0]} = {f'%.{precision}f'!r} % {self.register(operands[1])}"]
+        return self.instruction(op, operands, program.blocks, program.constants)
+
+    def trace(self, program:Program, header:int, path:list[tuple[int, int]], entry:list[type]):
+        """
+        The Python source of a trace, a `make` function that builds its closure.
+
+        path is the (index, jump target) of every instruction of one recorded
+        iteration, from header to the backward jump, entry is the type of
+        every register when the recording started.
+        """
+        code = program.code
+        back_edge = path[-1][0]
+        touched:set[int] = set()
+        written:set[int] = set()
+        for pc, _ in path:
+            read, wrote = effects(*code[pc])
+            touched.update(read, wrote)
+            written.update(wrote)
+        touched -= self.folded.keys()
+        for reg in touched:
+            if entry[reg] in GUARDS:
+                self.types[reg] = (entry[reg], frozenset((reg,)))
+
+        writeback = [f"regs[{reg}] = r{reg}" for reg in sorted(written)]
+        leave = lambda pc: [*writeback, f"return {pc}"]
+        body:list[str] = []
+        for pc, target in path:
+            op, operands = code[pc]
+            wrote = effects(op, operands)[1]
+            result = self.infer(op, operands)
+            for reg in wrote:
+                self.folded.pop(reg, None)
+            if op in bc.JUMPS:
+                if op == bc.JUMP:
+                    continue
+                if op == bc.COND_JUMP:
+                    test = self.register(operands[1])
+                else:
+                    _, compare, cond, lhs, rhs, keep = operands
+                    test = f"{self.register(lhs)} {BINARY[compare]} {self.register(rhs)}"
+                    if keep:
+                        body.append(f"r{cond} = {test}")
+                        test = f"r{cond}"
+                if pc == back_edge or target is not None:
+                    # the recorded iteration carried on at the jump target
+                    body += [f"if not ({test}):", *(f"    {line}" for line in leave(pc + 1))]
+                else:
+                    body += [f"if {test}:", *(f"    {line}" for line in leave(program.blocks[operands[0]]))]
+            elif (value := self.fold(op, operands, program.constants)) is not None:
+                body.append(f"r{operands[0]} = {self.constant(value)}")
+                self.folded[operands[0]] = value
+            else:
+                body += self.specialized(op, operands, program)
+            for reg in wrote:
+                if reg in self.folded:
+                    self.types[reg] = (type(self.folded[reg]), frozenset())
+                elif result is None:
+                    self.types.pop(reg, None)
+                else:
+                    self.types[reg] = result
+
+        check = lambda reg: f"r{reg} is None" if GUARDS[entry[reg]] is None else f"type(r{reg}) is {GUARDS[entry[reg]]}"
+        guards = sorted(self.guarded)
+        unstable = [reg for reg in guards if reg in written and self.types.get(reg, (None,))[0] is not entry[reg]]
+        appended:set[int] = set()
+        for pc, _ in path:
+            match code[pc]:
+                case (bc.ADD, (dst, lhs, _)) | (bc.ADD_STORE, (dst, _, lhs, _, 0)) if dst == lhs:
+                    appended.add(dst)
+        lines = [
+            "def make(regs, miss, readline, write, flush, interactive, format_num, np, load):",
+            f"    def trace_{header}():",
+            *(f"        r{reg} = regs[{reg}]" for reg in sorted(touched)),
+            # a local string appended to is resized in place, which beats a rope
+            *(f"        if type(r{reg}) is Rope: r{reg} = str(r{reg})" for reg in sorted(appended & touched)),
+        ]
+        if guards:
+            lines += [f"        if not ({' and '.join(map(check, guards))}):", "            return miss()"]
+        lines.append("        while True:")
+        if unstable:
+            # a type that changes during an iteration has to be checked again before the next one
+            lines += [f"            if not ({' and '.join(map(check, unstable))}):", *(f"                {line}" for line in leave(header))]
+        lines += [f"            {line}" for line in body or ["pass"]]
+        lines.append(f"    return trace_{header}")
+        return "\n".join(lines) + "\n"
+
+class TracingExecutor(Executor):
+    """
+    Runs the supplied bytecode, compiling the loops that get hot into
+    traces, see TraceCodegen.
+
+    A trace is only entered when the registers hold the types it was
+    specialized on, a loop whose trace keeps failing its guards goes
+    back to being interpreted.
+    """
+
+    HOT = 64
+    """
+    How often a backward jump is taken before its loop is traced.
+    """
+    MAX_TRACE = 256
+    """
+    The longest iteration that gets traced.
+    """
+    MAX_MISSES = 4
+    """
+    How often a trace can fail its guards on entry before it is dropped.
+    """
+
+    def __init__(self, bytecode:bc.ByteCode | Program, stdin:Input = None, stdout:Output = None) -> None:
+        super().__init__(bytecode, stdin, stdout)
+        self.stats:dict[str, int] = {"recorded": 0, "aborted": 0, "miss": 0, "dropped": 0}
+        self.traces:dict[int, str] = {}
+        """
+        The source of each trace, keyed by the loop header it replaces.
+        """
+
+    def bind(self, program:Program):
+        code = super().bind(program)
+        self.generic = list(code)
+        """
+        The interpreted handler of each instruction.
+        """
+        self.counters = [0] * len(code)
+        self.misses = [0] * len(code)
+        self.folded:dict[int, object] = None
+        """
+        The registers that are only ever written by the prelude, and the
+        constant they hold, found when the first loop is traced.
+        """
+        for i, (op, operands) in enumerate(program.code):
+            if op in bc.JUMPS and program.blocks[operands[0]] <= i:
+                code[i] = (self._back_edge, (i,))
+        return code
+
+    def _back_edge(self, i):
+        handler, operands = self.generic[i]
+        target = handler(*operands)
+        if target is not None:
+            self.counters[i] += 1
+            if self.counters[i] >= self.HOT:
+                self.code[i] = self.generic[i] # traced or not, the loop is not counted any more
+                return self.record(i, target)
+        return target
+
+    def record(self, back_edge:int, header:int):
+        """
+        Runs one iteration of the loop, recording the path it takes, and
+        installs its trace. Returns where the interpreter carries on.
+        """
+        if self.code[header] is not self.generic[header]:
+            self.stats["aborted"] += 1 # another loop already traced from here
+            return header
+        code = self.program.code
+        entry = [type(value) for value in self.regs]
+        path:list[tuple[int, int]] = []
+        seen:set[int] = set()
+        pc = header
+        while True:
+            if pc in seen or not header <= pc <= back_edge or code[pc][0] not in TRACEABLE or len(path) >= self.MAX_TRACE:
+                self.stats["aborted"] += 1 # nested loops, exits and long bodies are left to the interpreter
+                return pc
+            seen.add(pc)
+            handler, operands = self.generic[pc]
+            target = handler(*operands)
+            path.append((pc, target))
+            if pc == back_edge:
+                break
+            pc = pc + 1 if target is None else target
+        self.code[header] = (self.compile(header, path, entry), ())
+        self.stats["recorded"] += 1
+        return target
+
+    def constants(self):
+        """The registers only the prelude writes, with the constant it writes into them."""
+        program = self.program
+        defs:dict[int, int] = {}
+        for op, operands in program.code:
+            for reg in effects(op, operands)[1]:
+                defs[reg] = defs.get(reg, 0) + 1
+        return {
+            operands[0]: program.constants[operands[1]] for i, (op, operands) in enumerate(program.code)
+            if i < program.start and op in (bc.NUM, bc.STR) and defs[operands[0]] == 1
+        }
+
+    def compile(self, header:int, path:list[tuple[int, int]], entry:list[type]):
+        if self.folded is None:
+            self.folded = self.constants()
+        self.traces[header] = TraceCodegen(self.folded).trace(self.program, header, path, entry)
+        namespace = {"Rope": Rope}
+        exec(self.traces[header], namespace)
+        return namespace["make"](
+            self.regs, lambda: self.miss(header), self.stdin.readline, self.write,
+            self.stdout.flush, self.stdin.interactive, format_num, np, _load
+        )
+
+    def miss(self, header:int):
+        self.stats["miss"] += 1
+        self.misses[header] += 1
+        if self.misses[header] >= self.MAX_MISSES:
+            self.code[header] = self.generic[header]
+            self.stats["dropped"] += 1
+        handler, operands = self.generic[header]
+        return handler(*operands)
@@ -0,0 +1,233 @@
+"""
+Runs blocks of a program in a pool of processes, so one program can use
+every core, and the channels they talk over.
+
+A worker is the program bound to an executor in another process. It starts
+at the block it was spawned at, with a copy of the registers as they were
+then, so it only sees what the main program does afterwards through
+channels. It ends at a RET outside of any call, JOIN gets the value, or at
+the end of the code. What it writes to STDOUT is held until it is joined.
+
+At most one worker per core runs at once, the rest wait for a free process.
+Workers waiting on channels only count themselves in shared memory, the
+main program is the one that sees every worker and tells when they all
+wait on something that cannot happen.
+"""
+
+import multiprocessing
+import os
+import pickle
+import queue
+from concurrent.futures import Future, ProcessPoolExecutor
+from .decoder import Program
+from .channels import Input, Output
+from .rope import Rope
+
+class Channel:
+    """
+    A bounded queue of numbers and strings between a program and its
+    workers, SEND waits while it is full and RECV while it is empty.
+
+    The queue lives in a manager process, so a channel is handed to a
+    worker in its registers like any other value.
+    """
+    def __init__(self, queue) -> None:
+        self.queue = queue
+
+class Workers:
+    """
+    The workers a program spawned. The pool of processes they run in and
+    the manager that holds the channels are only started once needed.
+    """
+    POLL = 0.1
+    """
+    How often the main program checks on its workers while it waits on a channel or a worker, in seconds.
+    """
+    STUCK = 3
+    """
+    How many checks in a row every running worker has to be waiting on a
+    channel for the main program to give up, each of them tries again
+    in between.
+    """
+
+    def __init__(self, program:Program, worker:bool = False, waiting = None) -> None:
+        self.program = program
+        self.worker = worker
+        """
+        Whether these belong to a worker, which cannot spawn its own.
+        """
+        self.pool:ProcessPoolExecutor = None
+        self.size = os.cpu_count() or 1
+        """
+        How many workers run at once.
+        """
+        self.manager = None
+        self.tasks:list[Future] = []
+        """
+        Every worker spawned, SPAWN hands out its index in here. Joined ones are None.
+        """
+        self.waiting:multiprocessing.Value = waiting
+        """
+        How many workers are waiting on a channel, shared with them.
+        """
+
+    def channel(self, capacity:int | float):
+        if self.worker:
+            raise RuntimeError("Only the main program can make channels, not its workers.")
+        capacity = int(capacity)
+        if capacity < 1:
+            raise RuntimeError(f"A channel holds at least one value, not {capacity}.")
+        if self.manager is None:
+            self.manager = multiprocessing.Manager()
+        return Channel(self.manager.Queue(capacity))
+
+    def spawn(self, pc:int, regs:list):
+        """Starts a worker at pc with the registers, returning the worker."""
+        if self.worker:
+            raise RuntimeError("Only the main program can SPAWN, not its workers.")
+        if self.pool is None:
+            self.waiting = multiprocessing.Value("i", 0)
+            self.pool = ProcessPoolExecutor(self.size, initializer=_start, initargs=(self.program, self.waiting))
+        # pickled here and not by the pool, so the copy is taken now, and a
+        # worker only connects to the channels in it once it starts, which
+        # fails its task instead of its process when the manager is gone
+        snapshot = pickle.dumps([str(value) if type(value) is Rope else value for value in regs], pickle.HIGHEST_PROTOCOL)
+        self.tasks.append(self.pool.submit(_work, pc, snapshot))
+        return len(self.tasks) - 1
+
+    def send(self, channel:Channel, value):
+        if type(channel) is not Channel:
+            raise RuntimeError(f"SEND needs a channel, not {channel!r}.")
+        if type(value) is Rope:
+            value = str(value)
+        elif not isinstance(value, (int, float, str)):
+            raise RuntimeError(f"Only numbers and strings can be sent over a channel, not {type(value).__name__}.")
+        self.wait("SEND", lambda: channel.queue.put(value, timeout=self.POLL), queue.Full)
+
+    def recv(self, channel:Channel):
+        if type(channel) is not Channel:
+            raise RuntimeError(f"RECV needs a channel, not {channel!r}.")
+        return self.wait("RECV", lambda: channel.queue.get(timeout=self.POLL), queue.Empty)
+
+    def wait(self, name:str, attempt, busy:type):
+        """
+        Attempts a channel operation until it goes through. A worker counts
+        itself as waiting in between. The main program raises the error of
+        a worker that failed, and gives up once no worker is left to take
+        the other side, or every one left waits on a channel too.
+        """
+        try:
+            return attempt()
+        except busy:
+            pass
+        if self.worker:
+            with self.waiting.get_lock():
+                self.waiting.value += 1
+            try:
+                while True:
+                    try:
+                        return attempt()
+                    except busy:
+                        pass
+            finally:
+                with self.waiting.get_lock():
+                    self.waiting.value -= 1
+        stuck = 0
+        while True:
+            try:
+                stuck = self.check(name, stuck)
+                error = None
+            except RuntimeError as e:
+                error = e
+            try:
+                return attempt() # the last worker may have just taken its turn
+            except busy:
+                if error is not None:
+                    raise error from None
+
+    def check(self, name:str, stuck:int):
+        """
+        Raises the error of a failed worker, or when waiting on something
+        only the workers could do is sure to last forever. Returns how many
+        checks in a row every running worker was waiting on a channel.
+        """
+        running = 0
+        for task, future in enumerate(self.tasks):
+            if future is None:
+                continue
+            if not future.done():
+                running += 1
+            elif future.exception() is not None:
+                raise RuntimeError(f"Worker {task} failed: {future.exception()}")
+        if running == 0:
+            raise RuntimeError(f"{name} would wait forever, there are no workers left to take the other side.")
+        if self.waiting is None or self.waiting.value < min(running, self.size):
+            return 0
+        if stuck < self.STUCK:
+            return stuck + 1
+        if running > self.size:
+            raise RuntimeError(f"{name} would wait forever, every running worker waits on a channel while {running - self.size} "
+                f"more wait for a process to run in, at most {self.size} workers run at once.")
+        raise RuntimeError(f"{name} would wait forever, every worker left waits on a channel too.")
+
+    def result(self, task:int):
+        """Waits for the worker to end, returning what it returned and what it wrote to STDOUT."""
+        if type(task) is not int or not 0 <= task < len(self.tasks) or self.tasks[task] is None:
+            raise RuntimeError(f"{task!r} is not a worker that is still to be joined.")
+        future = self.tasks[task]
+
+        def attempt():
+            error = future.exception(self.POLL) # TimeoutError while it runs
+            if error is not None:
+                raise RuntimeError(f"Worker {task} failed: {error}") from error
+            return future.result()
+
+        try:
+            return self.wait("JOIN", attempt, TimeoutError)
+        finally:
+            self.tasks[task] = None
+
+    def join(self, task:int, write):
+        """Waits for the worker to end, writes out what it wrote to STDOUT and returns what it returned."""
+        value, output = self.result(task)
+        write(output)
+        return value
+
+    def join_all(self, write):
+        """Joins the workers that were never joined, in the order they were spawned."""
+        for task, future in enumerate(self.tasks):
+            if future is not None:
+                self.join(task, write)
+
+    def close(self):
+        # the channels go first, so workers still waiting on one fail instead of keeping the pool from shutting down
+        if self.manager is not None:
+            self.manager.shutdown()
+            self.manager = None
+        if self.pool is not None:
+            self.pool.shutdown(cancel_futures=True)
+            self.pool = None
+
+_executor = None
+"""
+The executor of a worker process, bound once for every worker it runs.
+"""
+
+def _start(program:Program, waiting:multiprocessing.Value):
+    global _executor
+    from .executor import Executor # which imports this module
+    _executor = Executor(program, Input([]), Output.memory())
+    _executor.workers = Workers(program, True, waiting)
+    _executor.regs.append(None) # what a RET outside of any call returns goes in here
+
+def _work(pc:int, snapshot:bytes):
+    executor = _executor
+    regs = pickle.loads(snapshot)
+    executor.regs[:len(regs)] = regs
+    executor.regs[-1] = None
+    executor.registers.frames.clear()
+    executor.registers.calls[:] = [(len(executor.code), len(regs), 0, 0, [])] # a call that returns past the end of the code
+    executor.stdout = Output.memory()
+    executor.write = executor.stdout.write
+    executor.run_from(pc)
+    return executor.regs[-1], executor.stdout.getvalue()
@@ -0,0 +1,28 @@
+import argparse
+import os
+import sys
+from .harness import Harness
+from .workloads import WORKLOADS
+
+BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+
+argp = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmarks every stage of the parser and the VM.")
+argp.add_argument("--workloads", default=",".join(WORKLOADS), help="the comma separated workloads to run (default all)")
+argp.add_argument("--repeat", type=int, default=7, help="timed runs per stage (default 7)")
+argp.add_argument("--baseline", default=BASELINE, help="the results to compare against (default benchmarks/baseline.json)")
+argp.add_argument("--threshold", type=float, default=0.25, help="how much slower a stage can get before it counts as a regression (default 0.25)")
+argp.add_argument("--save", metavar="PATH", help="write the results to PATH, pass the baseline's path to update it")
+args = argp.parse_args()
+
+harness = Harness(repeat=args.repeat, workloads=args.workloads.split(","))
+harness.run(log=sys.stdout)
+if args.save:
+    harness.save(args.save)
+
+if args.save != args.baseline and os.path.exists(args.baseline):
+    regressions = harness.gate(Harness.load(args.baseline), args.threshold)
+    for key, metric, before, after in regressions:
+        print(f"regression: {key} {metric} {before} -> {after} ({after / max(before, 1) - 1:+.0%})")
+    if regressions:
+        sys.exit(1)
+    print("no regressions against the baseline")
@@ -0,0 +1,163 @@
+import gc
+import json
+import statistics
+import time
+import tracemalloc
+from ASM_LANG import Parser
+from VM import Decoder, Executor, Input, Output
+from .workloads import WORKLOADS
+
+STAGES = ("tokenize", "emit", "decode", "bind", "execute")
+"""
+tokenize    splitting the source into instruction parts (Parser.tokenize)
+emit        writing the bytecode through the BytecodeBuilder (Parser.emit)
+decode      turning the bytecode into a Program (Decoder.decode)
+bind        the executor's pre-scan, binding handlers and resolving jumps
+execute     running the program with scripted STDIN and a captured STDOUT
+"""
+
+class Harness:
+    """Times every stage of every workload and compares them against a baseline."""
+
+    def __init__(self, repeat:int = 7, warmup:int = 1, workloads:list[str] = None) -> None:
+        self.repeat = repeat
+        self.warmup = warmup
+        self.workloads = list(WORKLOADS if workloads is None else workloads)
+        for name in self.workloads:
+            if name not in WORKLOADS:
+                raise RuntimeError(f"Unknown workload {name}.")
+        self.results:dict[str, dict] = {}
+        """
+        Each "workload/size/stage" is associated with its timings and memory peak.
+        """
+
+    def stages(self, src:str, stdin:str):
+        """
+        Yields each stage as a (name, setup, run) triple, setup builds the
+        input of the stage outside of the timed region.
+        """
+        yield "tokenize", lambda: Parser(src), lambda parser: parser.tokenize()
+        tokens = Parser(src).tokenize()
+        yield "emit", lambda: Parser(src), lambda parser: parser.emit(tokens)
+        bytecode = Parser(src).emit(tokens).src
+        yield "decode", lambda: Decoder(bytecode), lambda decoder: decoder.decode()
+        program = Decoder(bytecode).decode()
+        yield "bind", lambda: program, lambda program: Executor(program, Input.text(stdin), Output.memory())
+        yield "execute", lambda: Executor(program, Input.text(stdin), Output.memory()), lambda executor: executor.run({})
+
+    def calibrate(self):
+        """
+        Times a fixed piece of pure Python, so timings taken while the
+        machine runs slower or faster can still be compared.
+        """
+        times:list[int] = []
+        for _ in range(5):
+            began = time.perf_counter_ns()
+            total = 0
+            for i in range(20_000):
+                total += i
+            times.append(time.perf_counter_ns() - began)
+        return min(times)
+
+    def measure(self, setup, run):
+        calibration = self.calibrate()
+        times:list[int] = []
+        for n in range(self.warmup + self.repeat):
+            state = setup()
+            gc.collect()
+            gc.disable() # a collection landing in one run skews it, like timeit
+            try:
+                began = time.perf_counter_ns()
+                run(state)
+                elapsed = time.perf_counter_ns() - began
+            finally:
+                gc.enable()
+            if n >= self.warmup:
+                times.append(elapsed)
+
+        # tracing slows everything down, so the peak comes from a run of its own
+        state = setup()
+        tracemalloc.start()
+        try:
+            run(state)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+
+        times.sort()
+        quartiles = statistics.quantiles(times, n=4) if len(times) > 1 else [times[0]] * 3
+        return {
+            "calibration_ns": min(calibration, self.calibrate()),
+            "median_ns": int(statistics.median(times)),
+            "min_ns": times[0],
+            "iqr_ns": int(quartiles[2] - quartiles[0]),
+            "peak_bytes": peak,
+        }
+
+    def run(self, log=None):
+        for name in self.workloads:
+            workload, sizes = WORKLOADS[name]
+            for size in sizes:
+                src, stdin = workload(size)
+                lines = src.count("\n") + 1
+                for stage, setup, run in self.stages(src, stdin):
+                    key = f"{name}/{size}/{stage}"
+                    self.results[key] = self.measure(setup, run)
+                    if log is not None:
+                        result = self.results[key]
+                        # the parser's stages also get their throughput, in source lines per second
+                        throughput = f" {lines / result['median_ns'] * 1e9:>12,.0f} lines/s" if stage in ("tokenize", "emit") else ""
+                        print(f"{key:<32} {result['median_ns'] / 1_000_000:>10.3f} ms "
+                              f"± {result['iqr_ns'] / 1_000_000:<8.3f} {result['peak_bytes'] / 1024:>10.1f} KiB{throughput}", file=log)
+        return self.results
+
+    def remeasure(self, key:str):
+        """Measures a single "workload/size/stage" again, keeping whichever run was faster."""
+        name, size, stage = key.split("/")
+        workload, _ = WORKLOADS[name]
+        for current, setup, run in self.stages(*workload(int(size))):
+            if current == stage:
+                result = self.measure(setup, run)
+                if result["min_ns"] / result["calibration_ns"] < self.results[key]["min_ns"] / self.results[key]["calibration_ns"]:
+                    self.results[key] = result
+                return
+
+    def gate(self, baseline:dict[str, dict], threshold:float = 0.25):
+        """
+        Compares against the baseline, measuring whatever looks like a
+        regression once more so a single noisy run does not fail the gate.
+        """
+        for key in {key for key, *_ in self.compare(baseline, threshold)}:
+            self.remeasure(key)
+        return self.compare(baseline, threshold)
+
+    def compare(self, baseline:dict[str, dict], threshold:float = 0.25, floor_ns:int = 50_000):
+        """
+        Returns the results that got slower or hungrier than the baseline
+        by more than the threshold, as (key, metric, before, after).
+
+        Timings are compared on their fastest run, which noise from the
+        rest of the machine only ever adds to, scaled by the calibration
+        taken alongside it. Changes below floor_ns are taken as noise.
+        """
+        regressions = []
+        for key, result in self.results.items():
+            if key not in baseline:
+                continue
+            before = baseline[key]
+            expected = before["min_ns"] * result["calibration_ns"] / before["calibration_ns"]
+            slower = result["min_ns"] - expected
+            if slower > floor_ns and slower > expected * threshold:
+                regressions.append((key, "min_ns", int(expected), result["min_ns"]))
+            if result["peak_bytes"] > before["peak_bytes"] * (1 + threshold) + 4096:
+                regressions.append((key, "peak_bytes", before["peak_bytes"], result["peak_bytes"]))
+        return regressions
+
+    def save(self, path:str):
+        with open(path, "w") as f:
+            json.dump(self.results, f, indent=4, sort_keys=True)
+
+    @staticmethod
+    def load(path:str) -> dict[str, dict]:
+        with open(path) as f:
+            return json.load(f)
@@ -0,0 +1,171 @@
+"""
+Programs the benchmarks run, as functions of a size that return
+the source and the scripted STDIN it reads.
+"""
+
+import os
+
+TESTS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "integration_tests")
+
+SCRIPTS = {
+    "t1": "",
+    "t2": "bob\n",
+    "t3": "3\n4\n",
+    "t4": "",
+    "t5": "",
+    "t7": "",
+    "calculator": "5\n+\n3\n*\n2\n-\n1.5\n/\n4\n=\n",
+}
+"""
+The STDIN each integration test gets.
+"""
+
+def integration(name:str):
+    def workload(size:int):
+        with open(os.path.join(TESTS, f"{name}.pasm")) as f:
+            return f.read(), SCRIPTS[name]
+    return workload
+
+def deep_loop(size:int):
+    """A tight counting loop of size iterations."""
+    return f"""
+NUM i 0
+NUM n {size}
+NUM one 1
+START
+    BLOCK loop
+        ADD i i one
+        LT again i n
+    COND_JUMP loop again
+    CAST_STR out i
+    STDOUT out
+""", ""
+
+def long_strings(size:int):
+    """Grows a string by concatenation, size times."""
+    return f"""
+NUM i 0
+NUM n {size}
+NUM one 1
+STR s ""
+STR piece "0123456789"
+START
+    BLOCK loop
+        ADD s s piece
+        ADD i i one
+        LT again i n
+    COND_JUMP loop again
+    STDOUT s
+""", ""
+
+def wide_fmt(size:int):
+    """Formats size numbers into one string, a hundred times."""
+    nums = "\n".join(f"NUM v{i} {i}" for i in range(size))
+    args = " ".join(f"v{i}" for i in range(size))
+    return f"""
+{nums}
+NUM i 0
+NUM n 100
+NUM one 1
+STR template "{'{} ' * size}\\n"
+START
+    BLOCK loop
+        FMT msg template {args}
+        STDOUT msg
+        ADD i i one
+        LT again i n
+    COND_JUMP loop again
+""", ""
+
+def many_vars(size:int):
+    """Declares size variables and sums them in one long straight line."""
+    nums = "\n".join(f"NUM v{i} {i}" for i in range(size))
+    adds = "\n".join(f"ADD acc acc v{i}" for i in range(size))
+    return f"""
+{nums}
+NUM acc 0
+START
+{adds}
+CAST_STR out acc
+STDOUT out
+""", ""
+
+def calls(size:int):
+    """deep_loop with the increment in a function, so the difference between the two is the cost of size calls."""
+    return f"""
+NUM i 0
+NUM n {size}
+NUM one 1
+FUNC inc x
+    ADD y x one
+    RET y
+END_FUNC
+START
+    BLOCK loop
+        CALL i inc i
+        LT again i n
+    COND_JUMP loop again
+    CAST_STR out i
+    STDOUT out
+""", ""
+
+def recursion(size:int):
+    """Sums 1 to size recursively, so there are size calls in progress at the deepest point, ten times over."""
+    return f"""
+NUM zero 0
+NUM one 1
+NUM n {size}
+NUM i 0
+NUM ten 10
+FUNC sum k
+    EQ last k zero
+    COND_JUMP bottom last
+    SUB j k one
+    CALL rest sum j
+    ADD total rest k
+    RET total
+    BLOCK bottom
+    RET zero
+END_FUNC
+START
+    BLOCK loop
+        CALL s sum n
+        ADD i i one
+        LT again i ten
+    COND_JUMP loop again
+    CAST_STR out s
+    STDOUT out
+""", ""
+
+def big_source(size:int):
+    """A generated program of about size lines, mostly straight line code with some strings, comments and forward jumps."""
+    lines = ["# generated", "NUM zero 0", "NUM one 1", 'STR sep ", "', "START"]
+    for i in range(size // 10):
+        lines += [
+            "",
+            f"    # chunk {i}",
+            f"    NUM a{i} {i}",
+            f"    ADD b{i} a{i} one",
+            f"    MUL b{i} b{i} a{i}",
+            f"    GT skip{i} b{i} zero",
+            f"    COND_JUMP done{i} skip{i}",
+            f'    STR s{i} "chunk \\"{i}\\"\\t{{}}{{}}{{}}\\n"',
+            f"    FMT s{i} s{i} a{i} sep b{i}",
+            f"    BLOCK done{i}",
+        ]
+    lines += ['    STR end "done\\n"', "    STDOUT end"]
+    return "\n".join(lines) + "\n", ""
+
+WORKLOADS = {
+    **{name: (integration(name), (1,)) for name in SCRIPTS},
+    "deep_loop": (deep_loop, (1_000, 10_000, 100_000)),
+    "long_strings": (long_strings, (100, 1_000, 5_000)),
+    "wide_fmt": (wide_fmt, (10, 100, 1_000)),
+    "many_vars": (many_vars, (100, 1_000, 10_000)),
+    "calls": (calls, (1_000, 10_000, 100_000)),
+    "recursion": (recursion, (100, 1_000, 10_000)),
+    "big_source": (big_source, (1_000, 10_000, 100_000)),
+}
+"""
+Each workload is associated with its generator and the sizes it runs at.
+"""
@@ -1,8 +1,121 @@
+import os
 import sys
-from ASM_LANG import Parser
+import json
+import argparse
+from ASM_LANG import Parser, CompileCache, IncrementalCompiler
+from VM import Executor, AdaptiveExecutor, TracingExecutor, BatchExecutor, CompiledExecutor, Optimizer, Profiler, Input, Output, binary
+from VM import bytecodes as bc
 import time
 
-with open(sys.argv[1], "r") as srcf:
-    t1 = time.time_ns()
-    Parser(srcf.read()).run()
-    print(f"finished:{(time.time_ns() - t1)/1_000_000} ms")
\ No newline at end of file
+argp = argparse.ArgumentParser(description="Compiles and runs a .pasm program.")
+argp.add_argument("src", help="the .pasm file to run, or a .pasmc file written by --emit")
+argp.add_argument("--no-cache", action="store_true", help="always compile from source instead of using __pasmcache__")
+argp.add_argument("--emit", metavar="PATH",
+    help="compile the program into PATH in the compiled format and exit, streaming the source so memory stays bounded however long it is")
+argp.add_argument("-O", "--optimize", action="store_true", help="optimize the program before running it")
+argp.add_argument("--passes", default=",".join(Optimizer.PASSES),
+    help=f"the comma separated optimization passes -O runs (default {','.join(Optimizer.PASSES)})")
+argp.add_argument("--adaptive", action="store_true", help="specialize instructions on the operand types they see while running")
+argp.add_argument("--jit", action="store_true", help="compile hot loops into Python while running, from a trace of one iteration")
+argp.add_argument("--profile", metavar="PATH", help="profile the run and write counts and time per opcode, block, line and instruction pair as JSON")
+argp.add_argument("--flamegraph", metavar="PATH", help="profile the run and write it in the collapsed stack format of flamegraph tools")
+argp.add_argument("--input", metavar="PATH", help="read STDIN lines from PATH instead of the terminal")
+argp.add_argument("--output", metavar="PATH", help="write STDOUT to PATH")
+argp.add_argument("--flush", choices=Output.POLICIES,
+    help="when buffered STDOUT is flushed (default line for terminals, full otherwise)")
+argp.add_argument("--codegen", action="store_true", help="compile the program to Python and run that instead of interpreting it")
+argp.add_argument("--batch", metavar="PATH",
+    help="run the program once per line of PATH, a JSON string holding that run's STDIN, in lock step; prints each run's STDOUT as a JSON line")
+argp.add_argument("--watch", action="store_true",
+    help="keep running the program again every time its source changes, recompiling only the blocks that changed")
+args = argp.parse_args()
+if args.watch and args.src.endswith(".pasmc"):
+    argp.error("--watch needs a .pasm source")
+if args.codegen and (args.profile or args.flamegraph):
+    argp.error("--codegen cannot be profiled, the compiled program does not go through the interpreter's loop")
+if args.batch and (args.profile or args.flamegraph):
+    argp.error("--batch cannot be profiled, its runs go through the batch executor's own loop")
+
+def run(program):
+    if args.optimize:
+        optimizer = Optimizer(args.passes.split(","))
+        program = optimizer.optimize(program)
+        print(optimizer.report(), file=sys.stderr)
+    if (args.codegen or args.batch) and any(op in bc.PARALLEL for op, _ in program.code):
+        message = f"{'--codegen' if args.codegen else '--batch'} cannot run programs that use workers"
+        if args.watch:
+            raise RuntimeError(message) # printed, the watch goes on
+        argp.error(message)
+    if args.batch:
+        with open(args.batch) as f:
+            inputs = [json.loads(line) for line in f if line.strip()]
+        batch = BatchExecutor(program, [Input.text(text) for text in inputs])
+        batch.run({})
+        for stdout in batch.stdouts:
+            print(json.dumps(stdout.getvalue()))
+        return
+    profiler = Profiler(program) if args.profile or args.flamegraph else None
+    stdin = Input.file(args.input) if args.input else Input.stdin()
+    stdout = Output.file(args.output, args.flush or "full") if args.output else Output.stdout(args.flush)
+    if args.codegen:
+        executor = CompiledExecutor(program, stdin, stdout, os.path.join(os.path.dirname(os.path.abspath(args.src)), "__pasmcache__"))
+    elif args.jit:
+        executor = TracingExecutor(program, stdin, stdout)
+    else:
+        executor = (AdaptiveExecutor if args.adaptive else Executor)(program, stdin, stdout)
+    try:
+        executor.run({}, profiler)
+    finally:
+        stdout.close()
+    if profiler is not None:
+        print(profiler.report(), file=sys.stderr)
+        if args.profile:
+            profiler.dump_json(args.profile)
+        if args.flamegraph:
+            profiler.dump_collapsed(args.flamegraph)
+
+def watch():
+    """Runs the program every time its source changes until interrupted, errors are printed instead of ending the watch."""
+    compiler = IncrementalCompiler()
+    mtime = None
+    while True:
+        try:
+            changed = os.stat(args.src).st_mtime_ns
+        except OSError:
+            changed = mtime # being replaced by an editor
+        if changed == mtime:
+            time.sleep(0.1)
+            continue
+        mtime = changed
+        t1 = time.time_ns()
+        try:
+            with open(args.src, encoding="utf-8") as srcf:
+                program = compiler.compile(srcf.read())
+            print(f"recompiled {compiler.compiled} of {compiler.total} blocks:{(time.time_ns() - t1)/1_000_000} ms", file=sys.stderr)
+            run(program)
+            print(f"finished:{(time.time_ns() - t1)/1_000_000} ms")
+        except Exception as e:
+            print(f"error: {e}" if isinstance(e, (OSError, RuntimeError)) else f"error: {type(e).__name__}: {e}", file=sys.stderr)
+        compiler.warm() # while there is nothing else to do
+        print(f"watching {args.src}, Ctrl-C to stop", file=sys.stderr)
+
+t1 = time.time_ns()
+if args.emit:
+    with open(args.src, encoding="utf-8") as srcf, open(args.emit, "wb") as f:
+        Parser(srcf).stream(f)
+    print(f"compiled:{(time.time_ns() - t1)/1_000_000} ms")
+    sys.exit(0)
+if args.watch:
+    try:
+        watch()
+    except KeyboardInterrupt:
+        sys.exit(0)
+if args.src.endswith(".pasmc"):
+    program = binary.load(args.src)
+elif args.no_cache:
+    with open(args.src, encoding="utf-8") as srcf:
+        program = Parser(srcf).compile()
+else:
+    program = CompileCache().compile(args.src)
+run(program)
+print(f"finished:{(time.time_ns() - t1)/1_000_000} ms")
@@ -0,0 +1,190 @@
+"""
+Runs many independent .pasm jobs across a process pool.
+
+A job is a program and the STDIN it gets. Every program is compiled once,
+up front, and the compiled programs are put in one block of shared memory
+that the workers decode them from, so nothing is parsed or pickled per job.
+"""
+
+import sys
+import os
+import math
+import json
+import time
+import argparse
+import multiprocessing
+from multiprocessing import shared_memory
+from ASM_LANG import CompileCache
+from VM import Executor, Optimizer, Input, Output, Program, binary
+from VM import bytecodes as bc
+
+def jobs_from_directory(directory:str):
+    """One job per .pasm file, reading STDIN from the .in file next to it if there is one."""
+    for name in sorted(os.listdir(directory)):
+        stem, ext = os.path.splitext(name)
+        if ext != ".pasm":
+            continue
+        stdin = ""
+        if os.path.exists(os.path.join(directory, f"{stem}.in")):
+            with open(os.path.join(directory, f"{stem}.in")) as f:
+                stdin = f.read()
+        yield {"id": stem, "src": os.path.join(directory, name), "stdin": stdin}
+
+def jobs_from_manifest(lines, base:str = "."):
+    """
+    One job per JSON line, {"id": ..., "src": path, "stdin": text} or
+    {"input": path} instead of "stdin". Paths are relative to base.
+    """
+    for n, line in enumerate(lines):
+        if not line.strip():
+            continue
+        job = json.loads(line)
+        job.setdefault("id", n)
+        job["src"] = os.path.join(base, job["src"])
+        if "input" in job:
+            with open(os.path.join(base, job.pop("input"))) as f:
+                job["stdin"] = f.read()
+        job.setdefault("stdin", "")
+        yield job
+
+def percentile(values:list[int], p:float):
+    """The nearest rank percentile of sorted values."""
+    if not values:
+        return 0
+    return values[max(0, math.ceil(p / 100 * len(values)) - 1)]
+
+class Programs:
+    """The compiled programs of a run, laid out back to back in shared memory."""
+    def __init__(self, programs:dict[str, Program]) -> None:
+        blobs = {src: binary.dumps(program) for src, program in programs.items()}
+        self.offsets:dict[str, tuple[int, int]] = {}
+        """
+        Each program is associated with where its compiled form starts and ends in the block.
+        """
+        size = 0
+        for src, blob in blobs.items():
+            self.offsets[src] = (size, size + len(blob))
+            size += len(blob)
+        self.memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        for src, blob in blobs.items():
+            start, end = self.offsets[src]
+            self.memory.buf[start:end] = blob
+
+    def close(self):
+        self.memory.close()
+        self.memory.unlink()
+
+_memory:shared_memory.SharedMemory = None
+_offsets:dict[str, tuple[int, int]] = {}
+_programs:dict[str, Program] = {}
+"""
+Each worker's view of the shared programs, and the ones it decoded so far.
+"""
+
+def _attach(name:str, offsets:dict[str, tuple[int, int]]):
+    global _memory, _offsets
+    _memory = shared_memory.SharedMemory(name=name)
+    _offsets = offsets
+
+def _run(job:dict):
+    src = job["src"]
+    if src not in _programs:
+        start, end = _offsets[src]
+        _programs[src] = binary.loads(_memory.buf[start:end])
+    stdout = Output.memory()
+    error = None
+    began = time.perf_counter_ns()
+    try:
+        Executor(_programs[src], Input.text(job["stdin"]), stdout).run({})
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    latency = time.perf_counter_ns() - began
+    return {"id": job["id"], "stdout": stdout.getvalue(), "error": error, "latency_ns": latency}
+
+class Runner:
+    """Runs jobs across a process pool and keeps their results and timings."""
+    def __init__(self, workers:int = None, chunksize:int = 16, optimize:bool = False) -> None:
+        self.workers = workers or os.cpu_count()
+        self.chunksize = chunksize
+        self.optimize = optimize
+        self.latencies:list[int] = []
+        self.jobs = 0
+        self.failed = 0
+        self.elapsed = 0
+
+    def compile(self, jobs:list[dict]):
+        """Compiles the source of every job, returning the programs and the errors of the sources that did not compile."""
+        cache = CompileCache()
+        programs:dict[str, Program] = {}
+        errors:dict[str, str] = {}
+        for job in jobs:
+            if job["src"] not in programs and job["src"] not in errors:
+                try:
+                    program = cache.compile(job["src"])
+                    for op, _ in program.code:
+                        if op in bc.PARALLEL:
+                            # the pool's processes are daemons, which cannot start the processes workers run in
+                            raise RuntimeError(f"{bc.OPNAMES[op]} cannot run under the runner, its jobs already run in worker processes.")
+                    programs[job["src"]] = Optimizer().optimize(program) if self.optimize else program
+                except Exception as e:
+                    errors[job["src"]] = f"{type(e).__name__}: {e}"
+        return programs, errors
+
+    def run(self, jobs:list[dict]):
+        """Yields the result of every job, in the order they finish. Jobs whose source did not compile fail first."""
+        began = time.perf_counter_ns()
+        programs, errors = self.compile(jobs)
+        for job in jobs:
+            if job["src"] in errors:
+                self.jobs += 1
+                self.failed += 1
+                yield {"id": job["id"], "stdout": "", "error": errors[job["src"]], "latency_ns": 0}
+        jobs = [job for job in jobs if job["src"] in programs]
+        programs = Programs(programs)
+        try:
+            with multiprocessing.Pool(self.workers, _attach, (programs.memory.name, programs.offsets)) as pool:
+                for result in pool.imap_unordered(_run, jobs, self.chunksize):
+                    self.latencies.append(result["latency_ns"])
+                    self.jobs += 1
+                    self.failed += result["error"] is not None
+                    yield result
+        finally:
+            programs.close()
+            self.elapsed = time.perf_counter_ns() - began
+
+    def report(self):
+        latencies = sorted(self.latencies)
+        rows = [
+            f"jobs: {self.jobs} ({self.failed} failed) on {self.workers} workers in {self.elapsed / 1e9:.3f} s, "
+            f"{self.jobs / max(self.elapsed / 1e9, 1e-9):.1f} jobs/s",
+            "latency: " + ", ".join(f"p{p} {percentile(latencies, p) / 1e6:.3f} ms" for p in (50, 90, 99))
+            + f", max {latencies[-1] / 1e6 if latencies else 0:.3f} ms",
+        ]
+        return "\n".join(rows)
+
+if __name__ == "__main__":
+    argp = argparse.ArgumentParser(description="Runs many .pasm jobs across a process pool.")
+    argp.add_argument("jobs", help="a directory of .pasm files (with optional .in files), a JSON lines manifest, or - for a manifest on STDIN")
+    argp.add_argument("-j", "--workers", type=int, default=None, help="the number of worker processes (default one per core)")
+    argp.add_argument("--chunksize", type=int, default=16, help="jobs handed to a worker at a time (default 16)")
+    argp.add_argument("-O", "--optimize", action="store_true", help="optimize every program before running it")
+    argp.add_argument("--results", metavar="PATH", help="write the results as JSON lines to PATH instead of STDOUT")
+    args = argp.parse_args()
+
+    if args.jobs == "-":
+        jobs = list(jobs_from_manifest(sys.stdin))
+    elif os.path.isdir(args.jobs):
+        jobs = list(jobs_from_directory(args.jobs))
+    else:
+        with open(args.jobs) as f:
+            jobs = list(jobs_from_manifest(f, os.path.dirname(args.jobs)))
+
+    runner = Runner(args.workers, args.chunksize, args.optimize)
+    results = open(args.results, "w") if args.results else sys.stdout
+    try:
+        for result in runner.run(jobs):
+            results.write(json.dumps(result) + "\n")
+    finally:
+        if results is not sys.stdout:
+            results.close()
+    print(runner.report(), file=sys.stderr)